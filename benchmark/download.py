@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import http.server
+import pathlib
+import queue
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, NamedTuple
+sys.path.insert(0, pathlib.Path(__file__).resolve().parents[1].as_posix())
+from slackbot.action import download  # noqa: E402
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    size = 0
+    block = b'\0' * (1024 * 1024)
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        remaining = self.size
+        while remaining > 0:
+            data = self.block[:min(remaining, len(self.block))]
+            self.wfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class Result(NamedTuple):
+    name: str
+    size: int
+    wall_time: float
+    cpu_time: float
+
+    def __str__(self) -> str:
+        return '{0:<24} {1:8.1f} MB/s {2:8.3f} CPU s/GB'.format(
+                self.name,
+                self.size / self.wall_time / 1e6,
+                self.cpu_time / (self.size / 1e9))
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(
+        name: str,
+        url: str,
+        size: int,
+        directory: pathlib.Path,
+        option: Dict[str, Any]) -> Result:
+    report_queue: 'queue.Queue[download.Report[None]]' = queue.Queue()
+    path = directory.joinpath(name)
+    thread_option = download.ThreadOption.option_list(name='').parse(option)
+    start_time = time.perf_counter()
+    start_cpu = _cpu_time()
+    download._thread._download(
+            url=url,
+            path=path,
+            info=None,
+            report_queue=report_queue,
+            option=thread_option)
+    cpu_time = _cpu_time() - start_cpu
+    wall_time = time.perf_counter() - start_time
+    while not report_queue.empty():
+        report = report_queue.get()
+        if report.type is download.ReportType.ERROR:
+            raise RuntimeError(report.error)
+        if report.saved_path is not None:
+            report.saved_path.unlink()
+    return Result(name, size, wall_time, cpu_time)
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser(
+            description='benchmark of the download thread')
+    argument_parser.add_argument(
+            '--size',
+            type=int,
+            default=256,
+            help='file size (MiB)')
+    args = argument_parser.parse_args()
+    size = args.size * 1024 * 1024
+    # local http server
+    _Handler.size = size
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/'.format(server.server_port)
+    cases = [
+        ('chunk_size=1KiB', {'chunk_size': 1024}),
+        ('chunk_size=64KiB', {'chunk_size': 64 * 1024}),
+        ('buffered', {'buffered': True}),
+        ('buffered,no-preallocate', {'buffered': True,
+                                     'preallocate': False})]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, option in cases:
+            print(measure(name, url, size, pathlib.Path(directory), option))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from ._action import Action, escape_text, unescape_text
+from ._action import (
+        Action, Token, TokenType, escape_text, tokenize, unescape_text)
 from ._core import create
 from ._option import Option, OptionError, OptionList
+from ._outbox import Outbox, OutboxOption
+from ._rate_limit import RateLimiter, RateLimits
 from ._team import Channel, ChannelList, Team, User, UserList
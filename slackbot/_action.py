@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import enum
+import functools
 import logging
-from typing import Callable, Generic, NamedTuple, Optional, TypeVar
+import re
+from typing import (
+        Callable, Generic, List, NamedTuple, Optional, Tuple, TypeVar)
 import slack
 from ._option import OptionList
+from ._outbox import Outbox
+from ._rate_limit import RateLimits
 from ._team import Team
 
 
@@ -15,6 +21,10 @@ class NoneOption(NamedTuple):
 
 
 _team = Team()
+# rate budget shared by the actions on the core event loop
+_rate_limits = RateLimits(rate=50. / 60., max_rate=50. / 60.)
+# outgoing messages of the actions
+_outbox = Outbox()
 
 
 class Action(Generic[OptionType]):
@@ -31,6 +41,8 @@ class Action(Generic[OptionType]):
         self._name = name
         self._option = option
         self._team = _team
+        self._rate_limits = _rate_limits
+        self._outbox = _outbox
 
     def register(self) -> None:
         pass
@@ -53,6 +65,14 @@ class Action(Generic[OptionType]):
     def team(self) -> Team:
         return self._team
 
+    @property
+    def rate_limits(self) -> RateLimits:
+        return self._rate_limits
+
+    @property
+    def outbox(self) -> Outbox:
+        return self._outbox
+
     @staticmethod
     def option_list(name: str) -> OptionList:
         return OptionList(NoneOption, name, [])
@@ -68,13 +88,75 @@ class Action(Generic[OptionType]):
                 callback=callback)
 
 
+_escape_table = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_entities = {'amp': '&', 'lt': '<', 'gt': '>'}
+_entity_regex = re.compile(r'&(amp|lt|gt);')
+
+
 def escape_text(string: str) -> str:
-    return (string.replace('&', '&amp;')
-                  .replace('>', '&gt;')
-                  .replace('<', '&lt;'))
+    return string.translate(_escape_table)
 
 
 def unescape_text(string: str) -> str:
-    return (string.replace('&amp;', '&')
-                  .replace('&gt;', '>')
-                  .replace('&lt;', '<'))
+    return _entity_regex.sub(lambda match: _entities[match.group(1)], string)
+
+
+class TokenType(enum.Enum):
+    TEXT = enum.auto()
+    USER = enum.auto()
+    CHANNEL = enum.auto()
+    SPECIAL = enum.auto()
+    URL = enum.auto()
+
+
+class Token(NamedTuple):
+    type: TokenType
+    # unescaped source of the token
+    text: str
+    # TEXT: text, USER & CHANNEL: id, SPECIAL: command, URL: url
+    value: str
+    label: Optional[str] = None
+
+
+# markup <...> or an entity, the rest is plain text
+_token_regex = re.compile(r'<(?P<markup>[^<>]*)>|&(?P<entity>amp|lt|gt);')
+_markup_types = {'@': TokenType.USER,
+                 '#': TokenType.CHANNEL,
+                 '!': TokenType.SPECIAL}
+
+
+@functools.lru_cache(maxsize=1024)
+def tokenize(string: str) -> Tuple[Token, ...]:
+    # a message is tokenized at most once for all the actions
+    tokens: List[Token] = []
+    text: List[str] = []
+    position = 0
+    for match in _token_regex.finditer(string):
+        text.append(string[position:match.start()])
+        position = match.end()
+        entity = match.group('entity')
+        if entity is not None:
+            text.append(_entities[entity])
+            continue
+        if any(text):
+            plain = ''.join(text)
+            tokens.append(Token(type=TokenType.TEXT, text=plain, value=plain))
+        text.clear()
+        tokens.append(_markup_token(match.group('markup')))
+    text.append(string[position:])
+    if any(text):
+        plain = ''.join(text)
+        tokens.append(Token(type=TokenType.TEXT, text=plain, value=plain))
+    return tuple(tokens)
+
+
+def _markup_token(markup: str) -> Token:
+    # <@U123|name>, <#C123|name>, <!here>, <https://example.com|label>
+    target, separator, label = markup.partition('|')
+    token_type = _markup_types.get(target[:1], TokenType.URL)
+    return Token(
+            type=token_type,
+            text='<{0}>'.format(unescape_text(markup)),
+            value=unescape_text(
+                    target if token_type is TokenType.URL else target[1:]),
+            label=unescape_text(label) if separator else None)
@@ -16,12 +16,15 @@ import slack
 import yaml
 from ._action import Action
 from ._option import Option, OptionList, OptionParser
+from ._outbox import OutboxOption
 from ._update_team import UpdateTeam, UpdateTeamOption
 
 
 class CoreOption(NamedTuple):
     token_file: pathlib.Path
     interval: float
+    rate_limit: float
+    outbox: OutboxOption
     team: UpdateTeamOption
 
     @staticmethod
@@ -39,6 +42,14 @@ class CoreOption(NamedTuple):
                     default=1.0,
                     type=float,
                     help='interval seconds to read real time messaging API'),
+             Option('rate_limit',
+                    default=50.0,
+                    type=float,
+                    help='maximum requests per minute of each slack api method'
+                         ' shared by the actions on the event loop'),
+             OutboxOption.option_list(
+                    name='outbox',
+                    help='outgoing messages of the actions'),
              UpdateTeamOption.option_list(
                     name='team',
                     help='update team info')],
@@ -66,6 +77,10 @@ class Core(Action[CoreOption]):
                 option=self.option.team,
                 logger=self._logger.getChild('UpdateTeam'))
         self._action_dict = action_dict or {}
+        self.rate_limits.configure(
+                rate=self.option.rate_limit / 60.,
+                max_rate=self.option.rate_limit / 60.)
+        self.outbox.configure(self.option.outbox)
 
     def token(self) -> str:
         if self._token is None:
@@ -96,6 +111,7 @@ class Core(Action[CoreOption]):
             self._rtm_client.stop()
         for action in self._action_dict.values():
             action.stop()
+        self.outbox.stop()
 
     def register(self) -> None:
         self._update_team.register()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import logging
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+import slack
+from ._option import Option, OptionList
+from ._rate_limit import RateLimits
+
+
+class OutboxOption(NamedTuple):
+    interval: float
+    merge_window: float
+    max_length: int
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['OutboxOption']:
+        return OptionList(
+            OutboxOption,
+            name,
+            [Option('interval',
+                    default=1.0,
+                    type=float,
+                    help='interval seconds of messages in each channel'),
+             Option('merge_window',
+                    default=0.5,
+                    type=float,
+                    help='seconds to wait for messages to be merged'
+                         ' into one post'),
+             Option('max_length',
+                    default=4000,
+                    type=int,
+                    help='maximum length of a merged message')],
+            help=help)
+
+
+class _Message(NamedTuple):
+    client: slack.WebClient
+    text: str
+    params: Dict[str, Any]
+    coalesce: bool
+    time: float
+    future: 'asyncio.Future[str]'
+
+    def key(self) -> Tuple[Tuple[str, Any], ...]:
+        return tuple(sorted(self.params.items()))
+
+
+class Outbox:
+    # outgoing messages: ordered & paced in each channel
+    def __init__(
+            self,
+            option: Optional[OutboxOption] = None,
+            logger: Optional[logging.Logger] = None) -> None:
+        self._logger = logger or logging.getLogger(__name__)
+        self._queues: Dict[str, Deque[_Message]] = {}
+        self._workers: Dict[str, asyncio.Future] = {}
+        self.configure(option or OutboxOption.option_list('').parse())
+
+    def configure(self, option: OutboxOption) -> None:
+        self._option = option
+        # slack allows about one message per second in each channel
+        rate = 1. / max(option.interval, 1e-3)
+        self._rate_limits = RateLimits(
+                rate=rate,
+                max_rate=rate,
+                logger=self._logger)
+
+    def post(
+            self,
+            client: slack.WebClient,
+            channel: str,
+            text: str,
+            params: Optional[Dict[str, Any]] = None,
+            coalesce: bool = True) -> 'asyncio.Future[str]':
+        # returns the future of the ts, no need to wait for it
+        loop = asyncio.get_event_loop()
+        future: 'asyncio.Future[str]' = loop.create_future()
+        # the errors are logged by the outbox
+        future.add_done_callback(
+                lambda x: x.cancelled() or x.exception())
+        self._queues.setdefault(channel, collections.deque()).append(_Message(
+                client=client,
+                text=text,
+                params=params or {},
+                coalesce=coalesce,
+                time=loop.time(),
+                future=future))
+        if channel not in self._workers:
+            self._workers[channel] = asyncio.ensure_future(
+                    self._worker(channel))
+        return future
+
+    def stop(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        for queue in self._queues.values():
+            for message in queue:
+                message.future.cancel()
+        self._queues.clear()
+
+    async def _worker(self, channel: str) -> None:
+        queue = self._queues[channel]
+        loop = asyncio.get_event_loop()
+        try:
+            while queue:
+                head = queue[0]
+                # wait for the messages to be merged
+                if head.coalesce:
+                    delay = head.time + self._option.merge_window - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                messages = self._pop_messages(queue)
+                text = '\n'.join(message.text for message in messages)
+                try:
+                    response = await self._rate_limits.call(
+                            channel,
+                            head.client.chat_postMessage,
+                            channel=channel,
+                            text=text,
+                            **head.params)
+                except asyncio.CancelledError:
+                    for message in messages:
+                        message.future.cancel()
+                    raise
+                except Exception as error:
+                    self._logger.error(
+                            'failed to post message to %s: %s',
+                            channel,
+                            error)
+                    for message in messages:
+                        if not message.future.done():
+                            message.future.set_exception(error)
+                    continue
+                if len(messages) > 1:
+                    self._logger.debug(
+                            'merge %d messages to %s',
+                            len(messages),
+                            channel)
+                for message in messages:
+                    if not message.future.done():
+                        message.future.set_result(response['ts'])
+        finally:
+            if self._workers.get(channel) is asyncio.current_task():
+                del self._workers[channel]
+                if not queue:
+                    self._queues.pop(channel, None)
+
+    def _pop_messages(self, queue: Deque[_Message]) -> List[_Message]:
+        # consecutive messages with the same avatar
+        messages = [queue.popleft()]
+        length = len(messages[0].text)
+        while (messages[0].coalesce
+               and queue
+               and queue[0].coalesce
+               and queue[0].client is messages[0].client
+               and queue[0].key() == messages[0].key()
+               and length + 1 + len(queue[0].text)
+               <= self._option.max_length):
+            length += 1 + len(queue[0].text)
+            messages.append(queue.popleft())
+        return messages
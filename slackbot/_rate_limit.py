@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+import slack
+
+
+class RateLimiter:
+    # AIMD: probe additively for the allowed rate, halve it on HTTP 429
+    def __init__(
+            self,
+            rate: float,
+            max_rate: float,
+            min_rate: float = 1. / 60.) -> None:
+        assert 0 < min_rate <= max_rate
+        self._max_rate = max_rate
+        self._min_rate = min_rate
+        self._rate = min(max(rate, min_rate), max_rate)
+        self._next_time = 0.
+        self._pause_until = 0.
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    async def acquire(self) -> None:
+        # reserve the next slot, then wait for it
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self._next_time, self._pause_until)
+        self._next_time = slot + 1. / self._rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def success(self) -> None:
+        self._rate = min(self._rate + self._max_rate / 20., self._max_rate)
+
+    def rate_limited(self, retry_after: float) -> None:
+        self._rate = max(self._rate / 2., self._min_rate)
+        now = asyncio.get_event_loop().time()
+        self._pause_until = max(self._pause_until, now + retry_after)
+        self._next_time = self._pause_until
+
+
+class RateLimits:
+    # slack limits the rate of each API method
+    def __init__(
+            self,
+            rate: float,
+            max_rate: float,
+            logger: Optional[logging.Logger] = None) -> None:
+        self._rate = rate
+        self._max_rate = max_rate
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._logger = logger or logging.getLogger(__name__)
+
+    def configure(self, rate: float, max_rate: float) -> None:
+        # applied to the methods called after this
+        self._rate = rate
+        self._max_rate = max_rate
+        self._limiters.clear()
+
+    def limiter(self, method: str) -> RateLimiter:
+        if method not in self._limiters:
+            self._limiters[method] = RateLimiter(
+                    rate=self._rate,
+                    max_rate=self._max_rate)
+        return self._limiters[method]
+
+    async def call(
+            self,
+            method: str,
+            function: Callable[..., Any],
+            **params: Any) -> Any:
+        limiter = self.limiter(method)
+        while True:
+            await limiter.acquire()
+            try:
+                response = await function(**params)
+                response.validate()
+            except slack.errors.SlackApiError as error:
+                if error.response.status_code != 429:
+                    raise
+                retry_after = float(
+                        error.response.headers.get('Retry-After', 1))
+                limiter.rate_limited(retry_after)
+                self._logger.warning(
+                        '%s is rate limited: retry after %.1fs at %.2f/min',
+                        method,
+                        retry_after,
+                        limiter.rate * 60.)
+                continue
+            limiter.success()
+            return response
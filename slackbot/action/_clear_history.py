@@ -1,27 +1,43 @@
 # -*- cpding: utf-8 -*-
 
+import array
 import asyncio
 import datetime
+import enum
 import logging
+import pathlib
 import threading
-from typing import Any, List, NamedTuple, Optional, Tuple, TypedDict, Union
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 import slack
-from .. import Action, Option, OptionError, OptionList
+from .. import Action, Channel, Option, OptionError, OptionList, RateLimits
+from . import clear_history
 
 
 class ChannelOption:
-    def __init__(self, name: str, period: Union[float, int]) -> None:
+    def __init__(
+            self,
+            name: str,
+            period: Union[float, int],
+            replies: bool = False,
+            files: bool = False) -> None:
         assert isinstance(name, str)
         assert isinstance(period, (float, int))
+        assert isinstance(replies, bool)
+        assert isinstance(files, bool)
         self._name = name
         self._period = datetime.timedelta(hours=period)
+        self._replies = replies
+        self._files = files
 
     def __repr__(self) -> str:
-        return "{0}.{1}(name={2}, period={3})".format(
-                self.__class__.__module__,
-                self.__class__.__name__,
-                repr(self._name),
-                repr(self._period))
+        return ("{0}.{1}(name={2}, period={3}, replies={4}, files={5})"
+                .format(
+                        self.__class__.__module__,
+                        self.__class__.__name__,
+                        repr(self._name),
+                        repr(self._period),
+                        repr(self._replies),
+                        repr(self._files)))
 
     @property
     def name(self) -> str:
@@ -31,10 +47,30 @@ class ChannelOption:
     def period(self) -> datetime.timedelta:
         return self._period
 
+    @property
+    def replies(self) -> bool:
+        return self._replies
+
+    @property
+    def files(self) -> bool:
+        return self._files
+
+
+class ExecutionMode(enum.Enum):
+    THREAD = enum.auto()
+    TASK = enum.auto()
+
 
 class ClearHistoryOption(NamedTuple):
     sleep: float
+    mode: ExecutionMode
     api_interval: float
+    rate_limit: float
+    concurrency: int
+    scan_slices: int
+    queue_size: int
+    checkpoint: Optional[pathlib.Path]
+    archive: clear_history.ArchiveOption
     channels: Tuple[ChannelOption, ...]
 
     @staticmethod
@@ -57,6 +93,10 @@ class ClearHistoryOption(NamedTuple):
                             .format(channel))
             return tuple(result)
 
+        # translate to ExecutionMode
+        to_mode = {'thread': ExecutionMode.THREAD,
+                   'task': ExecutionMode.TASK}
+
         return OptionList(
                 ClearHistoryOption,
                 name,
@@ -64,14 +104,58 @@ class ClearHistoryOption(NamedTuple):
                         type=float,
                         default=float(24 * 60 * 60),
                         help='clear execution interval of (seconds)'),
+                 Option('mode',
+                        default='thread',
+                        action=to_mode.get,
+                        choices=to_mode.keys(),
+                        help=('run in a thread with its own client'
+                              ' and rate limits, or as a task on the core'
+                              ' event loop sharing its client and rate budget'
+                              ' (api_interval & rate_limit are not used)')),
                  Option('api_interval',
                         type=float,
                         default=5.0,
-                        help='slack api execution interval (seconds)'),
+                        help=('initial interval (seconds) of each slack api'
+                              ' method, adapted up to rate_limit')),
+                 Option('rate_limit',
+                        type=float,
+                        default=50.0,
+                        help=('maximum requests per minute'
+                              ' of each slack api method')),
+                 Option('concurrency',
+                        type=int,
+                        default=4,
+                        help='number of concurrent deletions'),
+                 Option('scan_slices',
+                        type=int,
+                        default=4,
+                        help=('number of time slices of each channel'
+                              ' scanned in parallel')),
+                 Option('queue_size',
+                        type=int,
+                        default=4,
+                        help=('number of scanned pages'
+                              ' waiting to be deleted')),
+                 Option('checkpoint',
+                        action=lambda x: (
+                                pathlib.Path().joinpath(x)
+                                if x is not None
+                                else None),
+                        help=('file of the cleared range of each channel'
+                              ' to scan only new messages in the next run'
+                              ' (disabled if not set)')),
+                 clear_history.ArchiveOption.option_list(
+                        name='archive',
+                        help='export of the messages to be deleted'),
                  Option('channels',
-                        sample=[{'name': 'CHANNEL_NAME', 'period': 24}],
+                        sample=[{'name': 'CHANNEL_NAME',
+                                 'period': 24,
+                                 'replies': False,
+                                 'files': False}],
                         action=parse_channel,
-                        help='target channels')],
+                        help=('target channels'
+                              ' (replies: delete thread replies,'
+                              ' files: delete uploaded files)'))],
                 help=help)
 
 
@@ -79,9 +163,31 @@ class _ExecutionStop(Exception):
     pass
 
 
-class _DeleteTarget(TypedDict):
-    channel: str
-    ts: str
+class _TargetPage(NamedTuple):
+    channel: Channel
+    page: clear_history.PageProgress
+    # thread replies are deleted before their parents
+    replies: array.array
+    # sequence of the archive entry to be synced before the deletion
+    archived: int
+
+
+class _TargetReplies(NamedTuple):
+    # replies in the thread of a page scanned in a previous run
+    channel: Channel
+    progress: clear_history.ChannelProgress
+    thread_ts: int
+    replies: array.array
+    is_kept: bool
+    archived: int
+
+
+class _TargetFiles(NamedTuple):
+    channel: Channel
+    files: List[str]
+
+
+_Target = Union[_TargetPage, _TargetReplies, _TargetFiles]
 
 
 class ClearHistory(Action[ClearHistoryOption]):
@@ -96,105 +202,513 @@ class ClearHistory(Action[ClearHistoryOption]):
                 logger=logger or logging.getLogger(__name__))
         self._execution_time: Optional[datetime.datetime] = None
         self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Future] = None
         self._lock = threading.Lock()
         self._is_stopped = False
 
     async def update(self, client: slack.WebClient) -> None:
         if (self.team.is_initialized()
                 and not self.is_in_sleep()
-                and self._thread is None):
+                and self._thread is None
+                and self._task is None):
             self._execution_time = _now()
             self._logger.info('execute clear at %s', self._execution_time)
-            self._thread = threading.Thread(
-                    target=lambda: asyncio.run(self._execute(
-                            client=slack.WebClient(
-                                    token=client.token,
-                                    run_async=True))))
-            self._thread.start()
+            if self.option.mode is ExecutionMode.TASK:
+                # share the client & the rate budget of the core
+                self._task = asyncio.ensure_future(
+                        self._execute(client, self.rate_limits))
+            else:
+                self._thread = threading.Thread(
+                        target=lambda: asyncio.run(self._execute(
+                                client=slack.WebClient(
+                                        token=client.token,
+                                        run_async=True))))
+                self._thread.start()
         if self._thread is not None and not self._thread.is_alive():
             self._thread = None
+        if self._task is not None and self._task.done():
+            if (not self._task.cancelled()
+                    and self._task.exception() is not None):
+                self._logger.error(
+                        'execution failed: %r',
+                        self._task.exception())
+            self._task = None
 
     def stop(self) -> None:
         self._logger.info('request to stop execution')
         with self._lock:
             self._is_stopped = True
+        # a task is stopped immediately
+        if self._task is not None:
+            self._task.cancel()
 
     def is_in_sleep(self) -> bool:
         return (self._execution_time is not None
                 and (_now() - self._execution_time
                      < datetime.timedelta(seconds=self.option.sleep)))
 
-    async def _execute(self, client: slack.WebClient) -> None:
+    async def _execute(
+            self,
+            client: slack.WebClient,
+            rate_limits: Optional[RateLimits] = None) -> None:
         try:
             self._logger.info('begin execution')
-            # target
-            targets: List[_DeleteTarget] = []
-            for channel in self.option.channels:
-                targets.extend(await self._target_messages(client, channel))
-            # delete
-            for i, target in enumerate(targets):
-                self._logger.debug(
-                        'delete %d/%d: channel "%s", %s',
-                        i + 1,
-                        len(targets),
-                        target['channel'],
-                        _to_datetime(target['ts']))
-                response = await client.chat_delete(**target)
-                response.validate()
-                await asyncio.sleep(self.option.api_interval)
-                self._can_continue()
-            self._logger.info('end execution')
+            if rate_limits is None:
+                rate_limits = RateLimits(
+                        rate=1. / max(self.option.api_interval, 1e-3),
+                        max_rate=self.option.rate_limit / 60.,
+                        logger=self._logger)
+            # scan & delete are connected by a bounded queue
+            queue: asyncio.Queue[Optional[_Target]] = asyncio.Queue(
+                    maxsize=max(self.option.queue_size, 1))
+            checkpoint = clear_history.Checkpoint(self.option.checkpoint)
+            concurrency = max(self.option.concurrency, 1)
+            archive: Optional[clear_history.ArchiveWriter] = None
+            if self.option.archive.directory is not None:
+                archive = clear_history.ArchiveWriter(
+                        self.option.archive,
+                        logger=self._logger)
+                archive.start()
+            scanner = asyncio.ensure_future(self._scan(
+                    client,
+                    rate_limits,
+                    checkpoint,
+                    archive,
+                    queue,
+                    concurrency))
+            deleters = [asyncio.ensure_future(self._delete(
+                                client,
+                                rate_limits,
+                                checkpoint,
+                                archive,
+                                queue))
+                        for _ in range(concurrency)]
+            try:
+                counts = await asyncio.gather(*deleters)
+            finally:
+                scanner.cancel()
+                for deleter in deleters:
+                    deleter.cancel()
+                if archive is not None:
+                    # flush the rest without blocking the event loop
+                    await asyncio.get_event_loop().run_in_executor(
+                            None,
+                            archive.close)
+            await scanner
+            self._logger.info('end execution: delete %d messages', sum(counts))
         except _ExecutionStop:
             self._logger.info('execution is stopped')
             return
+        except asyncio.CancelledError:
+            self._logger.info('execution is cancelled')
+            raise
 
-    async def _target_messages(
+    async def _scan(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            checkpoint: clear_history.Checkpoint,
+            archive: Optional[clear_history.ArchiveWriter],
+            queue: 'asyncio.Queue[Optional[_Target]]',
+            concurrency: int) -> None:
+        is_cancelled = False
+        try:
+            # all channels and their time slices in parallel
+            tasks: List[asyncio.Future] = []
+            for channel_option in self.option.channels:
+                channel = self.team.channels.name_search(channel_option.name)
+                if channel is None:
+                    self._logger.warning(
+                            'channel \'%s\' is not found',
+                            channel_option.name)
+                    continue
+                if self._execution_time is None:
+                    self._logger.error('execution time is None')
+                    continue
+                latest = _pack_ts(str(
+                        (self._execution_time - channel_option.period)
+                        .timestamp()))
+                # continue from the checkpoint
+                progress = checkpoint.begin(
+                        channel.id,
+                        _created_ts(channel),
+                        latest,
+                        self.option.scan_slices)
+                # threads with the replies kept in the previous runs
+                if channel_option.replies and progress.threads:
+                    tasks.append(asyncio.ensure_future(self._scan_threads(
+                            client,
+                            rate_limits,
+                            archive,
+                            channel,
+                            progress,
+                            queue)))
+                for slice_progress in progress.slices:
+                    tasks.append(asyncio.ensure_future(self._scan_slice(
+                            client,
+                            rate_limits,
+                            checkpoint,
+                            archive,
+                            channel,
+                            channel_option,
+                            slice_progress,
+                            queue)))
+                if channel_option.files:
+                    tasks.append(asyncio.ensure_future(self._scan_files(
+                            client,
+                            rate_limits,
+                            channel,
+                            latest,
+                            queue)))
+            try:
+                counts = await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            self._logger.info('scan %d targets', sum(counts))
+        except asyncio.CancelledError:
+            is_cancelled = True
+            raise
+        finally:
+            # end of targets (the deleters are gone if cancelled)
+            if not is_cancelled:
+                for _ in range(concurrency):
+                    await queue.put(None)
+
+    async def _scan_slice(
                 self,
                 client: slack.WebClient,
-                channel_option: ChannelOption) -> List[_DeleteTarget]:
-        result: List[_DeleteTarget] = []
-        # channel
-        channel = self.team.channels.name_search(channel_option.name)
-        if channel is None:
-            self._logger.warning(
-                    'channel \'%s\' is not found',
-                    channel_option.name)
-            return result
-        # latest
-        if self._execution_time is None:
-            self._logger.error('execution time is None')
-            return result
-        latest = self._execution_time - channel_option.period
-        # request
-        for response in await client.conversations_history(
-                channel=channel.id,
-                latest=str(latest.timestamp()),
-                limit=1000):
-            response.validate()
-            await asyncio.sleep(self.option.api_interval)
+                rate_limits: RateLimits,
+                checkpoint: clear_history.Checkpoint,
+                archive: Optional[clear_history.ArchiveWriter],
+                channel: Channel,
+                channel_option: ChannelOption,
+                slice_progress: clear_history.SliceProgress,
+                queue: 'asyncio.Queue[Optional[_Target]]') -> int:
+        # messages in [oldest, latest)
+        oldest = slice_progress.oldest
+        latest = slice_progress.latest
+        count = 0
+        cursor: Optional[str] = None
+        while True:
+            params: Dict[str, Any] = {
+                    'channel': channel.id,
+                    'oldest': _unpack_ts(oldest - 1),
+                    'latest': _unpack_ts(latest),
+                    'limit': 1000}
+            if cursor:
+                params['cursor'] = cursor
+            response = await rate_limits.call(
+                    'conversations.history',
+                    client.conversations_history,
+                    **params)
             if response['messages']:
-                result.extend(
-                        {'channel': channel.id,
-                         'ts': message['ts']}
-                        for message in response['messages'])
+                page = slice_progress.add_page(array.array(
+                        'q',
+                        (_pack_ts(message['ts'])
+                         for message in response['messages'])))
+                count += len(page.timestamps)
                 self._logger.debug(
                         'channel "%s": add %d (%s - %s), total %d',
                         channel.name,
-                        len(response['messages']),
+                        len(page.timestamps),
                         _to_datetime(response['messages'][0]['ts']),
                         _to_datetime(response['messages'][-1]['ts']),
-                        len(result))
+                        count)
+                replies: List[Dict[str, Any]] = []
+                if channel_option.replies:
+                    assert slice_progress.channel is not None
+                    replies = await self._scan_replies(
+                            client,
+                            rate_limits,
+                            checkpoint,
+                            channel,
+                            slice_progress.channel,
+                            response['messages'])
+                    count += len(replies)
+                # the payloads are exported before they are deleted
+                archived = 0
+                if archive is not None:
+                    archived = archive.write(
+                            channel.id,
+                            channel.name,
+                            response['messages'] + replies)
+                # wait while the deleters are behind
+                await queue.put(_TargetPage(
+                        channel=channel,
+                        page=page,
+                        replies=array.array(
+                                'q',
+                                sorted((_pack_ts(reply['ts'])
+                                        for reply in replies),
+                                       reverse=True)),
+                        archived=archived))
             self._can_continue()
-        if result:
+            cursor = (response.get('response_metadata') or {}).get(
+                    'next_cursor',
+                    None)
+            if not cursor:
+                break
+        slice_progress.is_scanned = True
+        checkpoint.advance(slice_progress)
+        if count:
             self._logger.info(
                     'channel "%s": %d target (%s - %s)',
                     channel.name,
-                    len(result),
-                    _to_datetime(result[0]['ts']),
-                    _to_datetime(result[-1]['ts']))
-        else:
-            self._logger.info('channel "%s": no target', channel.name)
-        return result
+                    count,
+                    _to_datetime(_unpack_ts(oldest)),
+                    _to_datetime(_unpack_ts(latest)))
+        return count
+
+    async def _scan_replies(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            checkpoint: clear_history.Checkpoint,
+            channel: Channel,
+            progress: clear_history.ChannelProgress,
+            messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # the threads of a page are fetched concurrently
+        parents = [message['ts'] for message in messages
+                   if message.get('reply_count')
+                   and message.get('thread_ts', message['ts'])
+                   == message['ts']]
+        results = await asyncio.gather(*(
+                self._scan_thread(
+                        client,
+                        rate_limits,
+                        channel,
+                        ts,
+                        progress.latest)
+                for ts in parents))
+        for ts, (_, is_kept) in zip(parents, results):
+            # the parent is not scanned again after the checkpoint
+            if is_kept:
+                checkpoint.add_thread(progress, _pack_ts(ts))
+        return [reply for replies, _ in results for reply in replies]
+
+    async def _scan_threads(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            archive: Optional[clear_history.ArchiveWriter],
+            channel: Channel,
+            progress: clear_history.ChannelProgress,
+            queue: 'asyncio.Queue[Optional[_Target]]') -> int:
+        count = 0
+        threads = sorted(progress.threads)
+        for thread_ts in threads:
+            replies, is_kept = await self._scan_thread(
+                    client,
+                    rate_limits,
+                    channel,
+                    _unpack_ts(thread_ts),
+                    progress.latest)
+            archived = 0
+            if archive is not None and replies:
+                archived = archive.write(channel.id, channel.name, replies)
+            await queue.put(_TargetReplies(
+                    channel=channel,
+                    progress=progress,
+                    thread_ts=thread_ts,
+                    replies=array.array(
+                            'q',
+                            sorted((_pack_ts(reply['ts'])
+                                    for reply in replies),
+                                   reverse=True)),
+                    is_kept=is_kept,
+                    archived=archived))
+            count += len(replies)
+        if count:
+            self._logger.info(
+                    'channel "%s": %d target replies in %d threads',
+                    channel.name,
+                    count,
+                    len(threads))
+        return count
+
+    async def _scan_thread(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            channel: Channel,
+            thread_ts: str,
+            latest: int) -> Tuple[List[Dict[str, Any]], bool]:
+        # replies in the thread before latest, whether any reply is kept
+        replies: List[Dict[str, Any]] = []
+        is_kept = False
+        cursor: Optional[str] = None
+        while True:
+            params: Dict[str, Any] = {
+                    'channel': channel.id,
+                    'ts': thread_ts,
+                    'limit': 1000}
+            if cursor:
+                params['cursor'] = cursor
+            try:
+                response = await rate_limits.call(
+                        'conversations.replies',
+                        client.conversations_replies,
+                        **params)
+            except slack.errors.SlackApiError as error:
+                # the thread has been deleted
+                if error.response.get('error') != 'thread_not_found':
+                    raise
+                break
+            for message in response['messages']:
+                if message['ts'] == thread_ts:
+                    continue
+                if _pack_ts(message['ts']) < latest:
+                    replies.append(message)
+                else:
+                    is_kept = True
+            self._can_continue()
+            cursor = (response.get('response_metadata') or {}).get(
+                    'next_cursor',
+                    None)
+            if not cursor:
+                break
+        return replies, is_kept
+
+    async def _scan_files(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            channel: Channel,
+            latest: int,
+            queue: 'asyncio.Queue[Optional[_Target]]') -> int:
+        # list all pages first: deleting shifts the later pages
+        files: List[str] = []
+        page = 1
+        while True:
+            response = await rate_limits.call(
+                    'files.list',
+                    client.files_list,
+                    channel=channel.id,
+                    ts_to=str(latest // 1000000),
+                    count=1000,
+                    page=page)
+            files.extend(file['id'] for file in response['files'])
+            self._can_continue()
+            paging = response.get('paging') or {}
+            if page >= paging.get('pages', 1):
+                break
+            page += 1
+        for i in range(0, len(files), 100):
+            await queue.put(_TargetFiles(
+                    channel=channel,
+                    files=files[i:i + 100]))
+        if files:
+            self._logger.info(
+                    'channel "%s": %d target files',
+                    channel.name,
+                    len(files))
+        return len(files)
+
+    async def _delete(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            checkpoint: clear_history.Checkpoint,
+            archive: Optional[clear_history.ArchiveWriter],
+            queue: 'asyncio.Queue[Optional[_Target]]') -> int:
+        count = 0
+        while True:
+            target = await queue.get()
+            if target is None:
+                break
+            # do not delete what could not be archived
+            if archive is not None:
+                archive.check()
+                # the writer is usually ahead by the queue size
+                if not isinstance(target, _TargetFiles):
+                    await archive.wait(target.archived)
+            if isinstance(target, _TargetFiles):
+                for file_id in target.files:
+                    self._logger.debug(
+                            'delete: channel "%s", file %s',
+                            target.channel.name,
+                            file_id)
+                    if await self._delete_file(client, rate_limits, file_id):
+                        count += 1
+                    self._can_continue()
+                continue
+            if isinstance(target, _TargetReplies):
+                for timestamp in target.replies:
+                    if await self._delete_message(
+                            client,
+                            rate_limits,
+                            target.channel,
+                            _unpack_ts(timestamp)):
+                        count += 1
+                    self._can_continue()
+                # all the replies of the thread are deleted
+                if not target.is_kept:
+                    checkpoint.remove_thread(
+                            target.progress,
+                            target.thread_ts)
+                continue
+            for timestamp in target.replies:
+                if await self._delete_message(
+                        client,
+                        rate_limits,
+                        target.channel,
+                        _unpack_ts(timestamp)):
+                    count += 1
+                self._can_continue()
+            for timestamp in target.page.timestamps:
+                if await self._delete_message(
+                        client,
+                        rate_limits,
+                        target.channel,
+                        _unpack_ts(timestamp)):
+                    count += 1
+                # move the watermark
+                target.page.deleted += 1
+                checkpoint.advance(target.page.slice)
+                self._can_continue()
+        return count
+
+    async def _delete_message(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            channel: Channel,
+            ts: str) -> bool:
+        self._logger.debug(
+                'delete: channel "%s", %s',
+                channel.name,
+                _to_datetime(ts))
+        try:
+            await rate_limits.call(
+                    'chat.delete',
+                    client.chat_delete,
+                    channel=channel.id,
+                    ts=ts)
+        except slack.errors.SlackApiError as error:
+            # already deleted
+            if error.response.get('error') != 'message_not_found':
+                raise
+            return False
+        return True
+
+    async def _delete_file(
+            self,
+            client: slack.WebClient,
+            rate_limits: RateLimits,
+            file_id: str) -> bool:
+        try:
+            await rate_limits.call(
+                    'files.delete',
+                    client.files_delete,
+                    file=file_id)
+        except slack.errors.SlackApiError as error:
+            # already deleted
+            if error.response.get('error') not in ('file_not_found',
+                                                   'file_deleted'):
+                raise
+            return False
+        return True
 
     def _can_continue(self) -> None:
         with self._lock:
@@ -212,3 +726,20 @@ def _now() -> datetime.datetime:
 
 def _to_datetime(timestamp: str) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(float(timestamp))
+
+
+def _created_ts(channel: Channel) -> int:
+    try:
+        return int(channel.get('created')) * 1000000
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def _pack_ts(ts: str) -> int:
+    # '1234567890.123456' -> 1234567890123456 (exact, unlike float)
+    seconds, _, microseconds = ts.partition('.')
+    return int(seconds) * 1000000 + int(microseconds.ljust(6, '0')[:6])
+
+
+def _unpack_ts(value: int) -> str:
+    return '{0}.{1:06d}'.format(value // 1000000, value % 1000000)
@@ -1,22 +1,38 @@
 # -*- coding: utf-8
 
+import asyncio
 import datetime
+import enum
+import hashlib
 import logging
 import pathlib
-import queue
 import re
-from typing import List, NamedTuple, Optional, Pattern
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern
+import requests
 import slack
-from .. import Action, Channel, Option, OptionList
+from .. import Action, Channel, Option, OptionList, Outbox
 from . import download
 from ._option import AvatarOption
 
 
+class DestinationLayout(enum.Enum):
+    FLAT = enum.auto()
+    DATE = enum.auto()
+    CHANNEL = enum.auto()
+    HASH = enum.auto()
+
+
 class DownloadOption(NamedTuple):
     channel: List[str]
     pattern: Pattern
+    batch_pattern: Pattern
+    manifest_pattern: Pattern
     destination_directory: pathlib.Path
+    destination_layout: DestinationLayout
     least_size: Optional[int]
+    update_message: bool
+    update_interval: float
     thread: download.ThreadOption
     avatar: AvatarOption
 
@@ -24,6 +40,13 @@ class DownloadOption(NamedTuple):
     def option_list(
             name: str,
             help: str = '') -> OptionList['DownloadOption']:
+        # translate to DestinationLayout
+        to_layout: Dict[str, DestinationLayout] = {
+                'flat': DestinationLayout.FLAT,
+                'date': DestinationLayout.DATE,
+                'channel': DestinationLayout.CHANNEL,
+                'hash': DestinationLayout.HASH}
+
         return OptionList(
             DownloadOption,
             name,
@@ -41,14 +64,45 @@ class DownloadOption(NamedTuple):
                             r'(|\|[^>]+)>',
                     help=('regular expresion for working'
                           ' which have simbolic groups named "name" & "url"')),
+             Option('batch_pattern',
+                    action=re.compile,
+                    default=r'(?s)download\s+batch(\s+"(?P<name>[^"]+)")?'
+                            r'\s+(?P<urls>.+)',
+                    help=('regular expresion for downloading all URLs'
+                          ' in the symbolic group "urls" as a batch'
+                          ' whose name is the optional group "name"')),
+             Option('manifest_pattern',
+                    action=re.compile,
+                    default=r'download\s+manifest(\s+"(?P<name>[^"]+)")?'
+                            r'\s+<(?P<url>https?://[^|>\s]+)(|\|[^>]+)>',
+                    help=('regular expresion for downloading the files'
+                          ' listed in the manifest at the group "url"'
+                          ' (one URL per line or JSON) as a batch')),
              Option('destination_directory',
                     action=lambda x: pathlib.Path().joinpath(x),
                     default='./download',
                     help='directory where files are saved'),
+             Option('destination_layout',
+                    default='flat',
+                    action=to_layout.get,
+                    choices=to_layout.keys(),
+                    help=('subdirectories of destination_directory:'
+                          ' none, YYYY/MM/DD, channel name'
+                          ' or hash prefix of the file name')),
              Option('least_size',
                     action=lambda x: int(x) if x is not None else None,
                     help='minimun file size'
                          ' regarded as a successful download'),
+             Option('update_message',
+                    type=bool,
+                    default=True,
+                    help=('edit the start message with chat.update'
+                          ' instead of posting each report')),
+             Option('update_interval',
+                    type=float,
+                    default=10.0,
+                    help=('minimum interval (seconds)'
+                          ' between progress edits of a message')),
              download.ThreadOption.option_list(
                     name='thread',
                     help='download thread'),
@@ -60,11 +114,25 @@ class DownloadOption(NamedTuple):
 
 class ReportInfo(NamedTuple):
     channel: Channel
+    batch: Optional[int] = None
 
 
 Report = download.Report[ReportInfo]
 
 
+class _LiveMessage:
+    def __init__(self, channel: str, ts: str, header: str) -> None:
+        self.channel = channel
+        self.ts = ts
+        self.header = header
+        self.updated_time = time.perf_counter()
+        # latest message waiting for the update interval
+        self.pending: Optional[str] = None
+        # finish message followed by the results of post-processing
+        self.lines: List[str] = []
+        self.remaining_hooks = 0
+
+
 class Download(Action[DownloadOption]):
     def __init__(
             self,
@@ -75,10 +143,18 @@ class Download(Action[DownloadOption]):
                 name,
                 option,
                 logger=logger or logging.getLogger(__name__))
-        self._report_queue: 'queue.Queue[Report]' = queue.Queue()
-        self._download_threads = download.ThreadGenerator(
-                report_queue=self._report_queue,
-                option=self.option.thread)
+        self._report_queue: download.AsyncReportQueue[ReportInfo] = (
+                download.AsyncReportQueue())
+        self._download_threads: download.ThreadGenerator[ReportInfo] = (
+                download.ThreadGenerator(
+                        report_queue=self._report_queue,
+                        option=_thread_option(self.option),
+                        encode_info=lambda info: {
+                                'channel': info.channel.id}))
+        self._is_recovered = False
+        self._live_messages: Dict[int, _LiveMessage] = {}
+        self._batches: Dict[int, download.Batch[ReportInfo]] = {}
+        self._report_task: Optional[asyncio.Future] = None
 
     def register(self) -> None:
         self.register_callback(
@@ -86,19 +162,197 @@ class Download(Action[DownloadOption]):
                 callback=self._callback)
 
     async def update(self, client: slack.WebClient) -> None:
-        while not self._report_queue.empty():
-            report = self._report_queue.get()
-            self._logger.debug('report: %s', report)
-            await _post_report(client, self.option, report)
+        # restart the task stopped by an unexpected error
+        if (self._report_task is not None
+                and self._report_task.done()
+                and not self._report_task.cancelled()):
+            self._logger.error(
+                    'report task stopped: %r',
+                    self._report_task.exception())
+            self._report_task = None
+        # start the task to post reports as soon as they arrive
+        if self._report_task is None:
+            if not self._report_queue.is_bound():
+                self._report_queue.bind(asyncio.get_event_loop())
+            self._report_task = asyncio.ensure_future(
+                    self._report_loop(client))
+        # restart the jobs interrupted by the last shutdown
+        if not self._is_recovered and self.team.is_initialized():
+            self._is_recovered = True
+            count = self._download_threads.recover(self._decode_info)
+            if count:
+                self._logger.info('recover %d download jobs', count)
 
     def stop(self) -> None:
         self._logger.info('request cancel')
         self._download_threads.cancel()
+        if self._report_task is not None:
+            self._report_task.cancel()
 
     @staticmethod
     def option_list(name: str) -> OptionList['DownloadOption']:
         return DownloadOption.option_list(name)
 
+    def _decode_info(self, data: Any) -> Optional[ReportInfo]:
+        channel = (self.team.channels.id_search(data['channel'])
+                   if isinstance(data, dict) and 'channel' in data
+                   else None)
+        if channel is None:
+            self._logger.warning('could not recover job info: %r', data)
+            return None
+        return ReportInfo(channel=channel)
+
+    async def _report_loop(self, client: slack.WebClient) -> None:
+        while True:
+            # wait for reports or the next progress edit
+            timeout = min(
+                    (live_message.updated_time
+                     + self.option.update_interval
+                     - time.perf_counter()
+                     for live_message in self._live_messages.values()
+                     if live_message.pending is not None),
+                    default=None)
+            try:
+                reports = [await asyncio.wait_for(
+                        self._report_queue.get(),
+                        timeout=timeout)]
+            except asyncio.TimeoutError:
+                reports = []
+            reports.extend(self._report_queue.get_all_nowait())
+            for report in download.drop_superseded(reports):
+                self._logger.debug('report: %s', report)
+                try:
+                    if report.info.batch is not None:
+                        await self._update_batch(client, report)
+                    elif self.option.update_message:
+                        await self._update_report(client, report)
+                    else:
+                        _post_report(self.outbox, client, self.option, report)
+                except Exception as error:
+                    # the other reports are still posted
+                    self._logger.error(
+                            'failed to post report: %s %s',
+                            error.__class__.__name__,
+                            error)
+            # send the latest progress of each message per interval
+            current = time.perf_counter()
+            for live_message in list(self._live_messages.values()):
+                if (live_message.pending is not None
+                        and (current - live_message.updated_time
+                             >= self.option.update_interval)):
+                    try:
+                        await _update_message(
+                                client,
+                                live_message,
+                                live_message.pending)
+                    except Exception as error:
+                        self._logger.error(
+                                'failed to update report: %s %s',
+                                error.__class__.__name__,
+                                error)
+
+    async def _update_report(
+            self,
+            client: slack.WebClient,
+            report: Report) -> None:
+        live_message = self._live_messages.get(report.job_id, None)
+        # start: post a new message
+        if report.type is download.ReportType.START:
+            header = _report_message(self.option, report)
+            # the ts is needed to edit the message
+            ts = await _post_message(
+                    self.outbox,
+                    client,
+                    self.option,
+                    report.info.channel.id,
+                    header,
+                    coalesce=False)
+            self._live_messages[report.job_id] = _LiveMessage(
+                    channel=report.info.channel.id,
+                    ts=ts,
+                    header=header)
+        # no message to edit
+        elif live_message is None:
+            _post_report(self.outbox, client, self.option, report)
+        # progress: coalesced until the interval has passed
+        elif report.type is download.ReportType.PROGRESS:
+            live_message.pending = _report_message(self.option, report)
+        # post-processing: appended to the finish message
+        elif report.type in (download.ReportType.PROCESSED,
+                             download.ReportType.PROCESS_ERROR):
+            live_message.lines.append(_report_message(self.option, report))
+            live_message.remaining_hooks -= 1
+            if live_message.remaining_hooks <= 0:
+                del self._live_messages[report.job_id]
+            await _update_message(
+                    client,
+                    live_message,
+                    '\n'.join(live_message.lines))
+        # finish, error
+        else:
+            message = _report_message(self.option, report)
+            hooks = self.option.thread.postprocess.hooks
+            if report.type is download.ReportType.FINISH and hooks:
+                # keep the message until post-processing ends
+                live_message.lines = [message]
+                live_message.remaining_hooks = len(hooks)
+            else:
+                del self._live_messages[report.job_id]
+            await _update_message(client, live_message, message)
+
+    async def _update_batch(
+            self,
+            client: slack.WebClient,
+            report: Report) -> None:
+        assert report.info.batch is not None
+        # only the errors of post-processing are posted for a batch
+        if report.type in (download.ReportType.PROCESSED,
+                           download.ReportType.PROCESS_ERROR):
+            if report.type is download.ReportType.PROCESS_ERROR:
+                _post_report(self.outbox, client, self.option, report)
+            return
+        batch = self._batches.get(report.info.batch, None)
+        # batch of the last run
+        if batch is None:
+            _post_report(self.outbox, client, self.option, report)
+            return
+        batch.update(report)
+        # one message for the batch
+        live_message = self._live_messages.get(batch.id, None)
+        if live_message is None:
+            header = '[{0}]:start batch of {1} files'.format(
+                    batch.name,
+                    batch.size)
+            ts = await _post_message(
+                    self.outbox,
+                    client,
+                    self.option,
+                    report.info.channel.id,
+                    header,
+                    coalesce=False)
+            live_message = _LiveMessage(
+                    channel=report.info.channel.id,
+                    ts=ts,
+                    header=header)
+            self._live_messages[batch.id] = live_message
+        if batch.is_finished():
+            del self._batches[batch.id]
+            del self._live_messages[batch.id]
+            if self.option.update_message:
+                await _update_message(
+                        client,
+                        live_message,
+                        _batch_finish_message(batch))
+            else:
+                _post_message(
+                        self.outbox,
+                        client,
+                        self.option,
+                        report.info.channel.id,
+                        _batch_finish_message(batch))
+        elif self.option.update_message:
+            live_message.pending = _batch_progress_message(batch)
+
     async def _callback(self, **payload) -> None:
         data = payload['data']
         channel = self.team.channels.id_search(data['channel'])
@@ -106,19 +360,129 @@ class Download(Action[DownloadOption]):
                 or channel is None
                 or channel.name not in self.option.channel):
             return
-        self._logger.debug('match message: %s', data['text'].strip())
-        match = self.option.pattern.match(data['text'].strip())
-        if not match:
+        text = data['text'].strip()
+        timestamp = float(data.get('ts', time.time()))
+        self._logger.debug('match message: %s', text)
+        # single file
+        match = self.option.pattern.match(text)
+        if match:
+            name = match.group('name')
+            url = match.group('url')
+            path = _destination_path(self.option, channel, name, timestamp)
+            self._logger.info('detect: name=\'%s\', url=\'%s\'', name, url)
+            # start thread
+            self._download_threads.start(
+                    url=url,
+                    path=path,
+                    info=ReportInfo(channel=channel))
+            return
+        # manifest
+        match = self.option.manifest_pattern.match(text)
+        if match:
+            url = match.group('url')
+            self._logger.info('detect manifest: url=\'%s\'', url)
+            try:
+                entries = await asyncio.get_event_loop().run_in_executor(
+                        None,
+                        download.fetch_manifest,
+                        url,
+                        (self.option.thread.session.connect_timeout,
+                         self.option.thread.session.read_timeout))
+            except (requests.RequestException,
+                    download.InvalidManifestError) as error:
+                self._logger.error('failed to fetch manifest: %s', error)
+                client: Optional[slack.WebClient] = payload.get(
+                        'web_client',
+                        None)
+                if client is not None:
+                    _post_message(
+                            self.outbox,
+                            client,
+                            self.option,
+                            channel.id,
+                            '[{0}]:error {1} {2}'.format(
+                                    download.url_name(url),
+                                    error.__class__.__name__,
+                                    error))
+                return
+            self._start_batch(
+                    channel,
+                    match.group('name'),
+                    download.url_name(url),
+                    entries,
+                    timestamp)
             return
-        name = match.group('name')
-        url = match.group('url')
-        path = self.option.destination_directory.joinpath(name)
-        self._logger.info('detect: name=\'%s\', url=\'%s\'', name, url)
-        # start thread
-        self._download_threads.start(
-                url=url,
-                path=path,
-                info=ReportInfo(channel=channel))
+        # URLs in the message
+        match = self.option.batch_pattern.match(text)
+        if match:
+            self._start_batch(
+                    channel,
+                    match.group('name'),
+                    'batch',
+                    download.message_urls(match.group('urls')),
+                    timestamp)
+
+    def _start_batch(
+            self,
+            channel: Channel,
+            directory: Optional[str],
+            default_name: str,
+            entries: List[download.BatchEntry],
+            timestamp: float) -> None:
+        if not entries:
+            self._logger.warning('no files in batch: %s', default_name)
+            return
+        batch: download.Batch[ReportInfo] = download.Batch(
+                download.new_job_id(),
+                directory or default_name,
+                len(entries))
+        self._batches[batch.id] = batch
+        self._logger.info(
+                'detect batch: name=\'%s\', %d files',
+                batch.name,
+                batch.size)
+        for entry in entries:
+            # the files of a named batch are saved in its directory
+            name = (pathlib.PurePosixPath(directory, entry.name).as_posix()
+                    if directory is not None
+                    else entry.name)
+            self._download_threads.start(
+                    url=entry.url,
+                    path=_destination_path(
+                            self.option,
+                            channel,
+                            name,
+                            timestamp),
+                    info=ReportInfo(channel=channel, batch=batch.id))
+
+
+def _thread_option(option: DownloadOption) -> download.ThreadOption:
+    # reject files smaller than least_size before downloading them
+    if (option.least_size is not None
+            and option.thread.admission.min_size is None):
+        return option.thread._replace(
+                admission=option.thread.admission._replace(
+                        min_size=option.least_size))
+    return option.thread
+
+
+def _destination_path(
+        option: DownloadOption,
+        channel: Channel,
+        name: str,
+        timestamp: float) -> pathlib.Path:
+    # shard the destination to keep each directory small
+    directory = option.destination_directory
+    if option.destination_layout is DestinationLayout.DATE:
+        directory = directory.joinpath(
+                datetime.datetime.fromtimestamp(timestamp).strftime(
+                        '%Y/%m/%d'))
+    elif option.destination_layout is DestinationLayout.CHANNEL:
+        directory = directory.joinpath(channel.name)
+    elif option.destination_layout is DestinationLayout.HASH:
+        directory = directory.joinpath(
+                hashlib.sha1(name.encode()).hexdigest()[:2])
+    return directory.joinpath(name)
 
 
 def _start_message(report: Report) -> str:
@@ -148,6 +512,9 @@ def _progress_message(report: Report) -> str:
     if report.progress.remaining_time is not None:
         message.append(' (remaining {0})'.format(
                 datetime.timedelta(seconds=report.progress.remaining_time)))
+    if report.progress.bandwidth is not None:
+        message.append(' [limit {0}/s]'.format(
+                download.Report.format_bytes(report.progress.bandwidth)))
     return ''.join(message)
 
 
@@ -156,6 +523,14 @@ def _finish_report(
         least_size: Optional[int]) -> str:
     assert report.saved_path is not None
     message: List[str] = []
+    if report.source is download.ContentSource.STORE:
+        return '[{0}]:finish (already stored, sha256:{1})'.format(
+                report.saved_path.name,
+                report.digest)
+    if report.source is download.ContentSource.CACHE:
+        return '[{0}]:finish (not modified, served from cache {1})'.format(
+                report.saved_path.name,
+                download.Report.format_bytes(report.progress.file_size))
     if report.path == report.saved_path:
         message.append('[{0}]:finish'.format(report.path.name))
     else:
@@ -180,6 +555,48 @@ def _finish_report(
     return ''.join(message)
 
 
+def _batch_progress_message(batch: download.Batch[ReportInfo]) -> str:
+    progress = batch.progress()
+    message: List[str] = []
+    message.append('[{0}]:progress {1}/{2} files'.format(
+            batch.name,
+            len(batch.finished()) + len(batch.failed()),
+            batch.size))
+    message.append(' {0}/{1}'.format(
+            download.Report.format_bytes(progress.downloaded_size),
+            download.Report.format_bytes(progress.file_size)))
+    message.append(' {0}/s in {1}'.format(
+            download.Report.format_bytes(progress.speed),
+            datetime.timedelta(seconds=progress.elapsed_time)))
+    if progress.remaining_time is not None:
+        message.append(' (remaining {0})'.format(
+                datetime.timedelta(seconds=progress.remaining_time)))
+    return ''.join(message)
+
+
+def _batch_finish_message(
+        batch: download.Batch[ReportInfo],
+        max_errors: int = 20) -> str:
+    progress = batch.progress()
+    failed = batch.failed()
+    message: List[str] = []
+    message.append('[{0}]:finish {1}/{2} files'.format(
+            batch.name,
+            len(batch.finished()),
+            batch.size))
+    message.append(' {0} at {1}/s in {2}'.format(
+            download.Report.format_bytes(progress.downloaded_size),
+            download.Report.format_bytes(progress.average_speed),
+            datetime.timedelta(seconds=progress.elapsed_time)))
+    for report in failed[:max_errors]:
+        message.append('\n')
+        message.append(_error_report(report))
+    if len(failed) > max_errors:
+        message.append('\n... and {0} more errors'.format(
+                len(failed) - max_errors))
+    return ''.join(message)
+
+
 def _error_report(report: Report) -> str:
     assert report.error is not None
     return '[{0}]:error {1} {2}'.format(
@@ -188,10 +605,23 @@ def _error_report(report: Report) -> str:
                 report.error)
 
 
-async def _post_report(
-        client: slack.WebClient,
+def _process_report(report: Report) -> str:
+    assert report.saved_path is not None
+    if report.type is download.ReportType.PROCESS_ERROR:
+        return '[{0}]:{1} error {2} {3}'.format(
+                report.saved_path.name,
+                report.hook,
+                report.error.__class__.__name__,
+                report.error)
+    return '[{0}]:{1} {2}'.format(
+            report.saved_path.name,
+            report.hook,
+            report.result)
+
+
+def _report_message(
         option: DownloadOption,
-        report: Report) -> None:
+        report: Report) -> str:
     message = ''
     # start
     if report.type is download.ReportType.START:
@@ -205,10 +635,49 @@ async def _post_report(
     # error
     elif report.type is download.ReportType.ERROR:
         message = _error_report(report)
-    # post message
-    params = {}
-    params['text'] = message
-    params.update(option.avatar.params())
-    await client.chat_postMessage(
-            channel=report.info.channel.id,
-            **params)
+    # post-processing
+    elif report.type in (download.ReportType.PROCESSED,
+                         download.ReportType.PROCESS_ERROR):
+        message = _process_report(report)
+    return message
+
+
+def _post_report(
+        outbox: Outbox,
+        client: slack.WebClient,
+        option: DownloadOption,
+        report: Report) -> 'asyncio.Future[str]':
+    return _post_message(
+            outbox,
+            client,
+            option,
+            report.info.channel.id,
+            _report_message(option, report))
+
+
+def _post_message(
+        outbox: Outbox,
+        client: slack.WebClient,
+        option: DownloadOption,
+        channel: str,
+        message: str,
+        coalesce: bool = True) -> 'asyncio.Future[str]':
+    # queued in the outbox: the future of the ts
+    return outbox.post(
+            client,
+            channel,
+            message,
+            params=option.avatar.params(),
+            coalesce=coalesce)
+
+
+async def _update_message(
+        client: slack.WebClient,
+        live_message: _LiveMessage,
+        message: str) -> None:
+    live_message.pending = None
+    live_message.updated_time = time.perf_counter()
+    await client.chat_update(
+            channel=live_message.channel,
+            ts=live_message.ts,
+            text='{0}\n{1}'.format(live_message.header, message))
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import datetime
 import enum
 import logging
 import random
 import re
-from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from typing import (
+        Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set,
+        Tuple, Union, overload)
 import slack
-from .. import Action, Option, OptionError, OptionList, unescape_text
+from .. import (
+        Action, Option, OptionError, OptionList, TokenType, tokenize)
 from ._option import AvatarOption
+from .response import (
+        Cooldown, CooldownOption, ExactMatcher, RegexMatcher, SubstringMatcher,
+        Template, TemplateContext)
 
 
 class Trigger(enum.Enum):
@@ -17,22 +24,45 @@ class Trigger(enum.Enum):
     ANY = enum.auto()
 
 
+class CallType(enum.Enum):
+    EXACT = enum.auto()
+    SUBSTRING = enum.auto()
+    REGEX = enum.auto()
+
+
 class Pattern:
     def __init__(
             self,
             call: Iterable[str],
-            response: Iterable[str]) -> None:
+            response: Iterable[str],
+            type: CallType = CallType.EXACT) -> None:
         self._call: Tuple[str, ...] = tuple(call)
         self._response: Tuple[str, ...] = tuple(response)
+        self._type = type
         assert all(map(lambda x: isinstance(x, str), self.call))
         assert all(map(lambda x: isinstance(x, str), self.response))
+        assert isinstance(self._type, CallType)
+        # compiled once: raises re.error or ValueError
+        self._regexes: Tuple['re.Pattern[str]', ...] = (
+                tuple(re.compile(call) for call in self._call)
+                if self._type is CallType.REGEX
+                else ())
+        groups: Optional[Set[Union[int, str]]] = None
+        if self._type is CallType.REGEX:
+            groups = set()
+            for regex in self._regexes:
+                groups.update(range(regex.groups + 1))
+                groups.update(regex.groupindex.keys())
+        self._templates: Tuple[Template, ...] = tuple(
+                Template(response, groups) for response in self._response)
 
     def __repr__(self) -> str:
-        return "{0}.{1}(call={2}, response={3})".format(
+        return "{0}.{1}(call={2}, response={3}, type={4})".format(
                 self.__class__.__module__,
                 self.__class__.__name__,
                 repr(self.call),
-                repr(self.response))
+                repr(self.response),
+                repr(self.type))
 
     @property
     def call(self) -> Tuple[str, ...]:
@@ -42,11 +72,79 @@ class Pattern:
     def response(self) -> Tuple[str, ...]:
         return self._response
 
+    @property
+    def type(self) -> CallType:
+        return self._type
+
+    @property
+    def templates(self) -> Tuple[Template, ...]:
+        return self._templates
+
+    def search(self, text: str) -> Optional['re.Match[str]']:
+        # the match of the regex for the groups in the templates
+        for regex in self._regexes:
+            match = regex.search(text)
+            if match is not None:
+                return match
+        return None
+
+
+class PatternMatcher(Sequence[Pattern]):
+    # compiled once: exact & substring calls are indexed,
+    # regex calls are searched in order
+    def __init__(self, patterns: Iterable[Pattern]) -> None:
+        self._patterns: Tuple[Pattern, ...] = tuple(patterns)
+
+        def keys(call_type: CallType) -> List[Tuple[str, int]]:
+            return [(call, index)
+                    for index, pattern in enumerate(self._patterns)
+                    if pattern.type is call_type
+                    for call in pattern.call]
+
+        self._exact = ExactMatcher(keys(CallType.EXACT))
+        self._substring = SubstringMatcher(keys(CallType.SUBSTRING))
+        self._regex = RegexMatcher(keys(CallType.REGEX))
+
+    def __repr__(self) -> str:
+        return '{0}.{1}({2})'.format(
+                self.__class__.__module__,
+                self.__class__.__name__,
+                repr(self._patterns))
+
+    @overload
+    def __getitem__(self, index: int) -> Pattern: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[Pattern]: ...
+
+    def __getitem__(
+            self,
+            index: Union[int, slice]) -> Union[Pattern, Sequence[Pattern]]:
+        return self._patterns[index]
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def __iter__(self) -> Iterator[Pattern]:
+        return iter(self._patterns)
+
+    def match(self, text: str) -> List[Pattern]:
+        # all the exact & substring patterns, and the first regex pattern
+        indices = set(self._exact.search(text))
+        if len(self._substring):
+            indices |= self._substring.search(text)
+        if len(self._regex):
+            regex_index = self._regex.search(text)
+            if regex_index is not None:
+                indices.add(regex_index)
+        return [self._patterns[index] for index in sorted(indices)]
+
 
 class ResponseOption(NamedTuple):
     channel: Tuple[str, ...]
     trigger: Trigger
-    pattern: Tuple[Pattern, ...]
+    pattern: PatternMatcher
+    cooldown: CooldownOption
     avatar: AvatarOption
 
     @staticmethod
@@ -59,6 +157,12 @@ class ResponseOption(NamedTuple):
                 'reply': Trigger.REPLY,
                 'any': Trigger.ANY}
 
+        # translate to CallType
+        to_call_type: Dict[str, CallType] = {
+                'exact': CallType.EXACT,
+                'substring': CallType.SUBSTRING,
+                'regex': CallType.REGEX}
+
         # translate to Pattern
         def parse_pattern(data) -> Pattern:
             kwargs = copy.deepcopy(data)
@@ -66,20 +170,23 @@ class ResponseOption(NamedTuple):
                 for key in ('call', 'response'):
                     if key in kwargs and isinstance(kwargs[key], str):
                         kwargs[key] = [kwargs[key]]
+                if 'type' in kwargs:
+                    kwargs['type'] = to_call_type.get(kwargs['type'], None)
             try:
                 return Pattern(**kwargs)
-            except (TypeError, AssertionError):
+            except (TypeError, AssertionError, ValueError, re.error):
                 raise OptionError(
                         'could not convert to Pattern: \'{0}\''.format(data))
 
-        # translate to list of Patterns
-        def parse_pattern_list(data) -> List[Pattern]:
+        # translate to PatternMatcher
+        def parse_pattern_list(data) -> PatternMatcher:
             if isinstance(data, dict):
-                return [parse_pattern(data)]
+                return PatternMatcher([parse_pattern(data)])
             if isinstance(data, Iterable) and not isinstance(data, str):
-                return [parse_pattern(element) for element in data]
+                return PatternMatcher(
+                        parse_pattern(element) for element in data)
             if data is None:
-                return []
+                return PatternMatcher([])
             raise OptionError(
                     'could not convert to Pattern\'s list: \'{0}\''
                     .format(data))
@@ -100,9 +207,20 @@ class ResponseOption(NamedTuple):
                     choices=to_trigger.keys(),
                     help='response trigger'),
              Option('pattern',
-                    sample=[{'call': ['ping'], 'response': ['pong']}],
+                    sample=[{'call': ['ping'],
+                             'response': ['pong'],
+                             'type': 'exact'}],
                     action=parse_pattern_list,
-                    help='response pattern'),
+                    help=('response pattern (type: {0});'
+                          ' placeholders in response: {1}'.format(
+                                ', '.join(to_call_type.keys()),
+                                '{user}, {user_id}, {mention}, {channel},'
+                                ' {channel_id}, {text}, {time:%H:%M},'
+                                ' {1} or {name} of regex groups,'
+                                ' {{ & }} for braces'))),
+             CooldownOption.option_list(
+                    name='cooldown',
+                    help='limits of the responses'),
              AvatarOption.option_list(
                     name='avatar',
                     help='avatar')],
@@ -119,12 +237,24 @@ class Response(Action[ResponseOption]):
                 name,
                 option,
                 logger=logger or logging.getLogger(__name__))
+        self._cooldown = Cooldown(self.option.cooldown)
 
     def register(self) -> None:
         self.register_callback(
                 event='message',
                 callback=self._response)
 
+    async def update(self, client: slack.WebClient) -> None:
+        metrics = self._cooldown.report()
+        if metrics and metrics.get('suppressed', 0):
+            self._logger.info(
+                    'suppressed %d of %d responses: %s',
+                    metrics['suppressed'],
+                    metrics['suppressed'] + metrics.get('responded', 0),
+                    ', '.join('{0}={1}'.format(key[len('suppressed_'):], value)
+                              for key, value in sorted(metrics.items())
+                              if key.startswith('suppressed_')))
+
     @staticmethod
     def option_list(name: str) -> OptionList[ResponseOption]:
         return ResponseOption.option_list(name)
@@ -142,38 +272,55 @@ class Response(Action[ResponseOption]):
         user = self.team.users.id_search(data['user'])
         if user is None:
             return
-        # message text
-        match = re.search(
-                    r'(<@(?P<reply_to>[^|>]+)(|\|.+)>|)\s*(?P<text>.+)',
-                    data['text'])
-        if not match:
+        # message text: the first line after the leading mention
+        tokens = tokenize(data['text'])
+        reply_to: Optional[str] = None
+        if tokens and tokens[0].type is TokenType.USER:
+            reply_to = tokens[0].value
+            tokens = tokens[1:]
+        text = ''.join(token.text for token in tokens).lstrip()
+        text = text.partition('\n')[0]
+        if not text:
             return
-        text = unescape_text(match.group('text'))
         # trigger
         is_reply = (self.team.bot is not None
-                    and match.group('reply_to') == self.team.bot.id)
+                    and reply_to == self.team.bot.id)
         if ((is_reply and self.option.trigger is Trigger.NON_REPLY)
                 or (not is_reply and self.option.trigger is Trigger.REPLY)):
             return
         # pattern
-        for pattern in self.option.pattern:
-            if text not in pattern.call:
+        for pattern in self.option.pattern.match(text):
+            # cooldown: counted instead of sent
+            if not self._cooldown.acquire(user.id, channel.id, pattern):
+                self._logger.debug(
+                        'suppress response: \'%s\' (from \'%s\')',
+                        text,
+                        user.name)
                 continue
-            params = {}
+            # avatar
+            params = self.option.avatar.params()
             # text
-            response = random.choice(pattern.response)
-            params['text'] = '{0}{1}'.format(
+            template = random.choice(pattern.templates)
+            response = template.render(TemplateContext(
+                    user=user,
+                    channel=channel,
+                    text=text,
+                    match=(pattern.search(text)
+                           if template.uses_match
+                           else None),
+                    time=datetime.datetime.now()))
+            message = '{0}{1}'.format(
                     '<@{0}> '.format(user.id) if is_reply else '',
                     response)
-            # avatar
-            params.update(self.option.avatar.params())
-            # request
+            # request: paced & merged by the outbox
             self._logger.info(
                     'response: \'%s\' (from \'%s\') -> \'%s\'',
                     text,
                     user.name,
                     response)
             self._logger.debug('params: %r', params)
-            await client.chat_postMessage(
-                    channel=channel.id,
-                    **params)
+            self.outbox.post(
+                    client,
+                    channel.id,
+                    message,
+                    params=params)
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from ._archive import (
+        ArchiveError, ArchiveIndex, ArchiveOption, ArchiveWriter, read_archive)
+from ._checkpoint import (
+        ChannelProgress, Checkpoint, PageProgress, SliceProgress, time_slices)
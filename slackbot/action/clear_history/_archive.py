@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import pathlib
+import queue
+import threading
+import time
+from typing import (
+        Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union)
+from ... import Option, OptionList
+
+
+class ArchiveOption(NamedTuple):
+    directory: Optional[pathlib.Path]
+    max_size: int
+    sync_interval: float
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['ArchiveOption']:
+        return OptionList(
+            ArchiveOption,
+            name,
+            [Option('directory',
+                    action=lambda x: (
+                            pathlib.Path().joinpath(x)
+                            if x is not None
+                            else None),
+                    help=('directory to export the messages before deletion'
+                          ' (disabled if not set)')),
+             Option('max_size',
+                    type=int,
+                    default=64 * 1024 * 1024,
+                    help='rotate the archive file at this size (bytes)'),
+             Option('sync_interval',
+                    type=float,
+                    default=5.0,
+                    help='interval (seconds) to fsync the archive file')],
+            help=help)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class _Entry(NamedTuple):
+    channel_id: str
+    channel_name: str
+    messages: List[Dict[str, Any]]
+    sequence: int
+
+
+class ArchiveWriter:
+    # gzip compressed JSON lines written by a background thread
+    index_name = 'index.json'
+
+    def __init__(
+            self,
+            option: ArchiveOption,
+            logger: Optional[logging.Logger] = None) -> None:
+        assert option.directory is not None
+        self._option = option
+        self._directory = option.directory
+        self._logger = logger or logging.getLogger(__name__)
+        self._queue: 'queue.Queue[Optional[_Entry]]' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._index = ArchiveIndex.load(self._directory)
+        self._raw: Optional[io.BufferedWriter] = None
+        self._file: Optional[gzip.GzipFile] = None
+        self._path: Optional[pathlib.Path] = None
+        self._sync_time = 0.
+        self._is_dirty = False
+        self._lock = threading.Lock()
+        # entries up to written / durable have been written / synced
+        self._sequence = 0
+        self._written = 0
+        self._durable = 0
+        self._is_running = False
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+
+    def start(self) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._is_running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(
+            self,
+            channel_id: str,
+            channel_name: str,
+            messages: List[Dict[str, Any]]) -> int:
+        # never blocks: returns the sequence to wait() before the deletion
+        self.check()
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        self._queue.put(_Entry(channel_id, channel_name, messages, sequence))
+        return sequence
+
+    def is_durable(self, sequence: int) -> bool:
+        with self._lock:
+            return self._durable >= sequence
+
+    async def wait(self, sequence: int) -> None:
+        # until the entries up to the sequence are synced to the disk
+        future = asyncio.get_event_loop().create_future()
+        with self._lock:
+            if self._durable < sequence and self._is_running:
+                self._waiters.append((sequence, future))
+            else:
+                future.set_result(None)
+        await future
+        self.check()
+        if not self.is_durable(sequence):
+            raise ArchiveError('the archive writer is stopped')
+
+    def check(self) -> None:
+        if self._error is not None:
+            raise ArchiveError(
+                    'failed to write the archive: {0!r}'.format(self._error))
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.check()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                # write all the queued entries, then sync them at once
+                entries: List[Optional[_Entry]] = []
+                try:
+                    # wake up to sync the idle entries in time
+                    entries.append(self._queue.get(timeout=(
+                            max(self._sync_time
+                                + self._option.sync_interval
+                                - time.monotonic(),
+                                0.)
+                            if self._written > self._durable
+                            else None)))
+                    while entries[-1] is not None and not self._queue.empty():
+                        entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                for entry in entries:
+                    if entry is not None:
+                        self._write(entry)
+                if entries and entries[-1] is None:
+                    break
+                if time.monotonic() - self._sync_time >= (
+                        self._option.sync_interval):
+                    self._sync()
+        except BaseException as error:
+            self._logger.error('archive writer failed: %r', error)
+            self._error = error
+        finally:
+            try:
+                self._close_file()
+                if self._error is None:
+                    self._set_durable(self._written)
+            except OSError as error:
+                self._logger.error('failed to close the archive: %r', error)
+                self._error = self._error or error
+            with self._lock:
+                self._is_running = False
+                self._notify()
+
+    def _write(self, entry: _Entry) -> None:
+        for message in entry.messages:
+            if self._file is None:
+                self._open_file()
+            assert self._file is not None and self._path is not None
+            self._file.write(json.dumps(
+                    {'channel': entry.channel_id,
+                     'channel_name': entry.channel_name,
+                     'message': message},
+                    ensure_ascii=False).encode('utf-8'))
+            self._file.write(b'\n')
+            self._index.add(
+                    self._path.name,
+                    entry.channel_id,
+                    message.get('ts', ''))
+            self._is_dirty = True
+            assert self._raw is not None
+            if self._raw.tell() >= self._option.max_size:
+                self._close_file()
+        self._written = entry.sequence
+
+    def _open_file(self) -> None:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        for sequence in range(1000):
+            path = self._directory.joinpath('{0}-{1:03d}.jsonl.gz'.format(
+                    now.strftime('%Y%m%dT%H%M%S'),
+                    sequence))
+            try:
+                self._raw = path.open('xb')
+                break
+            except FileExistsError:
+                continue
+        else:
+            raise ArchiveError('failed to create an archive file')
+        self._path = path
+        self._file = gzip.GzipFile(
+                filename=path.name,
+                mode='wb',
+                fileobj=self._raw)
+        self._logger.info('open archive: %s', path.as_posix())
+
+    def _sync(self) -> None:
+        if self._is_dirty:
+            if self._file is not None and self._raw is not None:
+                # a readable gzip member boundary up to here
+                self._file.flush()
+                self._raw.flush()
+                os.fsync(self._raw.fileno())
+            # the index follows the synced data
+            self._index.save()
+            self._is_dirty = False
+        self._sync_time = time.monotonic()
+        self._set_durable(self._written)
+
+    def _set_durable(self, sequence: int) -> None:
+        with self._lock:
+            self._durable = sequence
+            self._notify()
+
+    def _notify(self) -> None:
+        # wake up the waiters in their event loop
+        waiters = self._waiters
+        self._waiters = []
+        for sequence, future in waiters:
+            if sequence > self._durable and self._is_running:
+                self._waiters.append((sequence, future))
+                continue
+            try:
+                future.get_loop().call_soon_threadsafe(_set_result, future)
+            except RuntimeError:
+                # the event loop is closed
+                pass
+
+    def _close_file(self) -> None:
+        if self._file is not None and self._raw is not None:
+            self._file.close()
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+            self._raw.close()
+            self._file = None
+            self._raw = None
+        if self._is_dirty:
+            self._index.save()
+            self._is_dirty = False
+        self._sync_time = time.monotonic()
+
+
+def _set_result(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ArchiveIndex:
+    # {file name: {channel id: [oldest ts, latest ts, count]}}
+    def __init__(
+            self,
+            path: pathlib.Path,
+            files: Dict[str, Dict[str, List[Any]]]) -> None:
+        self._path = path
+        self._files = files
+
+    @staticmethod
+    def load(directory: pathlib.Path) -> 'ArchiveIndex':
+        path = directory.joinpath(ArchiveWriter.index_name)
+        files: Dict[str, Dict[str, List[Any]]] = {}
+        if path.exists():
+            try:
+                with path.open() as fin:
+                    files = json.load(fin)
+            except (OSError, ValueError):
+                files = {}
+        return ArchiveIndex(path, files)
+
+    def add(self, name: str, channel_id: str, ts: str) -> None:
+        record = self._files.setdefault(name, {}).get(channel_id, None)
+        if record is None:
+            self._files[name][channel_id] = [ts, ts, 1]
+            return
+        if _ts_key(ts) < _ts_key(record[0]):
+            record[0] = ts
+        if _ts_key(ts) > _ts_key(record[1]):
+            record[1] = ts
+        record[2] += 1
+
+    def lookup(
+            self,
+            channel_id: str,
+            oldest: Optional[str] = None,
+            latest: Optional[str] = None) -> List[pathlib.Path]:
+        # files that may contain the messages in [oldest, latest]
+        result: List[pathlib.Path] = []
+        for name, channels in sorted(self._files.items()):
+            record = channels.get(channel_id, None)
+            if record is None:
+                continue
+            if oldest is not None and _ts_key(record[1]) < _ts_key(oldest):
+                continue
+            if latest is not None and _ts_key(record[0]) > _ts_key(latest):
+                continue
+            result.append(self._path.with_name(name))
+        return result
+
+    def save(self) -> None:
+        temp_path = self._path.with_name('{0}.tmp'.format(self._path.name))
+        with temp_path.open('w') as fout:
+            json.dump(self._files, fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+        temp_path.replace(self._path)
+
+
+def read_archive(
+        directory: Union[str, pathlib.Path],
+        channel_id: str,
+        oldest: Optional[str] = None,
+        latest: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    # archived messages of the channel in [oldest, latest]
+    index = ArchiveIndex.load(pathlib.Path(directory))
+    for path in index.lookup(channel_id, oldest, latest):
+        with gzip.open(path.as_posix(), 'rt', encoding='utf-8') as fin:
+            try:
+                for line in fin:
+                    record = json.loads(line)
+                    if record['channel'] != channel_id:
+                        continue
+                    ts = record['message'].get('ts', '')
+                    if oldest is not None and _ts_key(ts) < _ts_key(oldest):
+                        continue
+                    if latest is not None and _ts_key(ts) > _ts_key(latest):
+                        continue
+                    yield record['message']
+            except (EOFError, ValueError):
+                # the last line of an interrupted file
+                continue
+
+
+def _ts_key(ts: str) -> Tuple[int, int]:
+    seconds, _, microseconds = ts.partition('.')
+    try:
+        return (int(seconds), int(microseconds.ljust(6, '0')[:6]))
+    except ValueError:
+        return (0, 0)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import array
+import collections
+import json
+import pathlib
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class ChannelProgress:
+    def __init__(
+            self,
+            channel_id: str,
+            latest: int,
+            slices: List['SliceProgress'],
+            threads: Optional[Iterable[int]] = None) -> None:
+        self.channel_id = channel_id
+        self.latest = latest
+        self.slices = slices
+        # parents of the threads with replies after latest
+        self.threads: Set[int] = set(threads or ())
+        for slice_progress in slices:
+            slice_progress.channel = self
+
+    def is_done(self) -> bool:
+        return all(slice_progress.is_done() for slice_progress in self.slices)
+
+
+class SliceProgress:
+    # [position, latest) of the slice has been cleared
+    def __init__(self, oldest: int, latest: int) -> None:
+        self.oldest = oldest
+        self.latest = latest
+        self.position = latest
+        self.is_scanned = False
+        self.channel: Optional[ChannelProgress] = None
+        # pages waiting for deletion, newest first
+        self._pages: Deque['PageProgress'] = collections.deque()
+
+    def is_done(self) -> bool:
+        return self.position <= self.oldest
+
+    def add_page(self, timestamps: array.array) -> 'PageProgress':
+        page = PageProgress(self, timestamps)
+        self._pages.append(page)
+        return page
+
+    def advance(self) -> None:
+        # pages arrive newest first and are deleted newest first,
+        # but pages are deleted concurrently
+        while self._pages:
+            page = self._pages[0]
+            if page.deleted > 0:
+                self.position = page.timestamps[page.deleted - 1]
+            if page.deleted < len(page.timestamps):
+                return
+            self._pages.popleft()
+        if self.is_scanned:
+            self.position = self.oldest
+
+
+class PageProgress:
+    def __init__(
+            self,
+            slice_progress: SliceProgress,
+            timestamps: array.array) -> None:
+        self.slice = slice_progress
+        self.timestamps = timestamps
+        self.deleted = 0
+
+
+class Checkpoint:
+    # {channel id: {cleared_until, latest, slices, threads}}
+    def __init__(self, path: Optional[pathlib.Path]) -> None:
+        self._path = path
+        self._data: Dict[str, Dict[str, Any]] = {}
+        if path is not None and path.exists():
+            try:
+                with path.open() as fin:
+                    self._data = json.load(fin)
+            except (OSError, ValueError):
+                self._data = {}
+
+    def begin(
+            self,
+            channel_id: str,
+            oldest: int,
+            latest: int,
+            count: int) -> ChannelProgress:
+        record = self._data.get(channel_id, {})
+        start = max(oldest, record.get('cleared_until', oldest))
+        slices: List[SliceProgress] = []
+        run_latest: Optional[int] = record.get('latest', None)
+        if run_latest is not None:
+            # resume the interrupted run
+            for slice_oldest, position in record.get('slices', []):
+                position = min(position, latest)
+                if position > slice_oldest:
+                    slices.append(SliceProgress(slice_oldest, position))
+            start = max(start, run_latest)
+        # new messages since the last run
+        slices.extend(
+                SliceProgress(slice_oldest, slice_latest)
+                for slice_oldest, slice_latest
+                in time_slices(start, latest, count)
+                if slice_latest > slice_oldest)
+        progress = ChannelProgress(
+                channel_id,
+                latest,
+                slices,
+                record.get('threads', []))
+        self.update(progress)
+        return progress
+
+    def advance(self, slice_progress: SliceProgress) -> None:
+        slice_progress.advance()
+        assert slice_progress.channel is not None
+        self.update(slice_progress.channel)
+
+    def add_thread(self, progress: ChannelProgress, thread_ts: int) -> None:
+        # the thread is scanned again in the next run
+        if thread_ts not in progress.threads:
+            progress.threads.add(thread_ts)
+            self.update(progress)
+
+    def remove_thread(
+            self,
+            progress: ChannelProgress,
+            thread_ts: int) -> None:
+        if thread_ts in progress.threads:
+            progress.threads.remove(thread_ts)
+            self.update(progress)
+
+    def update(self, progress: ChannelProgress) -> None:
+        record = self._data.setdefault(progress.channel_id, {})
+        record['threads'] = sorted(progress.threads)
+        if progress.is_done():
+            record['cleared_until'] = max(
+                    record.get('cleared_until', progress.latest),
+                    progress.latest)
+            record.pop('latest', None)
+            record.pop('slices', None)
+        else:
+            record['latest'] = progress.latest
+            record['slices'] = [
+                    [slice_progress.oldest, slice_progress.position]
+                    for slice_progress in progress.slices
+                    if not slice_progress.is_done()]
+        self._save()
+
+    def _save(self) -> None:
+        if self._path is None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self._path.with_name('{0}.tmp'.format(self._path.name))
+        with temp_path.open('w') as fout:
+            json.dump(self._data, fout)
+        temp_path.replace(self._path)
+
+
+def time_slices(
+        oldest: int,
+        latest: int,
+        count: int) -> List[Tuple[int, int]]:
+    # split [oldest, latest) into equal time ranges
+    count = max(count, 1)
+    if latest <= oldest:
+        return [(oldest, latest)]
+    width = -(-(latest - oldest) // count)
+    return [(start, min(start + width, latest))
+            for start in range(oldest, latest, width)]
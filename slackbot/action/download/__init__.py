@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 
 
+from ._admission import AdmissionOption
+from ._bandwidth import Allocation, BandwidthOption, BandwidthScheduler
+from ._batch import (
+        Batch, BatchEntry, fetch_manifest, message_urls, parse_manifest,
+        url_name)
+from ._cache import CacheOption, HttpCache
 from ._exception import (
-        DownloadCancelled, DownloadException, IncompleteDownloadError)
+        DownloadCancelled, DownloadException, DownloadRejected,
+        IncompleteDownloadError, InvalidManifestError)
+from ._journal import Journal, JournalOption
+from ._postprocess import PostProcessOption, PostProcessor
 from ._progress import ProgressReport
-from ._report import Report, ReportType
+from ._report import (
+        AsyncReportQueue, Report, ReportQueue, ReportType, drop_superseded,
+        new_job_id)
+from ._session import SessionOption, SessionPool
+from ._store import ContentSource, ContentStore, StoreOption
 from ._thread import Controller, ThreadGenerator, ThreadOption, download
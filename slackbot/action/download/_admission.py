@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import pathlib
+import shutil
+from typing import MutableMapping, NamedTuple, Optional, Tuple
+from ... import Option, OptionList
+from ._exception import DownloadRejected
+from ._report import Report
+
+
+class AdmissionOption(NamedTuple):
+    min_size: Optional[int]
+    max_size: Optional[int]
+    allowed_types: Optional[Tuple[str, ...]]
+    check_disk_space: bool
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['AdmissionOption']:
+        def to_size(value: Optional[str]) -> Optional[int]:
+            return int(value) if value is not None else None
+
+        def to_types(value) -> Optional[Tuple[str, ...]]:
+            if value is None:
+                return None
+            if isinstance(value, str):
+                return (value,)
+            return tuple(value)
+
+        return OptionList(
+            AdmissionOption,
+            name,
+            [Option('min_size',
+                    action=to_size,
+                    help='minimum file size (byte)'),
+             Option('max_size',
+                    action=to_size,
+                    help='maximum file size (byte)'),
+             Option('allowed_types',
+                    action=to_types,
+                    sample=['image/*', 'video/mp4'],
+                    help=('allowed Content-Type patterns'
+                          ' (all types if not set)')),
+             Option('check_disk_space',
+                    type=bool,
+                    default=True,
+                    help=('reject the download'
+                          ' if the file is larger than the free space'))],
+            help=help)
+
+    def check_header(
+            self,
+            header: MutableMapping[str, str],
+            file_size: Optional[int],
+            resumed_size: int,
+            directory: pathlib.Path) -> None:
+        # Content-Type
+        content_type = (header.get('Content-Type', '')
+                        .split(';')[0]
+                        .strip()
+                        .lower())
+        if (self.allowed_types is not None
+                and not any(fnmatch.fnmatch(content_type, pattern.lower())
+                            for pattern in self.allowed_types)):
+            raise DownloadRejected(
+                    'Content-Type \'{0}\' is not allowed'
+                    .format(content_type))
+        if file_size is None:
+            return
+        # size
+        self.check_min_size(file_size)
+        self.check_max_size(file_size)
+        # disk space
+        if self.check_disk_space:
+            free_space = shutil.disk_usage(directory.as_posix()).free
+            if file_size - resumed_size > free_space:
+                raise DownloadRejected(
+                        'file size {0} is larger than free space {1}'.format(
+                                Report.format_bytes(file_size - resumed_size),
+                                Report.format_bytes(free_space)))
+
+    def check_max_size(self, size: int) -> None:
+        if self.max_size is not None and size > self.max_size:
+            raise DownloadRejected(
+                    'file size {0} is larger than {1}'.format(
+                            Report.format_bytes(size),
+                            Report.format_bytes(self.max_size)))
+
+    def check_min_size(self, size: int) -> None:
+        if self.min_size is not None and size < self.min_size:
+            raise DownloadRejected(
+                    'file size {0} is smaller than {1}'.format(
+                            Report.format_bytes(size),
+                            Report.format_bytes(self.min_size)))
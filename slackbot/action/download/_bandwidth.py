@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+from ... import Option, OptionList
+
+
+class BandwidthOption(NamedTuple):
+    rate_limit: Optional[float]
+    per_download_limit: Optional[float]
+    burst: float
+    reallocation_interval: float
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['BandwidthOption']:
+        def to_rate(value: Optional[str]) -> Optional[float]:
+            return float(value) if value is not None else None
+
+        return OptionList(
+            BandwidthOption,
+            name,
+            [Option('rate_limit',
+                    action=to_rate,
+                    help=('total download speed limit (byte/s)'
+                          ' shared fairly by active downloads')),
+             Option('per_download_limit',
+                    action=to_rate,
+                    help='download speed limit (byte/s) of each download'),
+             Option('burst',
+                    default=1.0,
+                    type=float,
+                    help='bucket size in seconds of the allocated rate'),
+             Option('reallocation_interval',
+                    default=1.0,
+                    type=float,
+                    help=('interval (seconds)'
+                          ' to reallocate bandwidth by demand'))],
+            help=help)
+
+
+class _TokenBucket:
+    def __init__(self, rate: Optional[float], burst: float) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = self.capacity
+        self._last = time.perf_counter()
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    @property
+    def capacity(self) -> float:
+        return self._rate * self._burst if self._rate is not None else 0.
+
+    def set_rate(self, rate: Optional[float], now: float) -> None:
+        self.refill(now)
+        self._rate = rate
+        self._tokens = min(self._tokens, self.capacity)
+
+    def refill(self, now: float) -> None:
+        if self._rate is not None:
+            self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def consume(self, size: int, now: float) -> float:
+        # return seconds to wait until the debt is paid
+        if self._rate is None:
+            return 0.
+        self.refill(now)
+        self._tokens -= size
+        if self._tokens >= 0 or self._rate <= 0:
+            return 0.
+        return -self._tokens / self._rate
+
+
+class Allocation:
+    def __init__(
+            self,
+            scheduler: 'BandwidthScheduler',
+            bucket: _TokenBucket) -> None:
+        self._scheduler = scheduler
+        self._bucket = bucket
+        self._received_size = 0
+        self._demand: Optional[float] = None
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._bucket.rate
+
+    def consume(
+            self,
+            size: int,
+            is_canceled: Optional[Callable[[], bool]] = None) -> None:
+        self._scheduler.consume(self, size, is_canceled)
+
+    def release(self) -> None:
+        self._scheduler.unregister(self)
+
+
+class BandwidthScheduler:
+    def __init__(self, option: Optional[BandwidthOption] = None) -> None:
+        self._option = option or BandwidthOption.option_list(name='').parse()
+        self._lock = threading.Lock()
+        self._allocations: List[Allocation] = []
+        self._last_allocation_time = time.perf_counter()
+
+    def is_limited(self) -> bool:
+        return (self._option.rate_limit is not None
+                or self._option.per_download_limit is not None)
+
+    def register(self) -> Allocation:
+        allocation = Allocation(
+                self,
+                _TokenBucket(None, self._option.burst))
+        with self._lock:
+            self._allocations.append(allocation)
+            self._reallocate(time.perf_counter(), measure=False)
+        return allocation
+
+    def unregister(self, allocation: Allocation) -> None:
+        with self._lock:
+            if allocation in self._allocations:
+                self._allocations.remove(allocation)
+                self._reallocate(time.perf_counter(), measure=False)
+
+    def consume(
+            self,
+            allocation: Allocation,
+            size: int,
+            is_canceled: Optional[Callable[[], bool]] = None) -> None:
+        with self._lock:
+            now = time.perf_counter()
+            if (now - self._last_allocation_time
+                    >= self._option.reallocation_interval):
+                self._reallocate(now, measure=True)
+            allocation._received_size += size
+            wait = allocation._bucket.consume(size, now)
+        # sleep in short steps to stay cancellable
+        while wait > 0:
+            if is_canceled is not None and is_canceled():
+                return
+            time.sleep(min(wait, 0.5))
+            wait -= 0.5
+
+    def _reallocate(self, now: float, measure: bool) -> None:
+        # measure the demand of each download since the last measurement
+        elapsed_time = now - self._last_allocation_time
+        if measure and elapsed_time > 0:
+            for allocation in self._allocations:
+                allocation._demand = (
+                        allocation._received_size / elapsed_time
+                        if allocation.rate is not None
+                        else None)
+                allocation._received_size = 0
+            self._last_allocation_time = now
+        # max-min fair share
+        per_download_limit = (
+                self._option.per_download_limit
+                if self._option.per_download_limit is not None
+                else math.inf)
+        if self._option.rate_limit is None:
+            for allocation in self._allocations:
+                allocation._bucket.set_rate(
+                        self._option.per_download_limit,
+                        now)
+            return
+
+        def limit(allocation: Allocation) -> float:
+            # a download below its share may grow by 20% in each interval
+            if (allocation._demand is not None
+                    and allocation.rate is not None
+                    and allocation._demand < 0.8 * allocation.rate):
+                return min(allocation._demand * 1.2, per_download_limit)
+            return per_download_limit
+
+        remaining = self._option.rate_limit
+        allocations = sorted(self._allocations, key=limit)
+        rates: List[float] = []
+        for i, allocation in enumerate(allocations):
+            rate = min(limit(allocation), remaining / (len(allocations) - i))
+            rates.append(rate)
+            remaining -= rate
+        # spread the unused bandwidth
+        for allocation, rate in zip(allocations, rates):
+            allocation._bucket.set_rate(
+                    min(rate + remaining / len(allocations),
+                        per_download_limit),
+                    now)
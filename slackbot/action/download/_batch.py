@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pathlib
+import re
+import time
+import urllib.parse
+from typing import Any, Dict, Generic, List, NamedTuple, Optional, Tuple
+import requests
+from ... import TokenType, tokenize
+from ._exception import InvalidManifestError
+from ._progress import ProgressReport
+from ._report import Report, ReportInfo, ReportType
+
+
+class BatchEntry(NamedTuple):
+    url: str
+    name: str
+
+
+class Batch(Generic[ReportInfo]):
+    def __init__(self, batch_id: int, name: str, size: int) -> None:
+        self.id = batch_id
+        self.name = name
+        self.size = size
+        self._start_time = time.perf_counter()
+        # latest report of each job
+        self._reports: Dict[int, Report[ReportInfo]] = {}
+
+    def update(self, report: Report[ReportInfo]) -> None:
+        if report.type in (ReportType.PROCESSED, ReportType.PROCESS_ERROR):
+            return
+        self._reports[report.job_id] = report
+
+    def finished(self) -> List[Report[ReportInfo]]:
+        return [report for report in self._reports.values()
+                if report.type is ReportType.FINISH]
+
+    def failed(self) -> List[Report[ReportInfo]]:
+        return [report for report in self._reports.values()
+                if report.type is ReportType.ERROR]
+
+    def is_finished(self) -> bool:
+        return len(self.finished()) + len(self.failed()) >= self.size
+
+    def progress(self) -> ProgressReport:
+        reports = self._reports.values()
+        # total size is known after all jobs have started (or failed)
+        file_size: Optional[int] = None
+        if (len(self._reports) >= self.size
+                and all(report.progress.file_size is not None
+                        for report in reports
+                        if report.type is not ReportType.ERROR)):
+            file_size = sum(report.progress.file_size or 0
+                            for report in reports
+                            if report.type is not ReportType.ERROR)
+        speeds = [report.progress.speed for report in reports
+                  if report.type in (ReportType.START, ReportType.PROGRESS)
+                  and report.progress.speed is not None]
+        return ProgressReport(
+                file_size=file_size,
+                downloaded_size=sum(report.progress.downloaded_size
+                                    for report in reports),
+                elapsed_time=time.perf_counter() - self._start_time,
+                speed=sum(speeds) if speeds else None,
+                resumed_size=sum(report.progress.resumed_size
+                                 for report in reports))
+
+
+def message_urls(text: str) -> List[BatchEntry]:
+    # <url> or <url|label> in a slack message
+    return [BatchEntry(url=token.value, name=url_name(token.value))
+            for token in tokenize(text)
+            if token.type is TokenType.URL
+            and re.match(r'https?://[^\s]+$', token.value)]
+
+
+def url_name(url: str) -> str:
+    path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+    return pathlib.PurePosixPath(path).name or 'download'
+
+
+def parse_manifest(url: str, text: str) -> List[BatchEntry]:
+    # JSON: ["url", ...] or [{"url": "...", "name": "..."}, ...]
+    if text.lstrip().startswith(('[', '{')):
+        try:
+            data = json.loads(text)
+        except ValueError as error:
+            raise InvalidManifestError(url, str(error))
+        if isinstance(data, dict):
+            data = data.get('files', None)
+        if not isinstance(data, list):
+            raise InvalidManifestError(url, 'list of files is required')
+        return [_json_entry(url, item) for item in data]
+    # lines: "url" or "url name", '#' starts a comment
+    entries: List[BatchEntry] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        file_url, *name = line.split(maxsplit=1)
+        entries.append(_entry(url, file_url, name[0] if name else None))
+    return entries
+
+
+def fetch_manifest(
+        url: str,
+        timeout: Tuple[Optional[float], Optional[float]] = (30., 60.),
+        max_size: int = 1024 * 1024) -> List[BatchEntry]:
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            data.extend(chunk)
+            if len(data) > max_size:
+                raise InvalidManifestError(
+                        url,
+                        'larger than {0} bytes'.format(max_size))
+        encoding = response.encoding or 'utf-8'
+    return parse_manifest(url, data.decode(encoding, errors='replace'))
+
+
+def _json_entry(url: str, item: Any) -> BatchEntry:
+    if isinstance(item, str):
+        return _entry(url, item, None)
+    if isinstance(item, dict) and isinstance(item.get('url', None), str):
+        name = item.get('name', None)
+        return _entry(
+                url,
+                item['url'],
+                name if isinstance(name, str) else None)
+    raise InvalidManifestError(url, 'unexpected item {0!r}'.format(item))
+
+
+def _entry(url: str, file_url: str, name: Optional[str]) -> BatchEntry:
+    if urllib.parse.urlsplit(file_url).scheme not in ('http', 'https'):
+        raise InvalidManifestError(url, 'invalid url {0!r}'.format(file_url))
+    # a remote manifest must not escape the destination directory
+    if name is not None:
+        name = pathlib.PurePosixPath(name).name
+    return BatchEntry(url=file_url, name=name or url_name(file_url))
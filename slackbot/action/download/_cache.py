@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import pathlib
+from typing import Dict, MutableMapping, NamedTuple, Optional
+from ... import Option, OptionList
+
+
+class CacheOption(NamedTuple):
+    directory: Optional[pathlib.Path]
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['CacheOption']:
+        return OptionList(
+            CacheOption,
+            name,
+            [Option('directory',
+                    action=lambda x: (
+                            pathlib.Path().joinpath(x)
+                            if x is not None
+                            else None),
+                    help=('directory of the http cache metadata'
+                          ' (disabled if not set)'))],
+            help=help)
+
+
+class CacheEntry(NamedTuple):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: int
+    path: str
+
+    def request_header(self) -> Dict[str, str]:
+        header = {}
+        if self.etag is not None:
+            header['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            header['If-Modified-Since'] = self.last_modified
+        return header
+
+
+class HttpCache:
+    def __init__(self, directory: pathlib.Path) -> None:
+        self._directory = directory
+
+    def entry(self, url: str) -> Optional[CacheEntry]:
+        path = self._entry_path(url)
+        if not path.exists():
+            return None
+        try:
+            with path.open() as fin:
+                entry = CacheEntry(**json.load(fin))
+        except (OSError, ValueError, TypeError):
+            return None
+        # the cached file must be unchanged
+        cached_file = pathlib.Path(entry.path)
+        if (not cached_file.exists()
+                or cached_file.stat().st_size != entry.size
+                or (entry.etag is None and entry.last_modified is None)):
+            return None
+        return entry
+
+    def save(
+            self,
+            url: str,
+            header: MutableMapping[str, str],
+            size: int,
+            path: pathlib.Path) -> None:
+        entry = CacheEntry(
+                url=url,
+                etag=header.get('ETag', None),
+                last_modified=header.get('Last-Modified', None),
+                size=size,
+                path=path.resolve().as_posix())
+        if entry.etag is None and entry.last_modified is None:
+            return
+        entry_path = self._entry_path(url)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = entry_path.with_name('{0}.tmp'.format(entry_path.name))
+        with temp_path.open('w') as fout:
+            json.dump(entry._asdict(), fout)
+        temp_path.replace(entry_path)
+
+    def _entry_path(self, url: str) -> pathlib.Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self._directory.joinpath(key[:2], key[2:])
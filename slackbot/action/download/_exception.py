@@ -36,3 +36,24 @@ class IncompleteDownloadError(DownloadException):
     @property
     def progress(self) -> ProgressReport:
         return self._progress
+
+
+class DownloadRejected(DownloadException):
+    def __init__(self, reason: str) -> None:
+        super().__init__(message='download rejected: {0}'.format(reason))
+        self._reason = reason
+
+    @property
+    def reason(self) -> str:
+        return self._reason
+
+
+class InvalidManifestError(DownloadException):
+    def __init__(self, url: str, reason: str) -> None:
+        super().__init__(
+                message='invalid manifest <{0}>: {1}'.format(url, reason))
+        self._url = url
+
+    @property
+    def url(self) -> str:
+        return self._url
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import enum
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional
+from ... import Option, OptionList
+from ._exception import DownloadCancelled
+from ._report import Report, ReportQueue, ReportType
+
+
+class JournalOption(NamedTuple):
+    path: Optional[pathlib.Path]
+    compaction_threshold: int
+    fsync: bool
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['JournalOption']:
+        return OptionList(
+            JournalOption,
+            name,
+            [Option('path',
+                    action=lambda x: (
+                            pathlib.Path().joinpath(x)
+                            if x is not None
+                            else None),
+                    help=('journal file of download jobs'
+                          ' (disabled if not set)')),
+             Option('compaction_threshold',
+                    default=1000,
+                    type=int,
+                    help=('number of appended events'
+                          ' to compact the journal')),
+             Option('fsync',
+                    type=bool,
+                    default=False,
+                    help='fsync the journal on every event')],
+            help=help)
+
+
+class JobEvent(enum.Enum):
+    QUEUED = 'queued'
+    STARTED = 'started'
+    PROGRESS = 'progress'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    INTERRUPTED = 'interrupted'
+    REQUEUED = 'requeued'
+
+
+class JobRecord(NamedTuple):
+    job: str
+    url: str
+    path: str
+    info: Any
+    event: JobEvent
+    downloaded_size: int
+
+    def is_unfinished(self) -> bool:
+        return self.event in (
+                JobEvent.QUEUED,
+                JobEvent.STARTED,
+                JobEvent.PROGRESS,
+                JobEvent.INTERRUPTED)
+
+
+class Journal:
+    def __init__(self, option: JournalOption) -> None:
+        assert option.path is not None
+        self._option = option
+        self._path: pathlib.Path = option.path
+        self._lock = threading.Lock()
+        # prefix of the job keys written by this process
+        self._session = uuid.uuid4().hex[:8]
+        self._appended_count = 0
+
+    def job_key(self, job_id: int) -> str:
+        return '{0}:{1}'.format(self._session, job_id)
+
+    def queued(
+            self,
+            job_id: int,
+            url: str,
+            path: pathlib.Path,
+            info: Any) -> None:
+        self._append({'event': JobEvent.QUEUED.value,
+                      'job': self.job_key(job_id),
+                      'url': url,
+                      'path': path.as_posix(),
+                      'info': info})
+
+    def requeued(self, record: JobRecord) -> None:
+        self._append({'event': JobEvent.REQUEUED.value, 'job': record.job})
+
+    def report(self, report: Report[Any]) -> None:
+        # post-processing does not change the state of the job
+        if report.type in (ReportType.PROCESSED, ReportType.PROCESS_ERROR):
+            return
+        data: Dict[str, Any] = {'job': self.job_key(report.job_id)}
+        if report.type is ReportType.START:
+            data['event'] = JobEvent.STARTED.value
+        elif report.type is ReportType.PROGRESS:
+            data['event'] = JobEvent.PROGRESS.value
+            data['downloaded_size'] = report.progress.downloaded_size
+        elif report.type is ReportType.FINISH:
+            data['event'] = JobEvent.FINISHED.value
+        elif isinstance(report.error, DownloadCancelled):
+            # cancelled by stop(): resume after restart
+            data['event'] = JobEvent.INTERRUPTED.value
+            data['downloaded_size'] = report.progress.downloaded_size
+        else:
+            data['event'] = JobEvent.FAILED.value
+            data['error'] = str(report.error)
+        self._append(data)
+
+    def unfinished_jobs(self) -> List[JobRecord]:
+        with self._lock:
+            return [record for record in self._replay().values()
+                    if record.is_unfinished()]
+
+    def compact(self) -> None:
+        with self._lock:
+            self._compact()
+
+    def _append(self, data: Dict[str, Any]) -> None:
+        data['time'] = time.time()
+        line = '{0}\n'.format(json.dumps(data))
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with self._path.open('a') as fout:
+                fout.write(line)
+                if self._option.fsync:
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            self._appended_count += 1
+            if self._appended_count >= self._option.compaction_threshold:
+                self._compact()
+
+    def _replay(self) -> Dict[str, JobRecord]:
+        records: Dict[str, JobRecord] = {}
+        if not self._path.exists():
+            return records
+        with self._path.open() as fin:
+            for line in fin:
+                try:
+                    data = json.loads(line)
+                    event = JobEvent(data['event'])
+                except (ValueError, KeyError):
+                    # torn write of a crash
+                    continue
+                job = data.get('job', None)
+                if event is JobEvent.QUEUED:
+                    records[job] = JobRecord(
+                            job=job,
+                            url=data['url'],
+                            path=data['path'],
+                            info=data['info'],
+                            event=JobEvent.QUEUED,
+                            downloaded_size=0)
+                elif job in records:
+                    records[job] = records[job]._replace(
+                            event=event,
+                            downloaded_size=data.get(
+                                    'downloaded_size',
+                                    records[job].downloaded_size))
+        return records
+
+    def _compact(self) -> None:
+        # keep only the latest state of unfinished jobs
+        lines: List[str] = []
+        for record in self._replay().values():
+            if not record.is_unfinished():
+                continue
+            lines.append('{0}\n'.format(json.dumps({
+                    'event': JobEvent.QUEUED.value,
+                    'job': record.job,
+                    'url': record.url,
+                    'path': record.path,
+                    'info': record.info})))
+            if record.event is not JobEvent.QUEUED:
+                lines.append('{0}\n'.format(json.dumps({
+                        'event': record.event.value,
+                        'job': record.job,
+                        'downloaded_size': record.downloaded_size})))
+        temp_path = self._path.with_name('{0}.tmp'.format(self._path.name))
+        with temp_path.open('w') as fout:
+            fout.writelines(lines)
+            fout.flush()
+            os.fsync(fout.fileno())
+        temp_path.replace(self._path)
+        self._appended_count = 0
+
+
+class JournalReportQueue:
+    def __init__(self, journal: Journal, report_queue: ReportQueue) -> None:
+        self._journal = journal
+        self._report_queue = report_queue
+
+    def put(self, item: Report[Any]) -> None:
+        self._journal.report(item)
+        self._report_queue.put(item)
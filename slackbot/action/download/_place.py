@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pathlib
+import re
+import shutil
+import threading
+from typing import Callable, Dict, Tuple
+
+
+class SuffixIndex:
+    # next free '{stem}_{i}{suffix}' of each name in each directory
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._index: Dict[pathlib.Path, Dict[Tuple[str, str], int]] = {}
+
+    def next(self, destination: pathlib.Path) -> pathlib.Path:
+        key = (destination.stem, destination.suffix)
+        with self._lock:
+            names = self._index.get(destination.parent, None)
+            if names is None:
+                # scan the directory once to continue after a restart
+                names = _scan_suffix(destination.parent)
+                self._index[destination.parent] = names
+            i = names.get(key, 0)
+            names[key] = i + 1
+        return destination.with_name('{0}_{1}{2}'.format(
+                destination.stem,
+                i,
+                destination.suffix))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index.clear()
+
+
+_suffix_index = SuffixIndex()
+
+
+def move_file(
+        source: pathlib.Path,
+        destination: pathlib.Path,
+        index: SuffixIndex = _suffix_index) -> pathlib.Path:
+    return place_file(source, destination, _move_exclusive, index)
+
+
+def link_file(
+        source: pathlib.Path,
+        destination: pathlib.Path,
+        index: SuffixIndex = _suffix_index) -> pathlib.Path:
+    # already linked
+    if destination.exists() and os.path.samefile(source, destination):
+        return destination
+    return place_file(source, destination, _link_exclusive, index)
+
+
+def place_file(
+        source: pathlib.Path,
+        destination: pathlib.Path,
+        place: Callable[[pathlib.Path, pathlib.Path], None],
+        index: SuffixIndex = _suffix_index) -> pathlib.Path:
+    # place() fails with FileExistsError instead of overwriting,
+    # so that no lock is needed between threads and processes
+    path = destination
+    while True:
+        try:
+            place(source, path)
+            return path
+        except FileExistsError:
+            path = index.next(destination)
+
+
+def _move_exclusive(source: pathlib.Path, path: pathlib.Path) -> None:
+    try:
+        os.link(source.as_posix(), path.as_posix())
+    except FileExistsError:
+        raise
+    except OSError:
+        # hardlink is not available: reserve the name, then overwrite it
+        _reserve(path)
+        shutil.move(source.as_posix(), path.as_posix())
+        return
+    source.unlink()
+
+
+def _link_exclusive(source: pathlib.Path, path: pathlib.Path) -> None:
+    try:
+        os.link(source.as_posix(), path.as_posix())
+    except FileExistsError:
+        raise
+    except OSError:
+        # hardlink is not available (e.g. across file systems)
+        _reserve(path)
+        shutil.copy2(source.as_posix(), path.as_posix())
+
+
+def _reserve(path: pathlib.Path) -> None:
+    fd = os.open(path.as_posix(), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    os.close(fd)
+
+
+def _scan_suffix(directory: pathlib.Path) -> Dict[Tuple[str, str], int]:
+    names: Dict[Tuple[str, str], int] = {}
+    if not directory.is_dir():
+        return names
+    pattern = re.compile(r'(?P<stem>.*)_(?P<index>[0-9]+)')
+    with os.scandir(directory.as_posix()) as entries:
+        for entry in entries:
+            path = pathlib.Path(entry.name)
+            match = pattern.fullmatch(path.stem)
+            if match is None:
+                continue
+            key = (match.group('stem'), path.suffix)
+            names[key] = max(names.get(key, 0), int(match.group('index')) + 1)
+    return names
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import hashlib
+import importlib
+import multiprocessing
+import pathlib
+import posixpath
+import shutil
+import tarfile
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from ... import Option, OptionList
+from ._place import place_file
+from ._report import Report, ReportQueue, ReportType
+
+
+class PostProcessOption(NamedTuple):
+    hooks: List[str]
+    max_workers: int
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['PostProcessOption']:
+        return OptionList(
+            PostProcessOption,
+            name,
+            [Option('hooks',
+                    action=lambda x: (
+                            [] if x is None
+                            else [x] if isinstance(x, str)
+                            else x),
+                    default=None,
+                    help=('hooks run on each saved file in worker processes'
+                          ': sha256, extract, thumbnail'
+                          ' or "module:function" (list or string)')),
+             Option('max_workers',
+                    default=2,
+                    type=int,
+                    help='number of worker processes')],
+            help=help)
+
+
+class PostProcessor:
+    def __init__(self, option: PostProcessOption) -> None:
+        self._option = option
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = (
+                None)
+        # pending hooks to be cancelled on shutdown
+        self._futures: Set[concurrent.futures.Future] = set()
+
+    @property
+    def hooks(self) -> List[str]:
+        return self._option.hooks
+
+    def submit(
+            self,
+            report: Report[Any],
+            report_queue: ReportQueue) -> None:
+        assert report.saved_path is not None
+        for hook in self._option.hooks:
+            try:
+                future = self._submit(hook, report.saved_path.as_posix())
+            except (concurrent.futures.process.BrokenProcessPool,
+                    RuntimeError) as error:
+                # report the error instead of failing the download
+                future = concurrent.futures.Future()
+                future.set_exception(error)
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._discard)
+            future.add_done_callback(functools.partial(
+                    _put_result,
+                    report,
+                    hook,
+                    report_queue))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            # cancel_futures of shutdown() requires python 3.9
+            futures = list(self._futures)
+            self._futures.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        for future in futures:
+            future.cancel()
+
+    def _discard(self, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def _submit(self, hook: str, path: str) -> concurrent.futures.Future:
+        with self._lock:
+            for _ in range(2):
+                if self._executor is None:
+                    # fork is unsafe in the threaded bot process
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                            max_workers=max(self._option.max_workers, 1),
+                            mp_context=multiprocessing.get_context('spawn'))
+                try:
+                    return self._executor.submit(run_hook, hook, path)
+                except concurrent.futures.process.BrokenProcessPool:
+                    # a worker died: restart the pool
+                    self._executor = None
+            raise concurrent.futures.process.BrokenProcessPool(
+                    'failed to restart the worker processes')
+
+
+class PostProcessReportQueue:
+    def __init__(
+            self,
+            post_processor: PostProcessor,
+            report_queue: ReportQueue) -> None:
+        self._post_processor = post_processor
+        self._report_queue = report_queue
+
+    def put(self, item: Report[Any]) -> None:
+        self._report_queue.put(item)
+        if item.type is ReportType.FINISH and item.saved_path is not None:
+            self._post_processor.submit(item, self._report_queue)
+
+
+def run_hook(hook: str, path: str) -> str:
+    # executed in a worker process
+    function = _builtin_hooks.get(hook, None) or _import_hook(hook)
+    return str(function(pathlib.Path(path)))
+
+
+def sha256(path: pathlib.Path) -> str:
+    hasher = hashlib.sha256()
+    with path.open('rb') as fin:
+        for chunk in iter(lambda: fin.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return 'sha256:{0}'.format(hasher.hexdigest())
+
+
+def extract(path: pathlib.Path) -> str:
+    archive = _archive_directory(path)
+    if archive is None:
+        raise ValueError('unknown archive format: {0}'.format(path.name))
+    directory, archive_format = archive
+    kwargs: Dict[str, Any] = {}
+    if archive_format in _tar_formats:
+        # the filter is not available before python 3.8.17
+        _check_tar_members(path)
+        if hasattr(tarfile, 'data_filter'):
+            # (the zip unpacker does not accept filter)
+            kwargs['filter'] = 'data'
+    # a new directory not to overwrite the files extracted before
+    directory = place_file(path, directory, _make_directory)
+    shutil.unpack_archive(
+            path.as_posix(),
+            directory.as_posix(),
+            format=archive_format,
+            **kwargs)
+    count = sum(1 for child in directory.rglob('*') if child.is_file())
+    return 'extracted {0} files to {1}'.format(count, directory.name)
+
+
+def thumbnail(path: pathlib.Path, size: int = 256) -> str:
+    # Pillow is an optional dependency
+    from PIL import Image
+    thumbnail_path = path.with_name('{0}.thumbnail.png'.format(path.stem))
+    with Image.open(path.as_posix()) as image:
+        image.thumbnail((size, size))
+        image.save(thumbnail_path.as_posix(), format='PNG')
+    return 'thumbnail {0}'.format(thumbnail_path.name)
+
+
+_builtin_hooks: Dict[str, Callable[[pathlib.Path], Any]] = {
+        'sha256': sha256,
+        'extract': extract,
+        'thumbnail': thumbnail}
+
+
+_tar_formats = ('tar', 'gztar', 'bztar', 'xztar')
+
+
+def _archive_directory(
+        path: pathlib.Path) -> Optional[Tuple[pathlib.Path, str]]:
+    # archive.tar.gz -> archive/, gztar
+    for name, extensions, _ in shutil.get_unpack_formats():
+        for extension in extensions:
+            if path.name.endswith(extension):
+                return path.with_name(path.name[:-len(extension)]), name
+    return None
+
+
+def _check_tar_members(path: pathlib.Path) -> None:
+    # only files & directories in the extracted directory
+    with tarfile.open(path.as_posix()) as archive:
+        for member in archive.getmembers():
+            if not (member.isfile() or member.isdir()):
+                raise ValueError('unsafe archive member: {0}'.format(
+                        member.name))
+            name = posixpath.normpath(member.name)
+            if (name.startswith('/')
+                    or name == '..'
+                    or name.startswith('../')):
+                raise ValueError('archive member out of directory: {0}'.format(
+                        member.name))
+
+
+def _make_directory(source: pathlib.Path, path: pathlib.Path) -> None:
+    path.mkdir()
+
+
+def _import_hook(hook: str) -> Callable[[pathlib.Path], Any]:
+    module_name, _, function_name = hook.partition(':')
+    if not function_name:
+        raise ValueError('unknown hook: {0}'.format(hook))
+    function = getattr(importlib.import_module(module_name), function_name)
+    if not callable(function):
+        raise ValueError('hook is not callable: {0}'.format(hook))
+    return function
+
+
+def _put_result(
+        report: Report[Any],
+        hook: str,
+        report_queue: ReportQueue,
+        future: concurrent.futures.Future) -> None:
+    if future.cancelled():
+        return
+    error = future.exception()
+    report_queue.put(Report(
+            type=(ReportType.PROCESSED
+                  if error is None
+                  else ReportType.PROCESS_ERROR),
+            info=report.info,
+            url=report.url,
+            path=report.path,
+            temp_path=report.temp_path,
+            final_url=report.final_url,
+            response_header=report.response_header,
+            progress=report.progress,
+            saved_path=report.saved_path,
+            error=error if isinstance(error, Exception) else None,
+            job_id=report.job_id,
+            source=report.source,
+            digest=report.digest,
+            hook=hook,
+            result=future.result() if error is None else None))
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import enum
+import math
 import time
-from typing import Deque, NamedTuple, Optional
+from typing import Callable, Deque, NamedTuple, Optional
+
+
+class SpeedMeterMode(enum.Enum):
+    CHUNK = enum.auto()
+    WINDOW = enum.auto()
+    EWMA = enum.auto()
 
 
 class SpeedMeter:
@@ -10,13 +18,13 @@ class SpeedMeter:
         value: float
         time: float
 
-    def __init__(self, size: int) -> None:
+    def __init__(self, size: Optional[int]) -> None:
         self._deque: Deque[SpeedMeter.Data] = collections.deque(maxlen=size)
 
-    def push(self, value: float) -> None:
+    def push(self, value: float, time_: Optional[float] = None) -> None:
         self._deque.append(SpeedMeter.Data(
                 value=value,
-                time=time.perf_counter()))
+                time=time_ if time_ is not None else time.perf_counter()))
 
     def speed(self) -> Optional[float]:
         if not self._deque:
@@ -26,11 +34,76 @@ class SpeedMeter:
         return valuedelta / timedelta if timedelta != 0 else None
 
 
+class TimeWindowSpeedMeter(SpeedMeter):
+    # one sample per time bucket: the memory does not grow with the speed
+    buckets = 16
+
+    def __init__(self, window: float) -> None:
+        super().__init__(size=self.buckets + 2)
+        self._window = window
+        self._bucket_size = window / self.buckets
+        self._bucket_time = 0.
+
+    def push(self, value: float, time_: Optional[float] = None) -> None:
+        time_ = time_ if time_ is not None else time.perf_counter()
+        # the latest sample in the current bucket is replaced
+        if (len(self._deque) > 1
+                and time_ - self._bucket_time < self._bucket_size):
+            self._deque[-1] = SpeedMeter.Data(value=value, time=time_)
+            return
+        super().push(value, time_)
+        self._bucket_time = time_
+        # keep one sample at or before the window start
+        latest = self._deque[-1].time
+        while (len(self._deque) > 2
+               and latest - self._deque[1].time >= self._window):
+            self._deque.popleft()
+
+
+class EWMASpeedMeter(SpeedMeter):
+    def __init__(self, time_constant: float) -> None:
+        super().__init__(size=0)
+        self._time_constant = time_constant
+        self._latest: Optional[SpeedMeter.Data] = None
+        self._speed: Optional[float] = None
+
+    def push(self, value: float, time_: Optional[float] = None) -> None:
+        data = SpeedMeter.Data(
+                value=value,
+                time=time_ if time_ is not None else time.perf_counter())
+        latest, self._latest = self._latest, data
+        if latest is None or data.time <= latest.time:
+            return
+        timedelta = data.time - latest.time
+        speed = (data.value - latest.value) / timedelta
+        if self._speed is None:
+            self._speed = speed
+        else:
+            alpha = 1.0 - math.exp(-timedelta / self._time_constant)
+            self._speed += alpha * (speed - self._speed)
+
+    def speed(self) -> Optional[float]:
+        return self._speed
+
+
+def create_speedmeter(
+        mode: SpeedMeterMode,
+        size: int,
+        window: float) -> SpeedMeter:
+    if mode is SpeedMeterMode.WINDOW:
+        return TimeWindowSpeedMeter(window)
+    if mode is SpeedMeterMode.EWMA:
+        return EWMASpeedMeter(window)
+    return SpeedMeter(size)
+
+
 class ProgressReport(NamedTuple):
     file_size: Optional[int]
     downloaded_size: int
     elapsed_time: float
     speed: Optional[float]
+    resumed_size: int = 0
+    bandwidth: Optional[float] = None
 
     @property
     def remaining_size(self) -> Optional[int]:
@@ -48,7 +121,7 @@ class ProgressReport(NamedTuple):
     def average_speed(self) -> Optional[float]:
         if self.elapsed_time <= 0:
             return None
-        return self.downloaded_size / self.elapsed_time
+        return (self.downloaded_size - self.resumed_size) / self.elapsed_time
 
     @property
     def remaining_time(self) -> Optional[float]:
@@ -64,18 +137,27 @@ class Progress:
     def __init__(
             self,
             file_size: Optional[int],
-            speedmeter_size: int) -> None:
+            speedmeter: SpeedMeter,
+            resumed_size: int = 0,
+            bandwidth: Optional[Callable[[], Optional[float]]] = None
+            ) -> None:
         self._start_time = time.perf_counter()
         self._latest_time = self._start_time
         self._file_size = file_size
-        self._downloaded_size = 0
-        self._speedmeter = SpeedMeter(speedmeter_size)
-        self._speedmeter.push(0)
+        self._resumed_size = resumed_size
+        self._downloaded_size = resumed_size
+        self._speedmeter = speedmeter
+        self._bandwidth = bandwidth
+        self._speedmeter.push(resumed_size, self._start_time)
 
     def update(self, received_size: int) -> None:
         self._downloaded_size += received_size
         self._latest_time = time.perf_counter()
-        self._speedmeter.push(self._downloaded_size)
+        self._speedmeter.push(self._downloaded_size, self._latest_time)
+
+    @property
+    def downloaded_size(self) -> int:
+        return self._downloaded_size
 
     def is_completed(self) -> bool:
         return (self._file_size is None
@@ -86,7 +168,11 @@ class Progress:
                 file_size=self._file_size,
                 downloaded_size=self._downloaded_size,
                 elapsed_time=self._latest_time - self._start_time,
-                speed=self._speedmeter.speed())
+                speed=self._speedmeter.speed(),
+                resumed_size=self._resumed_size,
+                bandwidth=(self._bandwidth()
+                           if self._bandwidth is not None
+                           else None))
 
 
 class ProgressReportTimer:
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import enum
+import itertools
 import pathlib
+import queue
+import threading
 from typing import (
-        Generic, MutableMapping, Optional, TypeVar, Union, TYPE_CHECKING)
+        Any, Generic, List, MutableMapping, Optional, Protocol, TypeVar,
+        Union)
 import requests
 from ._progress import ProgressReport
-if TYPE_CHECKING:
-    import queue
+from ._store import ContentSource
 
 
 ReportInfo = TypeVar('ReportInfo')
+_job_id = itertools.count(1)
 
 
 class ReportType(enum.Enum):
@@ -18,6 +23,8 @@ class ReportType(enum.Enum):
     PROGRESS = enum.auto()
     FINISH = enum.auto()
     ERROR = enum.auto()
+    PROCESSED = enum.auto()
+    PROCESS_ERROR = enum.auto()
 
 
 class Report(Generic[ReportInfo]):
@@ -32,7 +39,12 @@ class Report(Generic[ReportInfo]):
             response_header: Optional[MutableMapping[str, str]],
             progress: ProgressReport,
             saved_path: Optional[pathlib.Path] = None,
-            error: Optional[Exception] = None) -> None:
+            error: Optional[Exception] = None,
+            job_id: int = 0,
+            source: ContentSource = ContentSource.DOWNLOAD,
+            digest: Optional[str] = None,
+            hook: Optional[str] = None,
+            result: Optional[str] = None) -> None:
         self.type = type
         self.info = info
         self.url = url
@@ -43,10 +55,16 @@ class Report(Generic[ReportInfo]):
         self.progress = progress
         self.saved_path = saved_path
         self.error = error
+        self.job_id = job_id
+        self.source = source
+        self.digest = digest
+        self.hook = hook
+        self.result = result
 
     def __repr__(self) -> str:
         keys = ['type', 'info', 'url', 'path', 'temp_path', 'final_url',
-                'response_header', 'progress', 'saved_path', 'error']
+                'response_header', 'progress', 'saved_path', 'error',
+                'job_id', 'source', 'digest', 'hook', 'result']
         return '{0}.{1}({2})'.format(
                 self.__class__.__module__,
                 self.__class__.__name__,
@@ -72,14 +90,73 @@ class Report(Generic[ReportInfo]):
                 .format(value=value / unit, unit=prefix_list[unit_index]))
 
 
+def new_job_id() -> int:
+    return next(_job_id)
+
+
+class ReportQueue(Protocol):
+    def put(self, item: Report[Any]) -> None:
+        ...
+
+
+class AsyncReportQueue(Generic[ReportInfo]):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional['asyncio.Queue[Report[ReportInfo]]'] = None
+        # reports put before bind()
+        self._buffer: 'queue.Queue[Report[ReportInfo]]' = queue.Queue()
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        # call in the event loop thread
+        with self._lock:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            while not self._buffer.empty():
+                self._queue.put_nowait(self._buffer.get())
+
+    def is_bound(self) -> bool:
+        return self._loop is not None
+
+    def put(self, item: Report[ReportInfo]) -> None:
+        # thread-safe: wake up the event loop
+        with self._lock:
+            if self._loop is None or self._queue is None:
+                self._buffer.put(item)
+            else:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    async def get(self) -> Report[ReportInfo]:
+        assert self._queue is not None
+        return await self._queue.get()
+
+    def get_all_nowait(self) -> List[Report[ReportInfo]]:
+        assert self._queue is not None
+        result: List[Report[ReportInfo]] = []
+        while not self._queue.empty():
+            result.append(self._queue.get_nowait())
+        return result
+
+
+def drop_superseded(
+        reports: List[Report[ReportInfo]]) -> List[Report[ReportInfo]]:
+    # a progress report is stale if a later report of the job follows
+    latest = {report.job_id: i for i, report in enumerate(reports)}
+    return [report for i, report in enumerate(reports)
+            if report.type is not ReportType.PROGRESS
+            or latest[report.job_id] == i]
+
+
 class Reporter(Generic[ReportInfo]):
     def __init__(
             self,
             info: ReportInfo,
-            report_queue: 'queue.Queue[Report[ReportInfo]]',
+            report_queue: 'ReportQueue',
             url: str,
-            path: pathlib.Path) -> None:
+            path: pathlib.Path,
+            job_id: Optional[int] = None) -> None:
         self._report_queue = report_queue
+        self._job_id = job_id if job_id is not None else new_job_id()
         # report parameter
         self._info = info
         self._url = url
@@ -93,6 +170,8 @@ class Reporter(Generic[ReportInfo]):
                 elapsed_time=0.,
                 speed=None)
         self._saved_path: Optional[pathlib.Path] = None
+        self._source = ContentSource.DOWNLOAD
+        self._digest: Optional[str] = None
         self._error: Optional[Exception] = None
 
     def start(
@@ -117,8 +196,12 @@ class Reporter(Generic[ReportInfo]):
     def finish(
             self,
             saved_path: pathlib.Path,
-            progress: ProgressReport) -> None:
+            progress: ProgressReport,
+            source: ContentSource = ContentSource.DOWNLOAD,
+            digest: Optional[str] = None) -> None:
         self._saved_path = saved_path
+        self._source = source
+        self._digest = digest
         self._progress = progress
         # report
         self.report(ReportType.FINISH)
@@ -141,7 +224,10 @@ class Reporter(Generic[ReportInfo]):
                 response_header=self._response_header,
                 progress=self._progress,
                 saved_path=self._saved_path,
-                error=self._error)
+                error=self._error,
+                job_id=self._job_id,
+                source=self._source,
+                digest=self._digest)
 
     def report(self, type: ReportType) -> None:
         self._report_queue.put(self.create_report(type))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import pathlib
+import re
+import threading
+from typing import MutableMapping, NamedTuple, Optional, Set
+
+
+class ResumeState(NamedTuple):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    file_size: Optional[int]
+    downloaded_size: int
+
+    def validator(self) -> Optional[str]:
+        # If-Range requires a strong ETag or a Last-Modified date
+        if self.etag is not None and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+    def is_valid(self, header: MutableMapping[str, str]) -> bool:
+        if self.etag is not None and 'ETag' in header:
+            return self.etag == header['ETag']
+        if self.last_modified is not None and 'Last-Modified' in header:
+            return self.last_modified == header['Last-Modified']
+        return False
+
+    @staticmethod
+    def create(
+            url: str,
+            header: MutableMapping[str, str],
+            file_size: Optional[int],
+            downloaded_size: int) -> 'ResumeState':
+        return ResumeState(
+                url=url,
+                etag=header.get('ETag', None),
+                last_modified=header.get('Last-Modified', None),
+                file_size=file_size,
+                downloaded_size=downloaded_size)
+
+
+def partial_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name('{0}.part'.format(path.name))
+
+
+def state_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name('{0}.part.json'.format(path.name))
+
+
+def lock_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name('{0}.part.lock'.format(path.name))
+
+
+# lock files created by the jobs of this process
+_claimed: Set[pathlib.Path] = set()
+_claimed_lock = threading.Lock()
+
+
+def claim(path: pathlib.Path) -> bool:
+    # exclusive use of the partial file among the jobs & processes
+    lock_file = lock_path(path)
+    with _claimed_lock:
+        if lock_file in _claimed:
+            return False
+        for _ in range(2):
+            try:
+                fd = os.open(
+                        lock_file.as_posix(),
+                        os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                        0o644)
+            except FileExistsError:
+                if not _is_stale(lock_file):
+                    return False
+                # left by a process that has exited
+                try:
+                    lock_file.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as fout:
+                fout.write(str(os.getpid()))
+            _claimed.add(lock_file)
+            return True
+        return False
+
+
+def release(path: pathlib.Path) -> None:
+    lock_file = lock_path(path)
+    with _claimed_lock:
+        if lock_file not in _claimed:
+            return
+        _claimed.remove(lock_file)
+        try:
+            lock_file.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _is_stale(lock_file: pathlib.Path) -> bool:
+    try:
+        pid = int(lock_file.read_text())
+    except FileNotFoundError:
+        return True
+    except (OSError, ValueError):
+        # being written by another process
+        return False
+    # not claimed by a job of this process (the last run with the same pid)
+    if pid == os.getpid():
+        return True
+    # os.kill terminates the process on Windows
+    if os.name != 'posix':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def load_state(path: pathlib.Path) -> Optional[ResumeState]:
+    state_file = state_path(path)
+    if not state_file.exists():
+        return None
+    try:
+        with state_file.open() as fin:
+            return ResumeState(**json.load(fin))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_state(path: pathlib.Path, state: ResumeState) -> None:
+    state_file = state_path(path)
+    temp_file = state_file.with_name('{0}.tmp'.format(state_file.name))
+    with temp_file.open('w') as fout:
+        json.dump(state._asdict(), fout)
+    temp_file.replace(state_file)
+
+
+def remove_state(path: pathlib.Path) -> None:
+    state_file = state_path(path)
+    if state_file.exists():
+        state_file.unlink()
+
+
+def content_range_start(header: MutableMapping[str, str]) -> Optional[int]:
+    match = re.match(
+            r'bytes\s+(?P<start>\d+)-\d+/(\d+|\*)',
+            header.get('Content-Range', ''))
+    if match:
+        return int(match.group('start'))
+    return None
+
+
+def content_range_size(header: MutableMapping[str, str]) -> Optional[int]:
+    match = re.match(
+            r'bytes\s+\d+-\d+/(?P<size>\d+)',
+            header.get('Content-Range', ''))
+    if match:
+        return int(match.group('size'))
+    return None
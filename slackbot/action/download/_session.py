@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import urllib.parse
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+import requests
+import requests.adapters
+from ... import Option, OptionList
+
+
+class SessionOption(NamedTuple):
+    max_connections_per_host: int
+    connect_timeout: Optional[float]
+    read_timeout: Optional[float]
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['SessionOption']:
+        def to_timeout(value: Optional[str]) -> Optional[float]:
+            return float(value) if value is not None else None
+
+        return OptionList(
+            SessionOption,
+            name,
+            [Option('max_connections_per_host',
+                    default=4,
+                    type=int,
+                    help=('maximum number of simultaneous downloads'
+                          ' (keep-alive connections) per host')),
+             Option('connect_timeout',
+                    default=30.0,
+                    action=to_timeout,
+                    help='connection timeout (seconds)'),
+             Option('read_timeout',
+                    default=60.0,
+                    action=to_timeout,
+                    help='read timeout (seconds) between received data')],
+            help=help)
+
+
+class SessionPool:
+    def __init__(self, option: Optional[SessionOption] = None) -> None:
+        self._option = option or SessionOption.option_list(name='').parse()
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    @property
+    def timeout(self) -> Tuple[Optional[float], Optional[float]]:
+        return (self._option.connect_timeout, self._option.read_timeout)
+
+    def acquire(
+            self,
+            url: str,
+            is_canceled: Optional[Callable[[], bool]] = None,
+            interval: float = 1.0) -> Optional[requests.Session]:
+        host = _host(url)
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._create_session()
+                self._semaphores[host] = threading.BoundedSemaphore(
+                        max(self._option.max_connections_per_host, 1))
+            session = self._sessions[host]
+            semaphore = self._semaphores[host]
+        # wait for a free slot of the host
+        while not semaphore.acquire(timeout=interval):
+            if is_canceled is not None and is_canceled():
+                return None
+        return session
+
+    def release(self, url: str) -> None:
+        with self._lock:
+            semaphore = self._semaphores[_host(url)]
+        semaphore.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._semaphores.clear()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=max(self._option.max_connections_per_host, 1))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+def _host(url: str) -> str:
+    parsed = urllib.parse.urlsplit(url)
+    return '{0}://{1}'.format(parsed.scheme, parsed.netloc)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import enum
+import hashlib
+import json
+import pathlib
+import re
+import shutil
+from typing import MutableMapping, NamedTuple, Optional
+from ... import Option, OptionList
+
+
+class StoreOption(NamedTuple):
+    directory: Optional[pathlib.Path]
+    precheck: bool
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['StoreOption']:
+        return OptionList(
+            StoreOption,
+            name,
+            [Option('directory',
+                    action=lambda x: (
+                            pathlib.Path().joinpath(x)
+                            if x is not None
+                            else None),
+                    help=('directory of the content-addressed store'
+                          ' (disabled if not set)')),
+             Option('precheck',
+                    type=bool,
+                    default=False,
+                    help=('skip the download if the server reports'
+                          ' the SHA-256 digest of a stored file'))],
+            help=help)
+
+
+class ContentSource(enum.Enum):
+    DOWNLOAD = enum.auto()
+    STORE = enum.auto()
+    CACHE = enum.auto()
+
+
+class StoreRecord(NamedTuple):
+    url: str
+    digest: str
+    size: int
+
+
+class ContentStore:
+    def __init__(self, directory: pathlib.Path) -> None:
+        self._directory = directory
+
+    @property
+    def directory(self) -> pathlib.Path:
+        return self._directory
+
+    def object_path(self, digest: str) -> pathlib.Path:
+        return self._directory.joinpath('objects', digest[:2], digest[2:])
+
+    def add(self, source: pathlib.Path, digest: str) -> pathlib.Path:
+        path = self.object_path(digest)
+        if path.exists():
+            # duplicate content
+            source.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(source.as_posix(), path.as_posix())
+        return path
+
+    def record(self, url: str) -> Optional[StoreRecord]:
+        path = self._record_path(url)
+        if not path.exists():
+            return None
+        try:
+            with path.open() as fin:
+                record = StoreRecord(**json.load(fin))
+        except (OSError, ValueError, TypeError):
+            return None
+        if not self.object_path(record.digest).exists():
+            return None
+        return record
+
+    def save_record(self, record: StoreRecord) -> None:
+        path = self._record_path(record.url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name('{0}.tmp'.format(path.name))
+        with temp_path.open('w') as fout:
+            json.dump(record._asdict(), fout)
+        temp_path.replace(path)
+
+    def _record_path(self, url: str) -> pathlib.Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self._directory.joinpath('urls', key[:2], key[2:])
+
+
+def header_digest(header: MutableMapping[str, str]) -> Optional[str]:
+    # Repr-Digest: sha-256=:BASE64: (RFC 9530), Digest: SHA-256=BASE64
+    for key, pattern in (
+            ('Repr-Digest', r'(^|,)\s*sha-256=:(?P<value>[^:]+):'),
+            ('Digest', r'(^|,)\s*sha-256=(?P<value>[^,\s]+)')):
+        match = re.search(pattern, header.get(key, ''), flags=re.IGNORECASE)
+        if match:
+            try:
+                return base64.b64decode(match.group('value')).hex()
+            except (binascii.Error, ValueError):
+                return None
+    return None
@@ -1,26 +1,56 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import os
 import pathlib
 import re
-import shutil
 import tempfile
 import threading
-from typing import Generic, List, NamedTuple, Optional, TypeVar, TYPE_CHECKING
+import time
+from typing import (
+        Any, BinaryIO, Callable, Dict, Generic, Iterator, List, NamedTuple,
+        Optional, Tuple, TypeVar, Union, TYPE_CHECKING)
 import requests
 from ... import Option, OptionList
-from ._exception import DownloadCancelled, IncompleteDownloadError
-from ._report import Reporter
-from ._progress import Progress, ProgressReportTimer
+from . import _resume
+from ._admission import AdmissionOption
+from ._bandwidth import Allocation, BandwidthOption, BandwidthScheduler
+from ._cache import CacheEntry, CacheOption, HttpCache
+from ._exception import (
+        DownloadCancelled, DownloadRejected, IncompleteDownloadError)
+from ._journal import Journal, JournalOption, JournalReportQueue
+from ._place import link_file, move_file
+from ._postprocess import (
+        PostProcessOption, PostProcessor, PostProcessReportQueue)
+from ._report import Reporter, new_job_id
+from ._progress import (
+        Progress, ProgressReport, ProgressReportTimer, SpeedMeterMode,
+        create_speedmeter)
+from ._session import SessionOption, SessionPool
+from ._store import (
+        ContentSource, ContentStore, StoreOption, StoreRecord, header_digest)
 if TYPE_CHECKING:
-    import queue
-    from ._report import Report
+    from ._report import ReportQueue
 
 
 class ThreadOption(NamedTuple):
     chunk_size: int
     report_interval: float
     speedmeter_size: int
+    speedmeter_mode: SpeedMeterMode
+    speedmeter_window: float
     file_permission: Optional[int]
+    resume: bool
+    buffered: bool
+    max_buffer_size: int
+    preallocate: bool
+    session: SessionOption
+    bandwidth: BandwidthOption
+    store: StoreOption
+    cache: CacheOption
+    admission: AdmissionOption
+    journal: JournalOption
+    postprocess: PostProcessOption
 
     @staticmethod
     def option_list(
@@ -33,6 +63,12 @@ class ThreadOption(NamedTuple):
                 return int(match.group('permission'), base=8)
             return None
 
+        # translate to SpeedMeterMode
+        to_speedmeter_mode: Dict[str, SpeedMeterMode] = {
+                'chunk': SpeedMeterMode.CHUNK,
+                'window': SpeedMeterMode.WINDOW,
+                'ewma': SpeedMeterMode.EWMA}
+
         return OptionList(
             ThreadOption,
             name,
@@ -50,47 +86,119 @@ class ThreadOption(NamedTuple):
                     type=int,
                     help=('number of data chunks'
                           ' for download speed measurement')),
+             Option('speedmeter_mode',
+                    default='chunk',
+                    action=to_speedmeter_mode.get,
+                    choices=to_speedmeter_mode.keys(),
+                    help=('download speed measurement'
+                          ' over the last speedmeter_size chunks,'
+                          ' a time window or an EWMA')),
+             Option('speedmeter_window',
+                    default=10.0,
+                    type=float,
+                    help=('time window or EWMA time constant (seconds)'
+                          ' for download speed measurement')),
              Option('file_permission',
                     action=read_permission,
                     default='0o644',
-                    help='downloaded file permission (format: 0oXXX)')],
+                    help='downloaded file permission (format: 0oXXX)'),
+             Option('resume',
+                    type=bool,
+                    default=False,
+                    help=('keep the partial file on interruption'
+                          ' and resume it with a Range request')),
+             Option('buffered',
+                    type=bool,
+                    default=False,
+                    help=('read into a reusable buffer'
+                          ' with an adaptive chunk size'
+                          ' instead of chunk_size')),
+             Option('max_buffer_size',
+                    default=4 * 1024 * 1024,
+                    type=int,
+                    help='maximum buffer size (byte) in buffered mode'),
+             Option('preallocate',
+                    type=bool,
+                    default=True,
+                    help=('preallocate the file'
+                          ' when the file size is known')),
+             SessionOption.option_list(
+                    name='session',
+                    help='http session pool'),
+             BandwidthOption.option_list(
+                    name='bandwidth',
+                    help='bandwidth limit'),
+             StoreOption.option_list(
+                    name='store',
+                    help='content-addressed store for deduplication'),
+             CacheOption.option_list(
+                    name='cache',
+                    help='conditional requests for downloaded urls'),
+             AdmissionOption.option_list(
+                    name='admission',
+                    help='size and type check before downloading'),
+             JournalOption.option_list(
+                    name='journal',
+                    help='journal to resume download jobs after restart'),
+             PostProcessOption.option_list(
+                    name='postprocess',
+                    help='processing of saved files in worker processes')],
             help=help)
 
 
 ReportInfo = TypeVar('ReportInfo')
+_MIN_BUFFER_SIZE = 64 * 1024
+_TARGET_READ_TIME = 0.1
 
 
 class Controller:
     def __init__(self) -> None:
-        self._lock = threading.Lock()
-        self._is_finished = False
-        self._is_canceled = False
+        # Event.is_set() reads a flag without taking a lock
+        self._is_finished = threading.Event()
+        self._is_canceled = threading.Event()
 
     def finish(self) -> None:
-        with self._lock:
-            self._is_finished = True
+        self._is_finished.set()
 
     def is_finished(self) -> bool:
-        with self._lock:
-            return self._is_finished
+        return self._is_finished.is_set()
 
     def cancel(self) -> None:
-        with self._lock:
-            self._is_canceled = True
+        self._is_canceled.set()
 
     def is_canceled(self) -> bool:
-        with self._lock:
-            return self._is_canceled
+        return self._is_canceled.is_set()
 
 
 class ThreadGenerator(Generic[ReportInfo]):
     def __init__(
             self,
-            report_queue: 'queue.Queue[Report[ReportInfo]]',
-            option: Optional[ThreadOption] = None) -> None:
+            report_queue: 'ReportQueue',
+            option: Optional[ThreadOption] = None,
+            encode_info: Optional[Callable[[ReportInfo], Any]] = None
+            ) -> None:
         self._option = option
         self._report_queue = report_queue
         self._controllers: List[Controller] = []
+        # journal
+        self._journal: Optional[Journal] = None
+        if option is not None and option.journal.path is not None:
+            self._journal = Journal(option.journal)
+            self._report_queue = JournalReportQueue(
+                    self._journal,
+                    report_queue)
+        # post-processing
+        self._post_processor: Optional[PostProcessor] = None
+        if option is not None and option.postprocess.hooks:
+            self._post_processor = PostProcessor(option.postprocess)
+            self._report_queue = PostProcessReportQueue(
+                    self._post_processor,
+                    self._report_queue)
+        self._encode_info = encode_info
+        self._session_pool = SessionPool(
+                option.session if option is not None else None)
+        self._bandwidth_scheduler = BandwidthScheduler(
+                option.bandwidth if option is not None else None)
 
     def start(
             self,
@@ -98,14 +206,43 @@ class ThreadGenerator(Generic[ReportInfo]):
             path: pathlib.Path,
             info: ReportInfo) -> None:
         self.cleanup()
+        job_id = new_job_id()
+        if self._journal is not None:
+            self._journal.queued(
+                    job_id,
+                    url,
+                    path,
+                    self._encode_info(info)
+                    if self._encode_info is not None
+                    else None)
         controller = download(
                 url=url,
                 path=path,
                 info=info,
                 report_queue=self._report_queue,
-                option=self._option)
+                option=self._option,
+                session_pool=self._session_pool,
+                bandwidth_scheduler=self._bandwidth_scheduler,
+                job_id=job_id)
         self._controllers.append(controller)
 
+    def recover(
+            self,
+            decode_info: Callable[[Any], Optional[ReportInfo]]) -> int:
+        # restart the unfinished jobs in the journal
+        if self._journal is None:
+            return 0
+        count = 0
+        for record in self._journal.unfinished_jobs():
+            self._journal.requeued(record)
+            info = decode_info(record.info)
+            if info is None:
+                continue
+            self.start(record.url, pathlib.Path(record.path), info)
+            count += 1
+        self._journal.compact()
+        return count
+
     def cleanup(self) -> None:
         for controller in self._controllers[:]:
             if controller.is_finished():
@@ -115,14 +252,19 @@ class ThreadGenerator(Generic[ReportInfo]):
         self.cleanup()
         for controller in self._controllers:
             controller.cancel()
+        if self._post_processor is not None:
+            self._post_processor.shutdown()
 
 
 def download(
         url: str,
         path: pathlib.Path,
         info: ReportInfo,
-        report_queue: 'queue.Queue[Report[ReportInfo]]',
-        option: Optional[ThreadOption] = None) -> Controller:
+        report_queue: 'ReportQueue',
+        option: Optional[ThreadOption] = None,
+        session_pool: Optional[SessionPool] = None,
+        bandwidth_scheduler: Optional[BandwidthScheduler] = None,
+        job_id: Optional[int] = None) -> Controller:
     controller = Controller()
     thread = threading.Thread(
             target=lambda: _download(
@@ -131,7 +273,10 @@ def download(
                     info=info,
                     report_queue=report_queue,
                     option=option,
-                    controller=controller))
+                    controller=controller,
+                    session_pool=session_pool,
+                    bandwidth_scheduler=bandwidth_scheduler,
+                    job_id=job_id))
     thread.start()
     return controller
 
@@ -140,91 +285,413 @@ def _download(
         url: str,
         path: pathlib.Path,
         info: ReportInfo,
-        report_queue: 'queue.Queue[Report[ReportInfo]]',
+        report_queue: 'ReportQueue',
         *,
         option: Optional[ThreadOption] = None,
-        controller: Optional[Controller] = None) -> None:
+        controller: Optional[Controller] = None,
+        session_pool: Optional[SessionPool] = None,
+        bandwidth_scheduler: Optional[BandwidthScheduler] = None,
+        job_id: Optional[int] = None) -> None:
     option = option or ThreadOption.option_list(name='').parse()
+    # session pool
+    is_temporary_pool = session_pool is None
+    if session_pool is None:
+        session_pool = SessionPool(option.session)
+    # bandwidth
+    if bandwidth_scheduler is None:
+        bandwidth_scheduler = BandwidthScheduler(option.bandwidth)
+    is_canceled = (controller.is_canceled
+                   if controller is not None
+                   else None)
+    # content-addressed store
+    store = (ContentStore(option.store.directory)
+             if option.store.directory is not None
+             else None)
+    # http cache
+    cache = (HttpCache(option.cache.directory)
+             if option.cache.directory is not None
+             else None)
     # reporter
     reporter = Reporter(
             info=info,
             report_queue=report_queue,
             url=url,
-            path=path)
+            path=path,
+            job_id=job_id)
     # mkdir
     if not path.parent.exists():
         path.parent.mkdir(parents=True)
     # download
     temp_file_path: Optional[pathlib.Path] = None
+    state: Optional[_resume.ResumeState] = None
+    progress: Optional[Progress] = None
+    session: Optional[requests.Session] = None
+    response: Optional[requests.Response] = None
+    allocation: Optional[Allocation] = None
+    is_claimed = False
     try:
-        with tempfile.NamedTemporaryFile(
-                mode='wb',
-                delete=False,
-                dir=path.parent.as_posix()) as temp_file:
-            temp_file_path = pathlib.Path(temp_file.name)
-            # streaming download
-            response = requests.get(url, stream=True)
-            # status code check
-            response.raise_for_status()
-            # progress
-            progress = Progress(
-                    file_size=(int(response.headers['Content-Length'])
-                               if 'Content-Length' in response.headers
-                               else None),
-                    speedmeter_size=option.speedmeter_size)
-            progress_timer = ProgressReportTimer(
-                    interval=option.report_interval)
-            # start report
-            reporter.start(
-                    temp_path=temp_file_path,
-                    response=response,
-                    progress=progress.report())
-            # download
-            for data in response.iter_content(
-                    chunk_size=option.chunk_size):
+        # wait for a connection slot of the host
+        session = session_pool.acquire(url, is_canceled=is_canceled)
+        if session is None:
+            raise DownloadCancelled(ProgressReport(
+                    file_size=None,
+                    downloaded_size=0,
+                    elapsed_time=0.,
+                    speed=None))
+        # skip the download if the content is already stored
+        if store is not None and option.store.precheck:
+            if _precheck_store(
+                    store,
+                    session,
+                    session_pool.timeout,
+                    url,
+                    path,
+                    option,
+                    reporter):
+                return
+        # temporary file
+        # the partial file is used by one job at a time,
+        # the others download to a unique file without resuming
+        if option.resume and _resume.claim(path):
+            is_claimed = True
+            temp_file_path = _resume.partial_path(path)
+            state = _load_resume_state(url, path, temp_file_path)
+        else:
+            with tempfile.NamedTemporaryFile(
+                    mode='wb',
+                    delete=False,
+                    dir=path.parent.as_posix()) as temp_file:
+                temp_file_path = pathlib.Path(temp_file.name)
+        # streaming download
+        cache_entry = cache.entry(url) if cache is not None else None
+        response, resumed_size = _request(
+                session,
+                session_pool.timeout,
+                url,
+                state,
+                cache_entry)
+        # not modified
+        if (response.status_code == requests.codes.not_modified
+                and cache_entry is not None):
+            if not is_claimed:
+                temp_file_path.unlink()
+            temp_file_path = None
+            _finish_from_cache(cache_entry, response, path, option, reporter)
+            return
+        # status code check
+        response.raise_for_status()
+        # size and type check
+        file_size = _file_size(response, resumed_size)
+        option.admission.check_header(
+                response.headers,
+                file_size,
+                resumed_size,
+                path.parent)
+        # bandwidth allocation
+        if bandwidth_scheduler.is_limited():
+            allocation = bandwidth_scheduler.register()
+        # progress
+        progress = Progress(
+                file_size=file_size,
+                speedmeter=create_speedmeter(
+                        mode=option.speedmeter_mode,
+                        size=option.speedmeter_size,
+                        window=option.speedmeter_window),
+                resumed_size=resumed_size,
+                bandwidth=(lambda: allocation.rate
+                           if allocation is not None
+                           else None))
+        progress_timer = ProgressReportTimer(
+                interval=option.report_interval)
+        # resume state
+        if is_claimed:
+            state = _resume.ResumeState.create(
+                    url=url,
+                    header=response.headers,
+                    file_size=progress.report().file_size,
+                    downloaded_size=resumed_size)
+            _resume.save_state(path, state)
+        # start report
+        reporter.start(
+                temp_path=temp_file_path,
+                response=response,
+                progress=progress.report())
+        # download
+        with temp_file_path.open(
+                mode='r+b' if resumed_size > 0 else 'wb') as temp_file:
+            temp_file.seek(resumed_size)
+            temp_file.truncate()
+            # preallocate
+            if option.preallocate and file_size is not None:
+                _preallocate(temp_file, resumed_size, file_size)
+            # SHA-256 of the content
+            hasher = (_hash_file(temp_file_path, resumed_size)
+                      if store is not None
+                      else None)
+            for data in _iter_chunks(response, option):
                 temp_file.write(data)
+                if hasher is not None:
+                    hasher.update(data)
                 # update progress
                 progress.update(len(data))
+                # the decoded size may exceed Content-Length (gzip)
+                option.admission.check_max_size(progress.downloaded_size)
+                # bandwidth limit
+                if allocation is not None:
+                    allocation.consume(len(data), is_canceled)
                 if progress_timer.check():
                     reporter.progress(progress=progress.report())
+                    if state is not None:
+                        temp_file.flush()
+                        state = state._replace(
+                            downloaded_size=progress.report().downloaded_size)
+                        _resume.save_state(path, state)
                 # check if cancelled
                 if controller is not None and controller.is_canceled():
                     raise DownloadCancelled(progress.report())
+            # discard preallocated space beyond the received data
+            temp_file.truncate()
         # complete check
         if not progress.is_completed():
             raise IncompleteDownloadError(progress.report())
+        option.admission.check_min_size(progress.downloaded_size)
         # move file
-        save_path = _move_file(temp_file_path, path)
+        digest: Optional[str] = None
+        if store is not None and hasher is not None:
+            digest = hasher.hexdigest()
+            cached_path = store.add(temp_file_path, digest)
+            save_path = link_file(cached_path, path)
+            store.save_record(StoreRecord(
+                    url=url,
+                    digest=digest,
+                    size=progress.report().downloaded_size))
+        else:
+            save_path = move_file(temp_file_path, path)
+            cached_path = save_path
         temp_file_path = None
+        if cache is not None:
+            cache.save(
+                    url,
+                    response.headers,
+                    progress.report().downloaded_size,
+                    cached_path)
+        if is_claimed:
+            _resume.remove_state(path)
         # chmod
         if option.file_permission is not None:
             save_path.chmod(option.file_permission)
         # finish report
         reporter.finish(
                 saved_path=save_path,
-                progress=progress.report())
+                progress=progress.report(),
+                digest=digest)
     except Exception as error:
         reporter.error(error=error)
-        # remove temp file
         if temp_file_path is not None and temp_file_path.exists():
-            temp_file_path.unlink()
+            # keep partial file to resume
+            if (state is not None
+                    and not isinstance(error, DownloadRejected)
+                    and state.validator() is not None
+                    and temp_file_path.stat().st_size > 0):
+                if progress is not None:
+                    downloaded_size = progress.report().downloaded_size
+                    os.truncate(temp_file_path, downloaded_size)
+                    state = state._replace(downloaded_size=downloaded_size)
+                _resume.save_state(path, state)
+            # remove temp file
+            else:
+                temp_file_path.unlink()
+                if is_claimed:
+                    _resume.remove_state(path)
     finally:
+        if allocation is not None:
+            allocation.release()
+        if is_claimed:
+            _resume.release(path)
+        # return the connection to the pool
+        if response is not None:
+            response.close()
+        if session is not None:
+            session_pool.release(url)
+        if is_temporary_pool:
+            session_pool.close()
         if controller:
             controller.finish()
 
 
-_move_file_lock = threading.Lock()
+def _precheck_store(
+        store: ContentStore,
+        session: requests.Session,
+        timeout: Tuple[Optional[float], Optional[float]],
+        url: str,
+        path: pathlib.Path,
+        option: ThreadOption,
+        reporter: Reporter) -> bool:
+    record = store.record(url)
+    if record is None:
+        return False
+    response = session.head(url, allow_redirects=True, timeout=timeout)
+    response.close()
+    if (not response.ok
+            or header_digest(response.headers) != record.digest):
+        return False
+    progress = ProgressReport(
+            file_size=record.size,
+            downloaded_size=record.size,
+            elapsed_time=0.,
+            speed=None)
+    object_path = store.object_path(record.digest)
+    reporter.start(
+            temp_path=object_path,
+            response=response,
+            progress=progress)
+    save_path = link_file(object_path, path)
+    if option.file_permission is not None:
+        save_path.chmod(option.file_permission)
+    reporter.finish(
+            saved_path=save_path,
+            progress=progress,
+            source=ContentSource.STORE,
+            digest=record.digest)
+    return True
+
+
+def _finish_from_cache(
+        entry: CacheEntry,
+        response: requests.Response,
+        path: pathlib.Path,
+        option: ThreadOption,
+        reporter: Reporter) -> None:
+    progress = ProgressReport(
+            file_size=entry.size,
+            downloaded_size=entry.size,
+            elapsed_time=0.,
+            speed=None)
+    cached_path = pathlib.Path(entry.path)
+    reporter.start(
+            temp_path=cached_path,
+            response=response,
+            progress=progress)
+    save_path = link_file(cached_path, path)
+    if option.file_permission is not None:
+        save_path.chmod(option.file_permission)
+    reporter.finish(
+            saved_path=save_path,
+            progress=progress,
+            source=ContentSource.CACHE)
+
+
+def _hash_file(path: pathlib.Path, size: int) -> 'hashlib._Hash':
+    hasher = hashlib.sha256()
+    with path.open('rb') as fin:
+        while size > 0:
+            data = fin.read(min(size, 1024 * 1024))
+            if not data:
+                break
+            hasher.update(data)
+            size -= len(data)
+    return hasher
+
+
+def _load_resume_state(
+        url: str,
+        path: pathlib.Path,
+        temp_file_path: pathlib.Path) -> Optional[_resume.ResumeState]:
+    state = _resume.load_state(path)
+    if (state is None
+            or state.url != url
+            or not temp_file_path.exists()
+            or state.validator() is None):
+        return None
+    # the file may be preallocated beyond the last checkpoint
+    return state._replace(downloaded_size=min(
+            state.downloaded_size,
+            temp_file_path.stat().st_size))
+
+
+def _request(
+        session: requests.Session,
+        timeout: Tuple[Optional[float], Optional[float]],
+        url: str,
+        state: Optional[_resume.ResumeState],
+        cache_entry: Optional[CacheEntry] = None
+        ) -> Tuple[requests.Response, int]:
+    if state is None or state.downloaded_size <= 0:
+        return session.get(
+                url,
+                stream=True,
+                timeout=timeout,
+                headers=(cache_entry.request_header()
+                         if cache_entry is not None
+                         else None)), 0
+    validator = state.validator()
+    assert validator is not None
+    response = session.get(
+            url,
+            stream=True,
+            timeout=timeout,
+            headers={'Range': 'bytes={0}-'.format(state.downloaded_size),
+                     'If-Range': validator})
+    # partial content
+    if (response.status_code == requests.codes.partial_content
+            and state.is_valid(response.headers)
+            and (_resume.content_range_start(response.headers)
+                 == state.downloaded_size)):
+        return response, state.downloaded_size
+    # the resource has changed or range is not supported: start over
+    if response.status_code == requests.codes.ok:
+        return response, 0
+    response.close()
+    return session.get(url, stream=True, timeout=timeout), 0
+
+
+def _iter_chunks(
+        response: requests.Response,
+        option: ThreadOption) -> Iterator[Union[bytes, memoryview]]:
+    # decoded data may be longer than the buffer (urllib3 < 2)
+    if (not option.buffered
+            or response.headers.get('Content-Encoding', 'identity').lower()
+            != 'identity'):
+        yield from response.iter_content(chunk_size=option.chunk_size)
+        return
+    # read into a reusable buffer
+    max_size = max(option.max_buffer_size, _MIN_BUFFER_SIZE)
+    buffer = memoryview(bytearray(max_size))
+    size = _MIN_BUFFER_SIZE
+    while True:
+        start = time.perf_counter()
+        received_size = response.raw.readinto(buffer[:size])
+        if not received_size:
+            break
+        elapsed_time = time.perf_counter() - start
+        yield buffer[:received_size]
+        # adapt the chunk size to the link speed
+        if (received_size == size
+                and elapsed_time < _TARGET_READ_TIME / 2):
+            size = min(size * 2, max_size)
+        elif elapsed_time > _TARGET_READ_TIME * 2:
+            size = max(size // 2, _MIN_BUFFER_SIZE)
+
+
+def _preallocate(
+        file: BinaryIO,
+        offset: int,
+        file_size: int) -> None:
+    if not hasattr(os, 'posix_fallocate') or file_size <= offset:
+        return
+    try:
+        os.posix_fallocate(file.fileno(), offset, file_size - offset)
+    except OSError:
+        pass
 
 
-def _move_file(
-        source: pathlib.Path,
-        destination: pathlib.Path) -> pathlib.Path:
-    with _move_file_lock:
-        path = destination
-        i = 0
-        while path.exists():
-            path = source.with_name(
-                    '{0.stem}_{1}{0.suffix}'.format(destination, i))
-            i += 1
-        shutil.move(source.as_posix(), path.as_posix())
-    return path
+def _file_size(
+        response: requests.Response,
+        resumed_size: int) -> Optional[int]:
+    if resumed_size > 0:
+        size = _resume.content_range_size(response.headers)
+        if size is not None:
+            return size
+    if 'Content-Length' in response.headers:
+        return int(response.headers['Content-Length']) + resumed_size
+    return None
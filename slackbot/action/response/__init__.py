@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from ._cooldown import Cooldown, CooldownOption, Limit, TTLCache
+from ._matcher import ExactMatcher, RegexMatcher, SubstringMatcher
+from ._template import Template, TemplateContext
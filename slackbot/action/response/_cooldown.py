@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import time
+from typing import (
+        Any, Deque, Dict, Hashable, List, NamedTuple, Optional, Tuple, Union)
+from ... import Option, OptionError, OptionList
+
+
+class Limit:
+    # at most count responses in period seconds
+    def __init__(self, period: Union[float, int], count: int = 1) -> None:
+        assert isinstance(period, (float, int)) and period >= 0
+        assert isinstance(count, int) and count >= 1
+        self._period = float(period)
+        self._count = count
+
+    def __repr__(self) -> str:
+        return "{0}.{1}(period={2}, count={3})".format(
+                self.__class__.__module__,
+                self.__class__.__name__,
+                repr(self._period),
+                repr(self._count))
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+
+class CooldownOption(NamedTuple):
+    user: Optional[Limit]
+    channel: Optional[Limit]
+    pattern: Optional[Limit]
+    max_entries: int
+    report_interval: float
+
+    @staticmethod
+    def option_list(
+            name: str,
+            help: str = '') -> OptionList['CooldownOption']:
+        # translate to Limit
+        def parse_limit(data: Any) -> Optional[Limit]:
+            if data is None:
+                return None
+            try:
+                if isinstance(data, dict):
+                    return Limit(**data)
+                return Limit(data)
+            except (AssertionError, TypeError):
+                raise OptionError(
+                        'could not convert to Limit: \'{0}\''.format(data))
+
+        return OptionList(
+            CooldownOption,
+            name,
+            [Option('user',
+                    action=parse_limit,
+                    sample={'period': 10, 'count': 1},
+                    help=('responses to each user'
+                          ' (seconds or {period, count})')),
+             Option('channel',
+                    action=parse_limit,
+                    help=('responses in each channel'
+                          ' (seconds or {period, count})')),
+             Option('pattern',
+                    action=parse_limit,
+                    help=('responses of each pattern in each channel'
+                          ' (seconds or {period, count})')),
+             Option('max_entries',
+                    type=int,
+                    default=10000,
+                    help='maximum number of users & channels to remember'),
+             Option('report_interval',
+                    type=float,
+                    default=3600.,
+                    help=('interval seconds to log the suppressed responses'
+                          ' (disabled if 0)'))],
+            help=help)
+
+
+# expiration time, recent times
+_Entry = Tuple[float, Deque[float]]
+
+
+class TTLCache:
+    # key -> recent times, bounded and evicted after the TTL
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max(max_entries, 1)
+        self._entries: 'collections.OrderedDict[Hashable, _Entry]' = (
+                collections.OrderedDict())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, now: float) -> Optional[Deque[float]]:
+        entry = self._entries.get(key, None)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def put(
+            self,
+            key: Hashable,
+            times: Deque[float],
+            expire: float,
+            now: float) -> None:
+        self._entries[key] = (expire, times)
+        self._entries.move_to_end(key)
+        self.evict(now)
+
+    def evict(self, now: float) -> None:
+        # entries are ordered by the last update
+        while self._entries:
+            key, (expire, _) = next(iter(self._entries.items()))
+            if expire > now and len(self._entries) <= self._max_entries:
+                break
+            del self._entries[key]
+
+
+class Cooldown:
+    def __init__(self, option: CooldownOption) -> None:
+        self._option = option
+        self._caches: Dict[str, TTLCache] = {}
+        self._limits: Dict[str, Limit] = {}
+        for scope in ('user', 'channel', 'pattern'):
+            limit = getattr(option, scope)
+            if limit is not None:
+                self._limits[scope] = limit
+                self._caches[scope] = TTLCache(option.max_entries)
+        self._metrics: Dict[str, int] = collections.Counter()
+        self._report_time = time.monotonic()
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        return dict(self._metrics)
+
+    def acquire(
+            self,
+            user: str,
+            channel: str,
+            pattern: Hashable,
+            now: Optional[float] = None) -> bool:
+        # False if any limit is reached: the response is suppressed
+        now = time.monotonic() if now is None else now
+        keys: Dict[str, Hashable] = {
+                'user': user,
+                'channel': channel,
+                'pattern': (pattern, channel)}
+        suppressed: List[str] = []
+        for scope, limit in self._limits.items():
+            times = self._caches[scope].get(keys[scope], now)
+            if times is not None:
+                while times and times[0] <= now - limit.period:
+                    times.popleft()
+                if len(times) >= limit.count:
+                    suppressed.append(scope)
+        if suppressed:
+            self._metrics['suppressed'] += 1
+            for scope in suppressed:
+                self._metrics['suppressed_{0}'.format(scope)] += 1
+            return False
+        for scope, limit in self._limits.items():
+            cache = self._caches[scope]
+            times = cache.get(keys[scope], now) or collections.deque(
+                    maxlen=limit.count)
+            times.append(now)
+            cache.put(keys[scope], times, now + limit.period, now)
+        self._metrics['responded'] += 1
+        return True
+
+    def report(self, now: Optional[float] = None) -> Optional[Dict[str, int]]:
+        # the metrics since the last report, once per report interval
+        now = time.monotonic() if now is None else now
+        if (self._option.report_interval <= 0
+                or now - self._report_time < self._option.report_interval):
+            return None
+        self._report_time = now
+        metrics = dict(self._metrics)
+        self._metrics.clear()
+        return metrics
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import re
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class ExactMatcher:
+    # call -> indices of the patterns
+    def __init__(self, keys: Iterable[Tuple[str, int]]) -> None:
+        self._table: Dict[str, List[int]] = {}
+        for key, index in keys:
+            indices = self._table.setdefault(key, [])
+            if index not in indices:
+                indices.append(index)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def search(self, text: str) -> List[int]:
+        return self._table.get(text, [])
+
+
+class SubstringMatcher:
+    # Aho-Corasick automaton: a single pass over the text for all keywords
+    def __init__(self, keywords: Iterable[Tuple[str, int]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[int]] = [set()]
+        for keyword, index in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char, None)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state].add(index)
+        # failure links in breadth first order
+        queue: Deque[int] = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= (
+                        self._output[self._fail[next_state]])
+                queue.append(next_state)
+
+    def __len__(self) -> int:
+        return len(self._goto) - 1
+
+    def search(self, text: str) -> Set[int]:
+        result = set(self._output[0])
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            result |= self._output[state]
+        return result
+
+
+class RegexMatcher:
+    # the first regex in order that matches anywhere in the text:
+    # compiled once and searched one by one, since the re module scans
+    # a large alternation far slower than the regexes with literal prefixes
+    def __init__(self, regexes: Iterable[Tuple[str, int]]) -> None:
+        self._regexes: List[Tuple['re.Pattern[str]', int]] = sorted(
+                ((re.compile(regex), index) for regex, index in regexes),
+                key=lambda x: x[1])
+
+    def __len__(self) -> int:
+        return len(self._regexes)
+
+    def search(self, text: str) -> Optional[int]:
+        for regex, index in self._regexes:
+            if regex.search(text):
+                return index
+        return None
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import string
+from typing import (
+        Any, Callable, Collection, List, NamedTuple, Optional, Union)
+from ... import Channel, User, escape_text
+
+
+class TemplateContext(NamedTuple):
+    user: User
+    channel: Channel
+    text: str
+    match: Optional[Any]
+    time: datetime.datetime
+
+
+_Segment = Callable[[TemplateContext], str]
+
+
+class Template:
+    # '{user} said {1} in {channel} at {time:%H:%M}' compiled once
+    fields = {
+            'user': lambda context: context.user.name,
+            'user_id': lambda context: context.user.id,
+            'mention': lambda context: '<@{0}>'.format(context.user.id),
+            'channel': lambda context: context.channel.name,
+            'channel_id': lambda context: context.channel.id,
+            'text': lambda context: context.text}
+    # markup of the bot itself, the others are escaped
+    # not to post <!channel> or <@U...> typed by the user
+    raw_fields = {'mention', 'user_id', 'channel_id'}
+
+    def __init__(
+            self,
+            source: str,
+            groups: Optional[Collection[Union[int, str]]] = None) -> None:
+        # groups: the available groups of the regex (None: no regex)
+        self._source = source
+        self._uses_match = False
+        segments: List[_Segment] = []
+        literal = ''
+        for text, field, spec, conversion in string.Formatter().parse(source):
+            literal += text
+            if field is None:
+                continue
+            if conversion is not None:
+                raise ValueError(
+                        'conversion is not supported: {0}'.format(source))
+            if literal:
+                segments.append(_constant(literal))
+                literal = ''
+            segments.append(self._compile_field(field, spec or '', groups))
+        # without placeholders: the string itself
+        self._static: Optional[str] = literal if not segments else None
+        if literal:
+            segments.append(_constant(literal))
+        self._segments = segments
+
+    def __repr__(self) -> str:
+        return '{0}.{1}({2})'.format(
+                self.__class__.__module__,
+                self.__class__.__name__,
+                repr(self._source))
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    @property
+    def uses_match(self) -> bool:
+        return self._uses_match
+
+    def render(self, context: TemplateContext) -> str:
+        if self._static is not None:
+            return self._static
+        return ''.join(segment(context) for segment in self._segments)
+
+    def _compile_field(
+            self,
+            field: str,
+            spec: str,
+            groups: Optional[Collection[Union[int, str]]]) -> _Segment:
+        # time: the format spec is passed to strftime
+        if field == 'time':
+            time_format = spec or '%H:%M:%S'
+            return lambda context: context.time.strftime(time_format)
+        getter: Optional[_Segment] = self.fields.get(field, None)
+        if getter is None:
+            group: Union[int, str] = int(field) if field.isdigit() else field
+            if groups is None or group not in groups:
+                raise ValueError('unknown placeholder: {{{0}}}'.format(field))
+            self._uses_match = True
+            getter = _group_getter(group)
+        if spec:
+            getter = _formatted(getter, spec)
+        if field not in self.raw_fields:
+            getter = _escaped(getter)
+        return getter
+
+
+def _constant(value: str) -> _Segment:
+    return lambda context: value
+
+
+def _formatted(getter: _Segment, spec: str) -> _Segment:
+    return lambda context: format(getter(context), spec)
+
+
+def _escaped(getter: _Segment) -> _Segment:
+    return lambda context: escape_text(getter(context))
+
+
+def _group_getter(group: Union[int, str]) -> _Segment:
+    def getter(context: TemplateContext) -> str:
+        if context.match is None:
+            return ''
+        try:
+            return context.match.group(group) or ''
+        except IndexError:
+            # the group of another regex in the pattern
+            return ''
+    return getter
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import slackbot
+from slackbot import TokenType
+
+
+class EscapeTest(unittest.TestCase):
+    def test_escape(self):
+        self.assertEqual(
+                slackbot.escape_text('a < b && c > d'),
+                'a &lt; b &amp;&amp; c &gt; d')
+
+    def test_unescape(self):
+        self.assertEqual(
+                slackbot.unescape_text('a &lt; b &amp;&amp; c &gt; d'),
+                'a < b && c > d')
+        # decoded only once
+        self.assertEqual(slackbot.unescape_text('&amp;lt;'), '&lt;')
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_tokenize(self):
+        tokens = slackbot.tokenize(
+                '<@U1|bob> 1 &lt; 2 <#C1|general>'
+                '<https://example.com/?a=1&amp;b=2|see &amp; go><!here>')
+        self.assertEqual(
+                [(token.type, token.value, token.label) for token in tokens],
+                [(TokenType.USER, 'U1', 'bob'),
+                 (TokenType.TEXT, ' 1 < 2 ', None),
+                 (TokenType.CHANNEL, 'C1', 'general'),
+                 (TokenType.URL, 'https://example.com/?a=1&b=2', 'see & go'),
+                 (TokenType.SPECIAL, 'here', None)])
+        self.assertEqual(
+                ''.join(token.text for token in tokens),
+                '<@U1|bob> 1 < 2 <#C1|general>'
+                '<https://example.com/?a=1&b=2|see & go><!here>')
+
+    def test_text(self):
+        self.assertEqual(slackbot.tokenize(''), ())
+        self.assertEqual(
+                slackbot.tokenize('ping &amp; pong'),
+                (slackbot.Token(
+                        type=TokenType.TEXT,
+                        text='ping & pong',
+                        value='ping & pong'),))
+
+    def test_memoize(self):
+        text = 'memoized <@U1>'
+        self.assertIs(slackbot.tokenize(text), slackbot.tokenize(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
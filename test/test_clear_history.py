@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import datetime
+import json
+import pathlib
+import tempfile
+import unittest
+from slackbot import RateLimits
+from slackbot._team import Channel
+from slackbot.action import _clear_history, clear_history
+
+
+class TimestampTest(unittest.TestCase):
+    def test_pack(self):
+        for ts in ('1234567890.123456', '1234567890.000001', '1.000000'):
+            self.assertEqual(
+                    _clear_history._unpack_ts(_clear_history._pack_ts(ts)),
+                    ts)
+        self.assertEqual(
+                _clear_history._pack_ts('1234567890.5'),
+                1234567890500000)
+
+    def test_time_slices(self):
+        self.assertEqual(
+                clear_history.time_slices(0, 10, 3),
+                [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(clear_history.time_slices(5, 5, 3), [(5, 5)])
+
+
+class ClearHistoryTest(unittest.TestCase):
+    def test_execute(self):
+        client = FakeClient({'C1': [100 + i for i in range(25)],
+                             'C2': [100 + i for i in range(5)]})
+        action = make_action(client, page_size=10)
+        asyncio.run(action._execute(client))
+        # messages older than the period are deleted
+        self.assertEqual(client.messages['C1'], [122, 123, 124])
+        self.assertEqual(client.messages['C2'], [])
+        self.assertEqual(len(client.deleted), 27)
+        # deletion starts before the scan ends
+        self.assertLess(
+                client.calls.index('chat.delete'),
+                len(client.calls) - client.calls[::-1].index(
+                        'conversations.history'))
+
+    def test_stop(self):
+        client = FakeClient({'C1': [100 + i for i in range(25)]})
+        action = make_action(client, page_size=10)
+        action.stop()
+        asyncio.run(action._execute(client))
+        self.assertLessEqual(len(client.deleted), 1)
+
+    def test_replies_and_files(self):
+        client = FakeClient(
+                {'C1': [100 + i for i in range(25)]},
+                threads={('C1', 105): list(range(106, 130)),
+                         ('C1', 123): [124]},
+                files={'C1': [('F{0}'.format(i), 100 + i)
+                              for i in range(25)]})
+        action = make_action(
+                client,
+                channels=[{'name': 'C1',
+                           'period': 1,
+                           'replies': True,
+                           'files': True}])
+        asyncio.run(action._execute(client))
+        self.assertEqual(client.messages['C1'], [122, 123, 124])
+        # replies before the period in the paged thread are deleted
+        self.assertEqual(client.threads[('C1', 105)], list(range(122, 130)))
+        self.assertEqual(client.threads[('C1', 123)], [124])
+        self.assertEqual(
+                [file_id for file_id, _ in client.files['C1']],
+                ['F23', 'F24'])
+
+    def test_task(self):
+        client = FakeClient({'C1': [100 + i for i in range(25)]})
+        action = make_action(client, mode='task')
+        action._execution_time = None
+        action._rate_limits = RateLimits(rate=1000., max_rate=1000.)
+
+        async def run():
+            await action.update(client)
+            task = action._task
+            self.assertIsNotNone(task)
+            await task
+            await action.update(client)
+            self.assertIsNone(action._task)
+        asyncio.run(run())
+        self.assertEqual(client.messages['C1'], [])
+
+    def test_cancel_task(self):
+        client = FakeClient({'C1': [100 + i for i in range(25)]})
+        action = make_action(client, mode='task')
+        action._execution_time = None
+        action._rate_limits = RateLimits(rate=1000., max_rate=1000.)
+
+        async def chat_delete(channel, ts):
+            await asyncio.sleep(60)
+
+        client.chat_delete = chat_delete
+
+        async def run():
+            await action.update(client)
+            task = action._task
+            await asyncio.sleep(0.1)
+            action.stop()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(task, timeout=1.)
+        asyncio.run(run())
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('checkpoint.json')
+            client = FakeClient({'C1': [100 + i for i in range(25)]})
+            action = make_action(
+                    client,
+                    scan_slices=1,
+                    checkpoint=path.as_posix())
+            asyncio.run(action._execute(client))
+            self.assertEqual(client.messages['C1'], [122, 123, 124])
+            # the next run scans only the new range
+            client.history_params.clear()
+            action._execution_time += datetime.timedelta(seconds=2)
+            asyncio.run(action._execute(client))
+            self.assertEqual(client.messages['C1'], [124])
+            self.assertEqual(
+                    [(float(params['oldest']), float(params['latest']))
+                     for params in client.history_params],
+                    [(121.999999, 124.)])
+
+    def test_incremental_replies(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('checkpoint.json')
+            client = FakeClient(
+                    {'C1': [100 + i for i in range(25)]},
+                    threads={('C1', 105): list(range(106, 130))})
+            action = make_action(
+                    client,
+                    scan_slices=1,
+                    checkpoint=path.as_posix(),
+                    channels=[{'name': 'C1', 'period': 1, 'replies': True}])
+            asyncio.run(action._execute(client))
+            self.assertEqual(
+                    client.threads[('C1', 105)],
+                    list(range(122, 130)))
+            # the parent is before the checkpoint in the next run
+            action._execution_time += datetime.timedelta(seconds=5)
+            asyncio.run(action._execute(client))
+            self.assertEqual(client.messages['C1'], [])
+            self.assertEqual(client.threads[('C1', 105)], [127, 128, 129])
+            with path.open() as fin:
+                self.assertEqual(
+                        json.load(fin)['C1']['threads'],
+                        [_clear_history._pack_ts('105.000100')])
+            # not scanned again after all the replies are deleted
+            action._execution_time += datetime.timedelta(seconds=5)
+            asyncio.run(action._execute(client))
+            self.assertEqual(client.threads[('C1', 105)], [])
+            with path.open() as fin:
+                self.assertEqual(json.load(fin)['C1']['threads'], [])
+
+
+class ArchiveTest(unittest.TestCase):
+    def test_execute(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = FakeClient({'C1': [100 + i for i in range(25)],
+                                 'C2': [100 + i for i in range(5)]})
+            action = make_action(
+                    client,
+                    archive={'directory': directory, 'sync_interval': 0.1})
+            asyncio.run(action._execute(client))
+            # the deleted messages are archived
+            self.assertEqual(
+                    [message['ts'] for message in clear_history.read_archive(
+                            directory,
+                            'C2')],
+                    ['{0}.000100'.format(100 + i) for i in reversed(range(5))])
+            self.assertEqual(
+                    len(list(clear_history.read_archive(directory, 'C1'))),
+                    22)
+
+    def test_delete_after_sync(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = FakeClient({'C1': [100 + i for i in range(25)]})
+            action = make_action(
+                    client,
+                    archive={'directory': directory, 'sync_interval': 0.2})
+            delete = client.chat_delete
+            unsynced = []
+
+            async def chat_delete(channel, ts):
+                # a page is deleted after it is on the disk
+                if ts not in {message['ts'] for message
+                              in clear_history.read_archive(
+                                    directory,
+                                    channel)}:
+                    unsynced.append(ts)
+                return await delete(channel, ts)
+
+            client.chat_delete = chat_delete
+            asyncio.run(action._execute(client))
+            self.assertEqual(len(client.deleted), 22)
+            self.assertEqual(unsynced, [])
+
+    def test_sync_idle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            option = clear_history.ArchiveOption.option_list('archive').parse(
+                    {'directory': directory, 'sync_interval': 0.1})
+            writer = clear_history.ArchiveWriter(option)
+            writer.start()
+            try:
+                sequence = writer.write(
+                        'C1',
+                        'general',
+                        [{'ts': '100.000000', 'text': 'x'}])
+                # synced without the next entry
+                asyncio.run(asyncio.wait_for(writer.wait(sequence), 5.))
+                self.assertTrue(writer.is_durable(sequence))
+                self.assertEqual(
+                        [message['ts'] for message
+                         in clear_history.read_archive(directory, 'C1')],
+                        ['100.000000'])
+            finally:
+                writer.close()
+
+    def test_rotate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            option = clear_history.ArchiveOption.option_list('archive').parse(
+                    {'directory': directory, 'max_size': 1})
+            writer = clear_history.ArchiveWriter(option)
+            writer.start()
+            for i in range(3):
+                writer.write(
+                        'C1',
+                        'general',
+                        [{'ts': '{0}.000000'.format(100 + i), 'text': 'x'}])
+            writer.close()
+            files = sorted(pathlib.Path(directory).glob('*.jsonl.gz'))
+            self.assertEqual(len(files), 3)
+            # the index narrows the files by the time range
+            index = clear_history.ArchiveIndex.load(pathlib.Path(directory))
+            self.assertEqual(index.lookup('C1', '101', '101.5'), files[1:2])
+            self.assertEqual(index.lookup('C2'), [])
+            self.assertEqual(
+                    [message['ts'] for message in clear_history.read_archive(
+                            directory,
+                            'C1',
+                            oldest='101')],
+                    ['101.000000', '102.000000'])
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_watermark(self):
+        checkpoint = clear_history.Checkpoint(None)
+        progress = checkpoint.begin('C1', 0, 100, 1)
+        slice_progress = progress.slices[0]
+        pages = [slice_progress.add_page([90, 80]),
+                 slice_progress.add_page([70, 60])]
+        # the second page is deleted first
+        pages[1].deleted = 2
+        checkpoint.advance(slice_progress)
+        self.assertEqual(slice_progress.position, 100)
+        pages[0].deleted = 1
+        checkpoint.advance(slice_progress)
+        self.assertEqual(slice_progress.position, 90)
+        pages[0].deleted = 2
+        checkpoint.advance(slice_progress)
+        self.assertEqual(slice_progress.position, 60)
+        self.assertFalse(progress.is_done())
+        slice_progress.is_scanned = True
+        checkpoint.advance(slice_progress)
+        self.assertTrue(progress.is_done())
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('checkpoint.json')
+            checkpoint = clear_history.Checkpoint(path)
+            progress = checkpoint.begin('C1', 0, 100, 2)
+            progress.slices[1].position = 70
+            checkpoint.update(progress)
+            # restart
+            progress = clear_history.Checkpoint(path).begin('C1', 0, 120, 1)
+            self.assertEqual(
+                    [(slice_progress.oldest, slice_progress.latest)
+                     for slice_progress in progress.slices],
+                    [(0, 50), (50, 70), (100, 120)])
+            for slice_progress in progress.slices:
+                slice_progress.is_scanned = True
+                checkpoint.advance(slice_progress)
+            # next run
+            progress = clear_history.Checkpoint(path).begin('C1', 0, 150, 1)
+            self.assertEqual(
+                    [(slice_progress.oldest, slice_progress.latest)
+                     for slice_progress in progress.slices],
+                    [(120, 150)])
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def validate(self):
+        return self
+
+
+class FakeClient:
+    def __init__(self, messages, threads=None, files=None):
+        # channel -> timestamps (seconds)
+        self.messages = {channel: sorted(timestamps)
+                         for channel, timestamps in messages.items()}
+        # (channel, parent timestamp) -> reply timestamps
+        self.threads = threads or {}
+        # channel -> [(file id, created)]
+        self.files = files or {}
+        self.deleted = []
+        self.calls = []
+        self.history_params = []
+        self.page_size = 10
+
+    async def conversations_history(
+            self,
+            channel,
+            latest=None,
+            oldest=None,
+            limit=100,
+            cursor=None):
+        self.calls.append('conversations.history')
+        self.history_params.append({'oldest': oldest, 'latest': latest})
+        # newest first, the cursor is the last timestamp like slack
+        messages = [ts for ts in reversed(self.messages[channel])
+                    if (latest is None or ts < float(latest))
+                    and (oldest is None or ts > float(oldest))
+                    and (not cursor or ts < int(cursor))]
+        page = messages[:min(limit, self.page_size)]
+        has_more = len(messages) > len(page)
+        return FakeResponse({
+                'ok': True,
+                'messages': [
+                        {'ts': '{0}.000100'.format(ts),
+                         'reply_count': len(
+                                self.threads.get((channel, ts), []))}
+                        for ts in page],
+                'has_more': has_more,
+                'response_metadata': {
+                        'next_cursor': str(page[-1]) if has_more else ''}})
+
+    async def conversations_replies(self, channel, ts, limit=100, cursor=None):
+        self.calls.append('conversations.replies')
+        parent = int(float(ts))
+        # oldest first, the parent comes first
+        replies = [reply for reply in self.threads[(channel, parent)]
+                   if not cursor or reply > int(cursor)]
+        page = replies[:min(limit, self.page_size)]
+        has_more = len(replies) > len(page)
+        messages = [{'ts': '{0}.000200'.format(reply), 'thread_ts': ts}
+                    for reply in page]
+        if not cursor:
+            messages.insert(0, {'ts': ts, 'thread_ts': ts})
+        return FakeResponse({
+                'ok': True,
+                'messages': messages,
+                'has_more': has_more,
+                'response_metadata': {
+                        'next_cursor': str(page[-1]) if has_more else ''}})
+
+    async def chat_delete(self, channel, ts):
+        self.calls.append('chat.delete')
+        timestamp = int(float(ts))
+        if ts.endswith('.000200'):
+            for (thread_channel, _), replies in self.threads.items():
+                if thread_channel == channel and timestamp in replies:
+                    replies.remove(timestamp)
+        else:
+            self.messages[channel].remove(timestamp)
+        self.deleted.append((channel, ts))
+        return FakeResponse({'ok': True})
+
+    async def files_list(self, channel, ts_to, count=100, page=1):
+        self.calls.append('files.list')
+        files = [file_id for file_id, created in self.files.get(channel, [])
+                 if created <= int(ts_to)]
+        size = min(count, self.page_size)
+        return FakeResponse({
+                'ok': True,
+                'files': [{'id': file_id} for file_id
+                          in files[(page - 1) * size:page * size]],
+                'paging': {'page': page, 'pages': -(-len(files) // size)}})
+
+    async def files_delete(self, file):
+        self.calls.append('files.delete')
+        for channel, files in self.files.items():
+            self.files[channel] = [(file_id, created)
+                                   for file_id, created in files
+                                   if file_id != file]
+        return FakeResponse({'ok': True})
+
+
+class FakeChannels:
+    def __init__(self, names):
+        self._channels = {name: Channel({'id': name, 'name': name})
+                          for name in names}
+
+    def name_search(self, name):
+        return self._channels.get(name, None)
+
+
+class FakeTeam:
+    def __init__(self, names):
+        self.channels = FakeChannels(names)
+
+    def is_initialized(self):
+        return True
+
+
+def make_action(client, page_size=10, **option):
+    client.page_size = page_size
+    data = {'api_interval': 0.,
+            'rate_limit': 60000.,
+            'channels': [{'name': name, 'period': 1}
+                         for name in client.messages]}
+    data.update(option)
+    action = _clear_history.ClearHistory(
+            'ClearHistory',
+            _clear_history.ClearHistoryOption.option_list(
+                    'ClearHistory').parse(data))
+    action._team = FakeTeam(client.messages.keys())
+    # messages before 122 are older than the period
+    action._execution_time = datetime.datetime.fromtimestamp(
+            122 + 3600,
+            tz=datetime.timezone.utc)
+    return action
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,1007 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import concurrent.futures
+import contextlib
+import gzip
+import http.server
+import io
+import os
+import pathlib
+import queue
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import types
+import unittest
+from slackbot import Channel, Outbox, OutboxOption
+from slackbot.action import Download
+from slackbot.action._download import ReportInfo, _report_message
+from slackbot.action.download import (
+        DownloadRejected, InvalidManifestError, _admission, _bandwidth, _batch,
+        _cache, _journal, _place,
+        _postprocess, _progress, _report, _resume, _session, _store,
+        _thread)
+
+
+class ResumeStateTest(unittest.TestCase):
+    def test_validator_strong_etag(self):
+        state = make_state(etag='"abc"', last_modified='yesterday')
+        self.assertEqual(state.validator(), '"abc"')
+
+    def test_validator_weak_etag(self):
+        state = make_state(etag='W/"abc"', last_modified='yesterday')
+        self.assertEqual(state.validator(), 'yesterday')
+
+    def test_is_valid(self):
+        state = make_state(etag='"abc"')
+        self.assertTrue(state.is_valid({'ETag': '"abc"'}))
+        self.assertFalse(state.is_valid({'ETag': '"def"'}))
+        self.assertFalse(state.is_valid({}))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            state = make_state(etag='"abc"')
+            self.assertIsNone(_resume.load_state(path))
+            _resume.save_state(path, state)
+            self.assertEqual(_resume.load_state(path), state)
+            _resume.remove_state(path)
+            self.assertIsNone(_resume.load_state(path))
+
+    def test_content_range(self):
+        header = {'Content-Range': 'bytes 100-199/200'}
+        self.assertEqual(_resume.content_range_start(header), 100)
+        self.assertEqual(_resume.content_range_size(header), 200)
+
+    def test_content_range_unknown_size(self):
+        header = {'Content-Range': 'bytes 100-199/*'}
+        self.assertEqual(_resume.content_range_start(header), 100)
+        self.assertIsNone(_resume.content_range_size(header))
+
+    def test_claim(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            lock_file = _resume.lock_path(path)
+            self.assertTrue(_resume.claim(path))
+            self.assertFalse(_resume.claim(path))
+            _resume.release(path)
+            self.assertFalse(lock_file.exists())
+            # held by another process
+            lock_file.write_text(str(os.getppid()))
+            self.assertFalse(_resume.claim(path))
+            # left by the last run with the same pid
+            lock_file.write_text(str(os.getpid()))
+            self.assertTrue(_resume.claim(path))
+            _resume.release(path)
+
+
+class SpeedMeterTest(unittest.TestCase):
+    def test_chunk(self):
+        speedmeter = _progress.SpeedMeter(size=2)
+        for i in range(5):
+            speedmeter.push(100 * i * i, float(i))
+        self.assertEqual(speedmeter.speed(), 700.0)
+
+    def test_window(self):
+        speedmeter = _progress.TimeWindowSpeedMeter(window=2.0)
+        for i in range(11):
+            speedmeter.push(100 * i * i, i / 2)
+        self.assertEqual(speedmeter.speed(), 3200.0)
+
+    def test_window_size(self):
+        # a sample per chunk at a high speed
+        speedmeter = _progress.TimeWindowSpeedMeter(window=10.0)
+        for i in range(100000):
+            speedmeter.push(1000 * i, i / 1000)
+            self.assertLessEqual(len(speedmeter._deque), 18)
+        self.assertAlmostEqual(speedmeter.speed(), 1000000.0)
+
+    def test_ewma(self):
+        speedmeter = _progress.EWMASpeedMeter(time_constant=1.0)
+        self.assertIsNone(speedmeter.speed())
+        for i in range(11):
+            speedmeter.push(100 * i, i / 10)
+        self.assertAlmostEqual(speedmeter.speed(), 1000.0)
+
+
+class SessionPoolTest(unittest.TestCase):
+    def test_per_host_limit(self):
+        option = _session.SessionOption.option_list('').parse(
+                {'max_connections_per_host': 1})
+        pool = _session.SessionPool(option)
+        session = pool.acquire('http://example.com/foo')
+        self.assertIsNotNone(session)
+        # other host
+        self.assertIsNotNone(pool.acquire('http://example.org/foo'))
+        # same host: cancelled while waiting
+        self.assertIsNone(pool.acquire(
+                'http://example.com/bar',
+                is_canceled=lambda: True,
+                interval=0.01))
+        # released
+        pool.release('http://example.com/foo')
+        self.assertIs(pool.acquire('http://example.com/bar'), session)
+        pool.close()
+
+
+class BandwidthSchedulerTest(unittest.TestCase):
+    def test_unlimited(self):
+        scheduler = _bandwidth.BandwidthScheduler()
+        self.assertFalse(scheduler.is_limited())
+        self.assertIsNone(scheduler.register().rate)
+
+    def test_fair_share(self):
+        option = _bandwidth.BandwidthOption.option_list('').parse(
+                {'rate_limit': 1000})
+        scheduler = _bandwidth.BandwidthScheduler(option)
+        allocation1 = scheduler.register()
+        self.assertEqual(allocation1.rate, 1000)
+        allocation2 = scheduler.register()
+        self.assertEqual(allocation1.rate, 500)
+        self.assertEqual(allocation2.rate, 500)
+        allocation2.release()
+        self.assertEqual(allocation1.rate, 1000)
+
+    def test_per_download_limit(self):
+        option = _bandwidth.BandwidthOption.option_list('').parse(
+                {'rate_limit': 1000, 'per_download_limit': 300})
+        scheduler = _bandwidth.BandwidthScheduler(option)
+        allocation1 = scheduler.register()
+        allocation2 = scheduler.register()
+        self.assertEqual(allocation1.rate, 300)
+        self.assertEqual(allocation2.rate, 300)
+
+
+class DropSupersededTest(unittest.TestCase):
+    def test_drop(self):
+        reports = [
+            make_report(_report.ReportType.START, 1),
+            make_report(_report.ReportType.PROGRESS, 1),
+            make_report(_report.ReportType.PROGRESS, 2),
+            make_report(_report.ReportType.PROGRESS, 1),
+            make_report(_report.ReportType.FINISH, 2)]
+        self.assertEqual(
+                [(report.type, report.job_id)
+                 for report in _report.drop_superseded(reports)],
+                [(_report.ReportType.START, 1),
+                 (_report.ReportType.PROGRESS, 1),
+                 (_report.ReportType.FINISH, 2)])
+
+
+class AsyncReportQueueTest(unittest.TestCase):
+    def test_bind(self):
+        report_queue = _report.AsyncReportQueue()
+        # buffered until the event loop is bound
+        report_queue.put(make_report(_report.ReportType.START, 1))
+        self.assertFalse(report_queue.is_bound())
+
+        async def run():
+            report_queue.bind(asyncio.get_event_loop())
+            # put from the download threads
+            report = make_report(_report.ReportType.PROGRESS, 1)
+            threads = [threading.Thread(
+                            target=report_queue.put,
+                            args=(report,))
+                       for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            reports = [await report_queue.get()]
+            reports.append(await asyncio.wait_for(report_queue.get(), 5.))
+            for thread in threads:
+                thread.join()
+            await asyncio.sleep(0)
+            return reports + report_queue.get_all_nowait()
+        reports = asyncio.run(run())
+        self.assertTrue(report_queue.is_bound())
+        self.assertEqual(
+                [report.type for report in reports],
+                [_report.ReportType.START,
+                 _report.ReportType.PROGRESS,
+                 _report.ReportType.PROGRESS])
+
+
+class ContentStoreTest(unittest.TestCase):
+    def test_add(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            store = _store.ContentStore(directory.joinpath('store'))
+            paths = []
+            for name in ('a.txt', 'b.txt'):
+                path = directory.joinpath(name)
+                path.write_text('foo')
+                paths.append(store.add(path, '0123456789'))
+                self.assertFalse(path.exists())
+            self.assertEqual(paths[0], paths[1])
+            self.assertEqual(paths[0].read_text(), 'foo')
+
+    def test_record(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = _store.ContentStore(pathlib.Path(directory))
+            record = _store.StoreRecord(
+                    url='http://example.com/file.txt',
+                    digest='0123456789',
+                    size=3)
+            store.save_record(record)
+            # stored file does not exist
+            self.assertIsNone(store.record(record.url))
+            store.object_path(record.digest).parent.mkdir(parents=True)
+            store.object_path(record.digest).write_text('foo')
+            self.assertEqual(store.record(record.url), record)
+
+    def test_header_digest(self):
+        digest = ('2c26b46b68ffc68ff99b453c1d304134'
+                  '13422d706483bfa0f98a5e886266e7ae')
+        encoded = 'LCa0a2j/xo/5m0U8HTBBNBNCLXBkg7+g+YpeiGJm564='
+        self.assertEqual(
+                _store.header_digest({
+                    'Repr-Digest': 'sha-256=:{0}:'.format(encoded)}),
+                digest)
+        self.assertEqual(
+                _store.header_digest({
+                    'Digest': 'SHA-256={0}'.format(encoded)}),
+                digest)
+        self.assertIsNone(_store.header_digest({}))
+
+
+class HttpCacheTest(unittest.TestCase):
+    def test_save_and_entry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            cache = _cache.HttpCache(directory.joinpath('cache'))
+            path = directory.joinpath('file.txt')
+            path.write_text('foo')
+            url = 'http://example.com/file.txt'
+            self.assertIsNone(cache.entry(url))
+            cache.save(url, {'ETag': '"abc"'}, 3, path)
+            entry = cache.entry(url)
+            self.assertIsNotNone(entry)
+            self.assertEqual(
+                    entry.request_header(),
+                    {'If-None-Match': '"abc"'})
+            # the cached file has been changed
+            path.write_text('foobar')
+            self.assertIsNone(cache.entry(url))
+
+    def test_no_validator(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            cache = _cache.HttpCache(directory.joinpath('cache'))
+            path = directory.joinpath('file.txt')
+            path.write_text('foo')
+            url = 'http://example.com/file.txt'
+            cache.save(url, {}, 3, path)
+            self.assertIsNone(cache.entry(url))
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_size(self):
+        option = _admission.AdmissionOption.option_list('').parse(
+                {'min_size': 10, 'max_size': 100})
+        directory = pathlib.Path('.')
+        option.check_header({}, 10, 0, directory)
+        option.check_header({}, None, 0, directory)
+        with self.assertRaises(DownloadRejected):
+            option.check_header({}, 9, 0, directory)
+        with self.assertRaises(DownloadRejected):
+            option.check_header({}, 101, 0, directory)
+
+    def test_type(self):
+        option = _admission.AdmissionOption.option_list('').parse(
+                {'allowed_types': ['image/*', 'text/plain']})
+        directory = pathlib.Path('.')
+        option.check_header(
+                {'Content-Type': 'image/png'}, None, 0, directory)
+        option.check_header(
+                {'Content-Type': 'Text/Plain; charset=utf-8'},
+                None, 0, directory)
+        with self.assertRaises(DownloadRejected):
+            option.check_header(
+                    {'Content-Type': 'text/html'}, None, 0, directory)
+
+    def test_disk_space(self):
+        option = _admission.AdmissionOption.option_list('').parse()
+        with self.assertRaises(DownloadRejected):
+            option.check_header({}, 2 ** 62, 0, pathlib.Path('.'))
+
+
+class JournalTest(unittest.TestCase):
+    def test_unfinished_jobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            option = _journal.JournalOption.option_list('').parse(
+                    {'path': pathlib.Path(directory).joinpath('journal')})
+            journal = _journal.Journal(option)
+            for job_id in (1, 2, 3):
+                journal.queued(
+                        job_id,
+                        'http://example.com/{0}'.format(job_id),
+                        pathlib.Path('{0}.txt'.format(job_id)),
+                        {'channel': 'C{0}'.format(job_id)})
+            journal.report(make_report(_report.ReportType.START, 1))
+            journal.report(make_report(_report.ReportType.START, 2))
+            journal.report(make_report(_report.ReportType.FINISH, 2))
+            # restart
+            journal = _journal.Journal(option)
+            records = journal.unfinished_jobs()
+            self.assertEqual(
+                    [(record.url, record.event) for record in records],
+                    [('http://example.com/1', _journal.JobEvent.STARTED),
+                     ('http://example.com/3', _journal.JobEvent.QUEUED)])
+            # compact
+            journal.requeued(records[0])
+            journal.compact()
+            self.assertEqual(
+                    [record.url for record in journal.unfinished_jobs()],
+                    ['http://example.com/3'])
+
+
+class PlaceFileTest(unittest.TestCase):
+    def test_move_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            destination = directory.joinpath('file.txt')
+            index = _place.SuffixIndex()
+            paths = []
+            for i in range(3):
+                source = directory.joinpath('source{0}'.format(i))
+                source.write_text(str(i))
+                paths.append(_place.move_file(source, destination, index))
+                self.assertFalse(source.exists())
+            self.assertEqual(
+                    [path.name for path in paths],
+                    ['file.txt', 'file_0.txt', 'file_1.txt'])
+            self.assertEqual(
+                    [path.read_text() for path in paths],
+                    ['0', '1', '2'])
+
+    def test_scan_after_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            for name in ('file.txt', 'file_0.txt', 'file_7.txt', 'file_3.md'):
+                directory.joinpath(name).write_text('')
+            source = directory.joinpath('source')
+            source.write_text('foo')
+            path = _place.move_file(
+                    source,
+                    directory.joinpath('file.txt'),
+                    _place.SuffixIndex())
+            self.assertEqual(path.name, 'file_8.txt')
+
+    def test_link_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            source = directory.joinpath('source')
+            source.write_text('foo')
+            destination = directory.joinpath('file.txt')
+            index = _place.SuffixIndex()
+            path = _place.link_file(source, destination, index)
+            self.assertEqual(path, destination)
+            self.assertTrue(source.exists())
+            # already linked
+            self.assertEqual(
+                    _place.link_file(source, destination, index),
+                    destination)
+            # different content
+            other = directory.joinpath('other')
+            other.write_text('bar')
+            self.assertEqual(
+                    _place.link_file(other, destination, index).name,
+                    'file_0.txt')
+
+
+class BatchTest(unittest.TestCase):
+    def test_message_urls(self):
+        entries = _batch.message_urls(
+                'download batch <http://example.com/a.txt>\n'
+                '<https://example.com/dir/b%20c.zip|b c.zip>'
+                ' <http://example.com/>')
+        self.assertEqual(
+                entries,
+                [_batch.BatchEntry('http://example.com/a.txt', 'a.txt'),
+                 _batch.BatchEntry('https://example.com/dir/b%20c.zip',
+                                   'b c.zip'),
+                 _batch.BatchEntry('http://example.com/', 'download')])
+
+    def test_parse_manifest_lines(self):
+        entries = _batch.parse_manifest(
+                'http://example.com/manifest',
+                '# files\n'
+                'http://example.com/a.txt\n'
+                '\n'
+                'http://example.com/b.txt ../c.txt\n')
+        self.assertEqual(
+                entries,
+                [_batch.BatchEntry('http://example.com/a.txt', 'a.txt'),
+                 _batch.BatchEntry('http://example.com/b.txt', 'c.txt')])
+
+    def test_parse_manifest_json(self):
+        entries = _batch.parse_manifest(
+                'http://example.com/manifest',
+                '{"files": ["http://example.com/a.txt",'
+                ' {"url": "http://example.com/b.txt", "name": "c.txt"}]}')
+        self.assertEqual(
+                entries,
+                [_batch.BatchEntry('http://example.com/a.txt', 'a.txt'),
+                 _batch.BatchEntry('http://example.com/b.txt', 'c.txt')])
+        for text in ('[1]', '{"urls": []}', '["file:///etc/passwd"]', '[x'):
+            with self.assertRaises(InvalidManifestError):
+                _batch.parse_manifest('http://example.com/manifest', text)
+
+    def test_progress(self):
+        batch = _batch.Batch(100, 'batch', 2)
+        batch.update(make_report(_report.ReportType.START, 1, file_size=10))
+        self.assertIsNone(batch.progress().file_size)
+        batch.update(make_report(
+                _report.ReportType.PROGRESS, 2, file_size=20, downloaded=5))
+        self.assertEqual(batch.progress().file_size, 30)
+        self.assertEqual(batch.progress().downloaded_size, 5)
+        self.assertFalse(batch.is_finished())
+        batch.update(make_report(
+                _report.ReportType.FINISH, 1, file_size=10, downloaded=10))
+        batch.update(make_report(_report.ReportType.ERROR, 2))
+        self.assertEqual(batch.progress().file_size, 10)
+        self.assertTrue(batch.is_finished())
+        self.assertEqual(len(batch.finished()), 1)
+        self.assertEqual(len(batch.failed()), 1)
+
+
+class PostProcessTest(unittest.TestCase):
+    def test_sha256(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            path.write_text('foo')
+            self.assertEqual(
+                    _postprocess.run_hook('sha256', path.as_posix()),
+                    'sha256:2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0'
+                    'f98a5e886266e7ae')
+
+    def test_extract(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            source = directory.joinpath('source')
+            source.mkdir()
+            source.joinpath('a.txt').write_text('foo')
+            archive = shutil.make_archive(
+                    directory.joinpath('archive').as_posix(),
+                    'gztar',
+                    root_dir=source.as_posix())
+            self.assertEqual(
+                    _postprocess.run_hook('extract', archive),
+                    'extracted 1 files to archive')
+            self.assertEqual(
+                    directory.joinpath('archive', 'a.txt').read_text(),
+                    'foo')
+            # the directory extracted before is not overwritten
+            directory.joinpath('archive', 'a.txt').write_text('bar')
+            self.assertEqual(
+                    _postprocess.run_hook('extract', archive),
+                    'extracted 1 files to archive_0')
+            self.assertEqual(
+                    directory.joinpath('archive', 'a.txt').read_text(),
+                    'bar')
+            # zip is unpacked without the tar filter
+            archive = shutil.make_archive(
+                    directory.joinpath('zipped').as_posix(),
+                    'zip',
+                    root_dir=source.as_posix())
+            self.assertEqual(
+                    _postprocess.run_hook('extract', archive),
+                    'extracted 1 files to zipped')
+            self.assertEqual(
+                    directory.joinpath('zipped', 'a.txt').read_text(),
+                    'foo')
+            with self.assertRaises(ValueError):
+                _postprocess.run_hook(
+                        'extract',
+                        source.joinpath('a.txt').as_posix())
+
+    def test_extract_unsafe(self):
+        # checked even if tarfile has no data filter (python < 3.8.17)
+        members = {
+                'parent': tarfile.TarInfo('../evil.txt'),
+                'absolute': tarfile.TarInfo('/tmp/evil.txt'),
+                'symlink': tarfile.TarInfo('link')}
+        members['symlink'].type = tarfile.SYMTYPE
+        members['symlink'].linkname = '/etc'
+        for name, member in members.items():
+            with self.subTest(name=name), \
+                    tempfile.TemporaryDirectory() as directory:
+                path = pathlib.Path(directory).joinpath('archive.tar')
+                with tarfile.open(path.as_posix(), 'w') as archive:
+                    archive.addfile(member, io.BytesIO(b''))
+                with self.assertRaises(ValueError):
+                    _postprocess.run_hook('extract', path.as_posix())
+                self.assertEqual(os.listdir(directory), ['archive.tar'])
+
+    def test_unknown_hook(self):
+        with self.assertRaises(ValueError):
+            _postprocess.run_hook('unknown', 'file.txt')
+
+    def test_shutdown(self):
+        option = _postprocess.PostProcessOption.option_list('').parse(
+                {'hooks': ['sha256'], 'max_workers': 1})
+        post_processor = _postprocess.PostProcessor(option)
+        future = concurrent.futures.Future()
+        with post_processor._lock:
+            post_processor._futures.add(future)
+        future.add_done_callback(post_processor._discard)
+        # pending hooks are cancelled without cancel_futures (python 3.8)
+        post_processor.shutdown()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(post_processor._futures, set())
+
+    def test_report_queue(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            path.write_text('foo')
+            option = _postprocess.PostProcessOption.option_list('').parse(
+                    {'hooks': ['sha256', 'unknown'], 'max_workers': 1})
+            post_processor = _postprocess.PostProcessor(option)
+            report_queue = queue.Queue()
+            _postprocess.PostProcessReportQueue(
+                    post_processor,
+                    report_queue).put(make_report(
+                            _report.ReportType.FINISH,
+                            1,
+                            saved_path=path))
+            try:
+                reports = [report_queue.get(timeout=30) for _ in range(3)]
+            finally:
+                post_processor.shutdown()
+            self.assertEqual(reports[0].type, _report.ReportType.FINISH)
+            results = {report.hook: report for report in reports[1:]}
+            self.assertEqual(
+                    results['sha256'].type,
+                    _report.ReportType.PROCESSED)
+            self.assertTrue(results['sha256'].result.startswith('sha256:'))
+            self.assertEqual(
+                    results['unknown'].type,
+                    _report.ReportType.PROCESS_ERROR)
+            self.assertIsInstance(results['unknown'].error, ValueError)
+
+
+class ThreadTest(unittest.TestCase):
+    def test_buffered(self):
+        body = os.urandom(300 * 1024)
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.bin': (body, {})}) as url:
+            path = pathlib.Path(directory).joinpath('file.bin')
+            reports = download_file(
+                    url + '/file.bin',
+                    path,
+                    buffered=True,
+                    max_buffer_size=128 * 1024)
+            self.assertEqual(reports[-1].type, _report.ReportType.FINISH)
+            self.assertEqual(path.read_bytes(), body)
+            self.assertEqual(os.listdir(directory), ['file.bin'])
+
+    def test_buffered_gzip(self):
+        # the decoded data is longer than the buffer
+        body = b'0123456789' * 100 * 1024
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.txt': (
+                        gzip.compress(body),
+                        {'Content-Encoding': 'gzip'})}) as url:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            reports = download_file(
+                    url + '/file.txt',
+                    path,
+                    buffered=True,
+                    max_buffer_size=64 * 1024)
+            self.assertEqual(reports[-1].type, _report.ReportType.FINISH)
+            self.assertEqual(path.read_bytes(), body)
+
+    def test_max_size_gzip(self):
+        # Content-Length is the size of the compressed body
+        body = b'0' * 1024 * 1024
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.txt': (
+                        gzip.compress(body),
+                        {'Content-Encoding': 'gzip'})}) as url:
+            path = pathlib.Path(directory).joinpath('file.txt')
+            reports = download_file(
+                    url + '/file.txt',
+                    path,
+                    admission={'max_size': 64 * 1024})
+            self.assertEqual(reports[-1].type, _report.ReportType.ERROR)
+            self.assertIsInstance(reports[-1].error, DownloadRejected)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_resume(self):
+        body = os.urandom(200 * 1024)
+        log = []
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.bin': (body, {'ETag': '"abc"'})},
+                             log) as url:
+            path = pathlib.Path(directory).joinpath('file.bin')
+            # interrupted at the half
+            _resume.partial_path(path).write_bytes(body[:100 * 1024])
+            _resume.save_state(path, _resume.ResumeState(
+                    url=url + '/file.bin',
+                    etag='"abc"',
+                    last_modified=None,
+                    file_size=len(body),
+                    downloaded_size=100 * 1024))
+            reports = download_file(url + '/file.bin', path, resume=True)
+            self.assertEqual(reports[-1].type, _report.ReportType.FINISH)
+            self.assertEqual(path.read_bytes(), body)
+            self.assertEqual(os.listdir(directory), ['file.bin'])
+        self.assertEqual(log[0]['Range'], 'bytes=102400-')
+        self.assertEqual(log[0]['If-Range'], '"abc"')
+        self.assertEqual(reports[0].progress.downloaded_size, 100 * 1024)
+
+    def test_resume_changed(self):
+        # If-Range does not match: the whole content is sent
+        body = os.urandom(200 * 1024)
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.bin': (body, {'ETag': '"def"'})}) as url:
+            path = pathlib.Path(directory).joinpath('file.bin')
+            _resume.partial_path(path).write_bytes(os.urandom(100 * 1024))
+            _resume.save_state(path, _resume.ResumeState(
+                    url=url + '/file.bin',
+                    etag='"abc"',
+                    last_modified=None,
+                    file_size=len(body),
+                    downloaded_size=100 * 1024))
+            reports = download_file(url + '/file.bin', path, resume=True)
+            self.assertEqual(reports[-1].type, _report.ReportType.FINISH)
+            self.assertEqual(path.read_bytes(), body)
+
+    def test_resume_claimed(self):
+        # another job downloading to the same path
+        body = os.urandom(100 * 1024)
+        with tempfile.TemporaryDirectory() as directory, \
+                local_server({'/file.bin': (body, {'ETag': '"abc"'})}) as url:
+            path = pathlib.Path(directory).joinpath('file.bin')
+            partial = _resume.partial_path(path)
+            partial.write_bytes(b'foo')
+            self.assertTrue(_resume.claim(path))
+            try:
+                reports = download_file(
+                        url + '/file.bin',
+                        path,
+                        resume=True)
+                # the partial file of the other job is not touched
+                self.assertEqual(partial.read_bytes(), b'foo')
+                self.assertFalse(_resume.state_path(path).exists())
+                self.assertTrue(_resume.lock_path(path).exists())
+            finally:
+                _resume.release(path)
+            self.assertEqual(reports[-1].type, _report.ReportType.FINISH)
+            self.assertEqual(path.read_bytes(), body)
+
+    def test_adaptive_chunk_size(self):
+        option = _thread.ThreadOption.option_list('').parse(
+                {'buffered': True, 'max_buffer_size': 256 * 1024})
+        # the 4th read is slow
+        response = types.SimpleNamespace(
+                headers={},
+                raw=FakeRaw(1024 * 1024, slow=[4]))
+        self.assertEqual(
+                [len(chunk) // 1024
+                 for chunk in _thread._iter_chunks(response, option)],
+                [64, 128, 256, 256, 128, 192])
+
+    def test_preallocate(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b'foo')
+            _thread._preallocate(file, 3, 1024)
+            if hasattr(os, 'posix_fallocate'):
+                self.assertEqual(os.fstat(file.fileno()).st_size, 1024)
+            # the space beyond the received data is discarded
+            file.truncate()
+            self.assertEqual(os.fstat(file.fileno()).st_size, 3)
+
+
+class ReportLoopTest(unittest.TestCase):
+    def test_error(self):
+        # an unexpected error does not stop the loop
+        action = make_action()
+        client = FakeClient(update_error=RuntimeError('broken'))
+        info = report_info()
+
+        async def run():
+            await action.update(client)
+            for job_id in (1, 2):
+                for type in (_report.ReportType.START,
+                             _report.ReportType.ERROR):
+                    action._report_queue.put(make_report(
+                            type,
+                            job_id,
+                            info=info,
+                            error=OSError('failed')))
+            await wait_until(lambda: len(client.calls) == 4)
+            self.assertFalse(action._report_task.done())
+            action.stop()
+        with self.assertLogs('slackbot.action._download', 'ERROR') as logs:
+            asyncio.run(run())
+        self.assertEqual(
+                [call[0] for call in client.calls],
+                ['post', 'update', 'post', 'update'])
+        self.assertIn('RuntimeError broken', logs.output[0])
+
+    def test_restart(self):
+        action = make_action()
+        client = FakeClient()
+
+        async def run():
+            await action.update(client)
+            # the task stopped by an unexpected error
+            action._report_task.cancel()
+            failed = asyncio.get_event_loop().create_future()
+            failed.set_exception(RuntimeError('broken'))
+            action._report_task = failed
+            action._report_queue.put(make_report(
+                    _report.ReportType.START,
+                    1,
+                    info=report_info()))
+            await action.update(client)
+            self.assertIsNot(action._report_task, failed)
+            # the reports in the queue are kept
+            await wait_until(lambda: len(client.calls) == 1)
+            action.stop()
+        with self.assertLogs('slackbot.action._download', 'ERROR') as logs:
+            asyncio.run(run())
+        self.assertIn('report task stopped', logs.output[0])
+
+
+class UpdateReportTest(unittest.TestCase):
+    def test_update_message(self):
+        action = make_action()
+        client = FakeClient()
+        start = make_report(_report.ReportType.START, 1, info=report_info())
+        progress = [make_report(
+                            _report.ReportType.PROGRESS,
+                            1,
+                            downloaded=size,
+                            info=report_info())
+                    for size in (10, 20, 30)]
+        finish = make_report(
+                _report.ReportType.FINISH,
+                1,
+                downloaded=30,
+                saved_path=pathlib.Path('file.txt'),
+                info=report_info())
+
+        async def run():
+            await action.update(client)
+            action._report_queue.put(start)
+            await wait_until(lambda: len(client.calls) == 1)
+            for report in progress:
+                action._report_queue.put(report)
+                await asyncio.sleep(0.02)
+            # coalesced until the update interval has passed
+            self.assertEqual(len(client.calls), 1)
+            await wait_until(lambda: len(client.calls) == 2)
+            action._report_queue.put(finish)
+            await wait_until(lambda: len(client.calls) == 3)
+            await asyncio.sleep(0.3)
+            action.stop()
+        asyncio.run(run())
+        header = _report_message(action.option, start)
+        self.assertEqual(
+                client.calls,
+                [('post', 'C1', header),
+                 ('update', 'C1', '1.0', '{0}\n{1}'.format(
+                        header,
+                        _report_message(action.option, progress[-1]))),
+                 ('update', 'C1', '1.0', '{0}\n{1}'.format(
+                        header,
+                        _report_message(action.option, finish)))])
+        self.assertEqual(action._live_messages, {})
+
+    def test_clear_progress(self):
+        # the pending progress is dropped by finish & error
+        for type in (_report.ReportType.FINISH, _report.ReportType.ERROR):
+            with self.subTest(type=type):
+                action = make_action()
+                client = FakeClient()
+
+                async def run():
+                    await action.update(client)
+                    action._report_queue.put(make_report(
+                            _report.ReportType.START,
+                            1,
+                            info=report_info()))
+                    await wait_until(lambda: len(client.calls) == 1)
+                    action._report_queue.put(make_report(
+                            _report.ReportType.PROGRESS,
+                            1,
+                            downloaded=10,
+                            info=report_info()))
+                    await asyncio.sleep(0.02)
+                    action._report_queue.put(make_report(
+                            type,
+                            1,
+                            downloaded=10,
+                            saved_path=pathlib.Path('file.txt'),
+                            error=OSError('failed'),
+                            info=report_info()))
+                    await wait_until(lambda: len(client.calls) == 2)
+                    await asyncio.sleep(0.3)
+                    action.stop()
+                asyncio.run(run())
+                self.assertEqual(
+                        [call[0] for call in client.calls],
+                        ['post', 'update'])
+                self.assertIn(
+                        ':finish' if type is _report.ReportType.FINISH
+                        else ':error OSError failed',
+                        client.calls[1][3])
+
+    def test_without_start(self):
+        # a new message if there is no start message to edit
+        action = make_action()
+        client = FakeClient()
+        error = make_report(
+                _report.ReportType.ERROR,
+                1,
+                error=OSError('failed'),
+                info=report_info())
+
+        async def run():
+            await action.update(client)
+            action._report_queue.put(error)
+            await wait_until(lambda: len(client.calls) == 1)
+            action.stop()
+        asyncio.run(run())
+        self.assertEqual(
+                client.calls,
+                [('post', 'C1', _report_message(action.option, error))])
+
+
+def make_report(
+        type, job_id, file_size=None, downloaded=0, saved_path=None,
+        info=None, error=None):
+    return _report.Report(
+            type=type,
+            info=info,
+            url='http://example.com/file.txt',
+            path=pathlib.Path('file.txt'),
+            temp_path=None,
+            final_url=None,
+            response_header=None,
+            progress=_progress.ProgressReport(
+                    file_size=file_size,
+                    downloaded_size=downloaded,
+                    elapsed_time=0.,
+                    speed=None),
+            saved_path=saved_path,
+            error=error,
+            job_id=job_id)
+
+
+def make_action(**option):
+    data = {'channel': 'general', 'update_interval': 0.2}
+    data.update(option)
+    action = Download(
+            'download',
+            Download.option_list('download').parse(data))
+    action._outbox = Outbox(OutboxOption.option_list('outbox').parse(
+            {'interval': 0.01, 'merge_window': 0.}))
+    return action
+
+
+def report_info():
+    return ReportInfo(channel=Channel({'id': 'C1', 'name': 'general'}))
+
+
+async def wait_until(predicate, timeout=5.):
+    loop = asyncio.get_event_loop()
+    end = loop.time() + timeout
+    while not predicate():
+        if loop.time() > end:
+            raise AssertionError('timeout')
+        await asyncio.sleep(0.01)
+
+
+class FakeResponse(dict):
+    def validate(self):
+        return self
+
+
+class FakeClient:
+    # records chat.postMessage & chat.update in order
+    def __init__(self, update_error=None):
+        self.calls = []
+        self.update_error = update_error
+
+    async def chat_postMessage(self, channel, text, **params):
+        self.calls.append(('post', channel, text))
+        return FakeResponse(ok=True, ts='{0}.0'.format(len(self.calls)))
+
+    async def chat_update(self, channel, ts, text):
+        self.calls.append(('update', channel, ts, text))
+        if self.update_error is not None:
+            error, self.update_error = self.update_error, None
+            raise error
+        return FakeResponse(ok=True, ts=ts)
+
+
+class FakeRaw:
+    # instant reads except for the slow ones
+    def __init__(self, size, slow=()):
+        self.size = size
+        self.slow = set(slow)
+        self.count = 0
+
+    def readinto(self, buffer):
+        self.count += 1
+        if self.count in self.slow:
+            time.sleep(0.25)
+        received_size = min(len(buffer), self.size)
+        self.size -= received_size
+        return received_size
+
+
+@contextlib.contextmanager
+def local_server(files, log=None):
+    # {path: (body, header)} with Range & If-Range
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body, header = files[self.path]
+            if log is not None:
+                log.append(dict(self.headers))
+            match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if (match
+                    and self.headers.get('If-Range', None)
+                    in (None, header.get('ETag', None))):
+                start = int(match.group(1))
+                self.send_response(206)
+                self.send_header(
+                        'Content-Range',
+                        'bytes {0}-{1}/{2}'.format(
+                                start,
+                                len(body) - 1,
+                                len(body)))
+                body = body[start:]
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in header.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def download_file(url, path, **option):
+    report_queue = queue.Queue()
+    _thread._download(
+            url,
+            path,
+            None,
+            report_queue,
+            option=_thread.ThreadOption.option_list('').parse(option))
+    reports = []
+    while not report_queue.empty():
+        reports.append(report_queue.get_nowait())
+    return reports
+
+
+def make_state(etag=None, last_modified=None):
+    return _resume.ResumeState(
+            url='http://example.com/file.txt',
+            etag=etag,
+            last_modified=last_modified,
+            file_size=200,
+            downloaded_size=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+import slack
+from slackbot import Outbox, OutboxOption
+
+
+class OutboxTest(unittest.TestCase):
+    def make_outbox(self, **option):
+        data = {'interval': 0.05, 'merge_window': 0.02}
+        data.update(option)
+        return Outbox(OutboxOption.option_list('outbox').parse(data))
+
+    def test_merge(self):
+        outbox = self.make_outbox()
+        client = FakeClient()
+
+        async def post():
+            futures = [outbox.post(client, 'C1', 'a'),
+                       outbox.post(client, 'C1', 'b'),
+                       outbox.post(client, 'C1', 'c', {'username': 'x'}),
+                       outbox.post(client, 'C1', 'd', coalesce=False),
+                       outbox.post(client, 'C2', 'e')]
+            return await asyncio.gather(*futures)
+        ts = asyncio.run(post())
+        # merged messages share the ts
+        self.assertEqual(ts[0], ts[1])
+        self.assertEqual(len(set(ts)), 4)
+        self.assertEqual(
+                [(channel, text) for channel, text, _, _ in client.posts],
+                [('C1', 'a\nb'), ('C2', 'e'), ('C1', 'c'), ('C1', 'd')])
+        self.assertEqual(client.posts[2][2], {'username': 'x'})
+        # paced in each channel
+        times = [time for channel, _, _, time in client.posts
+                 if channel == 'C1']
+        for previous, current in zip(times, times[1:]):
+            self.assertGreaterEqual(current - previous, 0.04)
+
+    def test_max_length(self):
+        outbox = self.make_outbox(max_length=3)
+        client = FakeClient()
+
+        async def post():
+            await asyncio.gather(*(outbox.post(client, 'C1', text)
+                                   for text in ('a', 'b', 'c')))
+        asyncio.run(post())
+        self.assertEqual(
+                [text for _, text, _, _ in client.posts],
+                ['a\nb', 'c'])
+
+    def test_error(self):
+        outbox = self.make_outbox()
+        client = FakeClient(error='channel_not_found')
+
+        async def post():
+            await outbox.post(client, 'C1', 'a')
+        with self.assertRaises(slack.errors.SlackApiError):
+            asyncio.run(post())
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def validate(self):
+        if not self.data['ok']:
+            raise slack.errors.SlackApiError(self.data['error'], self)
+        return self
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.posts = []
+        self.error = error
+
+    async def chat_postMessage(self, channel, text, **params):
+        if self.error is not None:
+            return FakeResponse({'ok': False, 'error': self.error})
+        self.posts.append(
+                (channel, text, params, asyncio.get_event_loop().time()))
+        return FakeResponse({
+                'ok': True,
+                'channel': channel,
+                'ts': '{0}.000000'.format(len(self.posts))})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+import slack
+from slackbot import RateLimiter, RateLimits
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_aimd(self):
+        limiter = RateLimiter(rate=1., max_rate=2., min_rate=0.5)
+        limiter.success()
+        self.assertAlmostEqual(limiter.rate, 1.1)
+        for _ in range(20):
+            limiter.success()
+        self.assertEqual(limiter.rate, 2.)
+
+        async def rate_limited():
+            limiter.rate_limited(0.)
+            limiter.rate_limited(0.)
+            limiter.rate_limited(0.)
+        asyncio.run(rate_limited())
+        self.assertEqual(limiter.rate, 0.5)
+
+    def test_acquire(self):
+        limiter = RateLimiter(rate=100., max_rate=100.)
+
+        async def acquire():
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            for _ in range(5):
+                await limiter.acquire()
+            return loop.time() - start
+        self.assertGreaterEqual(asyncio.run(acquire()), 0.035)
+
+
+class RateLimitsTest(unittest.TestCase):
+    def test_retry(self):
+        rate_limits = RateLimits(rate=1000., max_rate=1000.)
+        calls = []
+
+        async def api(**params):
+            calls.append(params)
+            if len(calls) == 1:
+                raise slack.errors.SlackApiError(
+                        'ratelimited',
+                        FakeResponse(429, {'Retry-After': '0.01'}))
+            return FakeResponse(200, {})
+
+        response = asyncio.run(rate_limits.call('api.test', api, foo=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(calls, [{'foo': 1}, {'foo': 1}])
+        self.assertEqual(rate_limits.limiter('api.test').rate, 550.)
+
+    def test_error(self):
+        rate_limits = RateLimits(rate=1000., max_rate=1000.)
+
+        async def api(**params):
+            raise slack.errors.SlackApiError(
+                    'not_authed',
+                    FakeResponse(200, {}))
+
+        with self.assertRaises(slack.errors.SlackApiError):
+            asyncio.run(rate_limits.call('api.test', api))
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+    def validate(self):
+        return self
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import re
+import unittest
+from slackbot import Channel, User, tokenize
+from slackbot.action import response
+from slackbot.action._response import CallType, ResponseOption
+
+
+class MatcherTest(unittest.TestCase):
+    def test_substring(self):
+        matcher = response.SubstringMatcher(
+                [('he', 0), ('she', 1), ('his', 2), ('hers', 3)])
+        self.assertEqual(matcher.search('ushers'), {0, 1, 3})
+        self.assertEqual(matcher.search('this'), {2})
+        self.assertEqual(matcher.search('xyz'), set())
+
+    def test_regex(self):
+        matcher = response.RegexMatcher(
+                [(r'b+', 2), (r'^a', 0), (r'(?P<n>[0-9]+)', 1)])
+        self.assertEqual(matcher.search('abb'), 0)
+        self.assertEqual(matcher.search('xbb1'), 1)
+        self.assertEqual(matcher.search('xbb'), 2)
+        self.assertIsNone(matcher.search('xyz'))
+
+    def test_regex_groups(self):
+        # the same group name & a numbered backreference
+        matcher = response.RegexMatcher(
+                [(r'(?P<n>x)', 0), (r'(?P<n>y)', 1), (r'(.)\1', 2)])
+        self.assertEqual(matcher.search('y'), 1)
+        self.assertEqual(matcher.search('aa'), 2)
+        self.assertEqual(matcher.search('xaa'), 0)
+
+
+class PatternTest(unittest.TestCase):
+    def test_match(self):
+        pattern = parse_pattern([
+                {'call': ['ping', 'hello'], 'response': 'pong'},
+                {'call': 'lunch', 'response': 'ok', 'type': 'substring'},
+                {'call': r'^(?P<n>[0-9]+)$', 'response': 'n',
+                 'type': 'regex'},
+                {'call': 'ping', 'response': 'pong!'}])
+        self.assertEqual(len(pattern), 4)
+        self.assertIs(pattern[2].type, CallType.REGEX)
+        self.assertEqual(
+                [x.response for x in pattern.match('ping')],
+                [('pong',), ('pong!',)])
+        self.assertEqual(
+                [x.response for x in pattern.match('lunch time?')],
+                [('ok',)])
+        self.assertEqual(
+                [x.response for x in pattern.match('12')],
+                [('n',)])
+        self.assertEqual(pattern.match('ping pong'), [])
+
+    def test_invalid(self):
+        with self.assertRaises(SystemExit):
+            parse_pattern({'call': 'x', 'response': 'y', 'type': 'unknown'})
+        with self.assertRaises(SystemExit):
+            parse_pattern({'call': '(', 'response': 'y', 'type': 'regex'})
+
+
+class TemplateTest(unittest.TestCase):
+    def context(self, text='hello', match=None):
+        return response.TemplateContext(
+                user=User({'id': 'U1', 'name': 'alice'}),
+                channel=Channel({'id': 'C1', 'name': 'general'}),
+                text=text,
+                match=match,
+                time=datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+    def test_render(self):
+        template = response.Template(
+                '{mention} {user}@{channel}({channel_id}) {time:%H:%M} {{x}}')
+        self.assertFalse(template.uses_match)
+        self.assertEqual(
+                template.render(self.context()),
+                '<@U1> alice@general(C1) 03:04 {x}')
+        self.assertEqual(
+                response.Template('{user:>6}|').render(self.context()),
+                ' alice|')
+        # no placeholders
+        self.assertEqual(
+                response.Template('{{pong}}').render(self.context()),
+                '{pong}')
+
+    def test_escape(self):
+        # '<!channel>' typed by the user is decoded by tokenize
+        text = ''.join(
+                token.text for token in tokenize('&lt;!channel&gt; <@U2>'))
+        template = response.Template('{mention} you said: {text}')
+        self.assertEqual(
+                template.render(self.context(text=text)),
+                '<@U1> you said: &lt;!channel&gt; &lt;@U2&gt;')
+        match = re.search(r'say (?P<word>.+)', 'say <!here>')
+        template = response.Template(
+                '{word} {user}',
+                groups={0, 'word'})
+        user = User({'id': 'U1', 'name': '<!here>'})
+        self.assertEqual(
+                template.render(self.context(match=match)._replace(user=user)),
+                '&lt;!here&gt; &lt;!here&gt;')
+
+    def test_groups(self):
+        match = re.search(r'(?P<name>\w+) (\d+)', 'buy apple 3')
+        template = response.Template(
+                '{name} x {2} ({0})',
+                groups={0, 1, 2, 'name'})
+        self.assertTrue(template.uses_match)
+        self.assertEqual(
+                template.render(self.context(match=match)),
+                'apple x 3 (apple 3)')
+        self.assertEqual(template.render(self.context()), ' x  ()')
+
+    def test_invalid(self):
+        for source in ('{unknown}', '{1}', '{user!r}', '{', '{}'):
+            with self.assertRaises(ValueError):
+                response.Template(source)
+
+    def test_pattern(self):
+        pattern = parse_pattern([
+                {'call': r'^roll (?P<count>[0-9]+)$',
+                 'response': '{user} rolls {count}',
+                 'type': 'regex'}])
+        context = self.context(text='roll 3')
+        template = pattern[0].templates[0]
+        self.assertEqual(
+                template.render(context._replace(
+                        match=pattern[0].search('roll 3'))),
+                'alice rolls 3')
+        with self.assertRaises(SystemExit):
+            parse_pattern({'call': 'x', 'response': '{count}'})
+
+
+class CooldownTest(unittest.TestCase):
+    def make_cooldown(self, **option):
+        return response.Cooldown(
+                response.CooldownOption.option_list('cooldown').parse(option))
+
+    def test_user(self):
+        cooldown = self.make_cooldown(user={'period': 10, 'count': 2})
+        self.assertTrue(cooldown.acquire('U1', 'C1', 'p', now=0.))
+        self.assertTrue(cooldown.acquire('U1', 'C1', 'p', now=1.))
+        self.assertFalse(cooldown.acquire('U1', 'C2', 'p', now=2.))
+        self.assertTrue(cooldown.acquire('U2', 'C1', 'p', now=2.))
+        # the first response leaves the window
+        self.assertTrue(cooldown.acquire('U1', 'C1', 'p', now=10.5))
+        self.assertEqual(
+                cooldown.metrics,
+                {'responded': 4, 'suppressed': 1, 'suppressed_user': 1})
+
+    def test_channel_and_pattern(self):
+        cooldown = self.make_cooldown(channel=5, pattern=60)
+        self.assertTrue(cooldown.acquire('U1', 'C1', 'p', now=0.))
+        self.assertFalse(cooldown.acquire('U2', 'C1', 'q', now=1.))
+        self.assertTrue(cooldown.acquire('U2', 'C1', 'q', now=6.))
+        self.assertFalse(cooldown.acquire('U3', 'C1', 'p', now=12.))
+        self.assertTrue(cooldown.acquire('U3', 'C2', 'p', now=12.))
+        self.assertEqual(cooldown.metrics['suppressed_pattern'], 1)
+        self.assertEqual(cooldown.metrics['suppressed_channel'], 1)
+
+    def test_report(self):
+        cooldown = self.make_cooldown(user=10, report_interval=60)
+        cooldown.acquire('U1', 'C1', 'p')
+        self.assertIsNone(cooldown.report())
+        metrics = cooldown.report(now=cooldown._report_time + 60)
+        self.assertEqual(metrics, {'responded': 1})
+        self.assertEqual(cooldown.metrics, {})
+
+    def test_cache(self):
+        cache = response.TTLCache(max_entries=2)
+        for i in range(3):
+            cache.put(i, collections.deque([i]), expire=10. + i, now=i)
+        # bounded
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0, now=3.))
+        # expired
+        self.assertIsNone(cache.get(1, now=11.))
+        cache.evict(now=11.5)
+        self.assertEqual(len(cache), 1)
+
+
+def parse_pattern(pattern):
+    return ResponseOption.option_list('Response').parse(
+            {'pattern': pattern}).pattern
+
+
+if __name__ == '__main__':
+    unittest.main()